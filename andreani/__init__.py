@@ -1 +1,54 @@
-from .andreani import API, APIError, CodigoPostalInvalido
+'''
+Cliente de los servicios del webservice de Andreani.
+
+Las excepciones se importan junto con el paquete. El resto de los nombres
+exportados se importan al usarse por primera vez, de modo que importar el
+paquete no carga suds.
+'''
+import importlib
+
+from .excepciones import APIError, CodigoPostalInvalido, EnvioIncierto
+
+# nombres exportados que se importan al usarse: nombre -> modulo
+_PEREZOSOS = {
+    'API': 'andreani',
+    'Evento': 'andreani',
+    'AsyncAPI': 'asincrono',
+    'TransporteAsincrono': 'asincrono',
+    'CacheCodigosPostales': 'cache',
+    'CacheCotizaciones': 'cache',
+    'CacheTTL': 'cache',
+    'CacheWSDL': 'cache',
+    'Diario': 'diario',
+    'Metricas': 'metricas',
+    'Seguimiento': 'seguimiento',
+    'IndiceSucursales': 'sucursales',
+    'TransporteGrabador': 'transporte',
+    'TransportePool': 'transporte',
+    'TransporteReproductor': 'transporte',
+}
+# submodulos accesibles como atributos del paquete
+_MODULOS = ('andreani', 'asincrono', 'cache', 'conversion', 'diario',
+            'lector', 'lotes', 'metricas', 'seguimiento', 'sucursales',
+            'transporte', 'utiles', 'validator')
+
+__all__ = ['APIError', 'CodigoPostalInvalido', 'EnvioIncierto'] + sorted(
+    _PEREZOSOS)
+
+
+def __getattr__(nombre):
+    if nombre in _PEREZOSOS:
+        modulo = importlib.import_module('.' + _PEREZOSOS[nombre], __name__)
+        valor = getattr(modulo, nombre)
+    elif nombre in _MODULOS:
+        valor = importlib.import_module('.' + nombre, __name__)
+    else:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, nombre))
+    # las siguientes consultas no pasan por __getattr__
+    globals()[nombre] = valor
+    return valor
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_PEREZOSOS) | set(_MODULOS))
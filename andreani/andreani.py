@@ -1,14 +1,26 @@
 '''
 Implementa los servicios ofrecidos por el webservice de andreani.
 '''
-import string
+import collections
+import contextlib
+import functools
+import threading
+import time
 
+from . import conversion
+from . import lector
+from . import lotes
 from . import validator
+from .excepciones import APIError, CodigoPostalInvalido
+from .utiles import reintentable
 
 import suds.client
+import suds.plugin
+import suds.transport
 import suds.wsse
 from suds.bindings import binding
-from suds.sudsobject import asdict
+from suds.options import Options
+from suds.transport.https import HttpAuthenticated
 
 
 class API(object):
@@ -18,6 +30,29 @@ class API(object):
     '''
 
     DEBUG = False
+    # cache persistente de wsdl parseados (ver cache.CacheWSDL). Debe
+    # configurarse antes de la primer peticion
+    CACHE_WSDL = None
+    # cache de cotizaciones (ver cache.CacheCotizaciones)
+    CACHE_COTIZACIONES = None
+    # cache de codigos postales (ver cache.CacheCodigosPostales)
+    CACHE_CODIGOS_POSTALES = None
+    # diario de altas de envios (ver diario.Diario)
+    DIARIO = None
+    # reporte en el que se buscan las altas inciertas de cada operacion (ver
+    # conciliar_altas)
+    _REPORTES_ALTAS = {
+        'confirmar_compra': 'reporte_envios_pendientes_impresion',
+        'confirmar_compra_datos_impresion':
+            'reporte_envios_pendientes_ingreso',
+    }
+    # si es verdadero, las consultas de sucursales, trazabilidad y reportes
+    # leen directamente el XML de la respuesta, sin armar los objetos de suds
+    XML_DIRECTO = False
+    # funciones que reciben un Evento con los tiempos de cada peticion SOAP
+    # al terminar. Si tienen un metodo iniciar, tambien reciben el evento al
+    # comenzar la peticion (ver metricas.Metricas)
+    OYENTES = ()
     _url_staging = "https://www.e-andreani.com/CasaStaging/eCommerce/%s?wsdl"
     # tuplas (wsdl, metodo, soap_version)
     _URL = {
@@ -77,10 +112,23 @@ class API(object):
                 1.1),
         },
     }
+    # clientes suds ya parseados, compartidos por todas las operaciones e
+    # instancias de la API. La clave es la url del wsdl
+    _clientes = {}
+    _clientes_lock = threading.Lock()
+    # opciones de suds aplicadas a los clientes de cada instancia
+    _opciones_cliente = {}
 
-    def __init__(self, username, password, cliente):
+    def __init__(self, username, password, cliente, transporte=None):
         '''
         Inicializa datos del objeto
+
+        args
+        --------
+        transporte -- suds.transport.Transport: Transporte HTTP utilizado en
+                      todas las peticiones (por ejemplo
+                      transporte.TransportePool). Si no se indica se usa el
+                      de suds.
         '''
         # guardo token generado como atributo del objeto
         token = suds.wsse.UsernameToken(username, password)
@@ -88,6 +136,23 @@ class API(object):
         self.security.tokens.append(token)
         # numero de cliente
         self.cliente = cliente
+        # transporte compartido por todas las operaciones
+        self.transporte = transporte
+        # clientes suds configurados para esta instancia, por wsdl y metodo
+        self.__clientes = {}
+
+    def _ejecutar(self, peticion, procesar, **kwargs):
+        '''
+        Realiza la peticion SOAP y devuelve el resultado procesado con la
+        funcion dada.
+
+        Las subclases pueden redefinirlo para cambiar la forma en que se
+        envian las peticiones (ver asincrono.AsyncAPI).
+        '''
+        if not self.OYENTES:
+            return procesar(self.__soap(peticion, **kwargs))
+        # con oyentes, cada fase de la peticion se mide por separado
+        return self.__enviar(peticion, self._leer_suds(procesar), **kwargs)
 
     def __soap(self, peticion, **kwargs):
         '''
@@ -95,31 +160,211 @@ class API(object):
         '''
         try:
             # obtengo url del wsdl, nombre de metodo y version de soap
-            wsdl, metodo, version = self.__get_wsdl(peticion)
-            soap = suds.client.Client(wsdl)
-            metodo = getattr(soap.service, metodo)
-            soap.set_options(wsse=self.security)
-            # resguardo namespace del envelope por si lo modifico
-            envns = binding.envns
-            if version == 1.2:
-                # modifico namespace del envoltorio soap
-                binding.envns = ('SOAP-ENV',
-                                 'http://www.w3.org/2003/05/soap-envelope')
-                # configuro content-type de la peticion
-                soap.set_options(headers={'Content-Type':
-                                      'application/soap+xml;charset=utf-8;' +
-                                      'action=%s' %
-                                      metodo.method.soap.action})
-            try:
-                return metodo(**kwargs)
-            finally:
-                # restauro namespace del envelope
-                binding.envns = envns
+            wsdl, metodo, version = self._get_wsdl(peticion)
+            soap = self._get_cliente(wsdl, metodo, version)
+            return getattr(soap.service, metodo)(**kwargs)
         except suds.WebFault as e:
-            text = e.fault.Reason.Text
-            if text == "Codigo postal es invalido":
-                raise CodigoPostalInvalido from e
-            raise APIError(text) from e
+            raise self._error(e) from e
+
+    def _ejecutar_xml(self, peticion, procesar, **kwargs):
+        '''
+        Realiza la peticion SOAP y devuelve el resultado de procesar con la
+        funcion dada el XML de la respuesta, sin que suds arme sus objetos.
+
+        La funcion recibe (status, reason, body, tipo), donde tipo es el
+        lector.Tipo del resultado del metodo.
+        '''
+        return self.__enviar(peticion, self._leer_xml(procesar), **kwargs)
+
+    def _leer_suds(self, procesar):
+        '''
+        Devuelve una funcion que lee la respuesta con suds y la procesa con
+        la funcion dada (ver __enviar).
+        '''
+        def leer(evento, metodo, contexto, status, reason, body):
+            try:
+                respuesta = contexto.process_reply(body, status, reason)
+            except suds.WebFault as e:
+                raise self._error(e) from e
+            evento.fase('lectura')
+            resultado = procesar(respuesta)
+            evento.fase('conversion')
+            return resultado
+        return leer
+
+    @staticmethod
+    def _leer_xml(procesar):
+        '''
+        Devuelve una funcion que procesa el XML de la respuesta con la
+        funcion dada (ver __enviar y _ejecutar_xml).
+        '''
+        def leer(evento, metodo, contexto, status, reason, body):
+            status, reason, body = _respuesta(status, reason, body)
+            resultado = procesar(status, reason, body,
+                                 lector.tipo_resultado(metodo))
+            evento.fase('lectura')
+            return resultado
+        return leer
+
+    def __enviar(self, peticion, leer, **kwargs):
+        '''
+        Arma el envoltorio con suds, lo envia con el transporte del cliente
+        y devuelve el resultado de leer la respuesta con la funcion dada, que
+        recibe (evento, metodo de suds, contexto de suds, status, reason,
+        body).
+        '''
+        wsdl, metodo, version = self._get_wsdl(peticion)
+        with self._medir(peticion, metodo, version) as evento:
+            self._cliente(wsdl, self.transporte)
+            evento.fase('wsdl')
+            # suds solo arma el envoltorio, la peticion se envia con su
+            # transporte
+            soap = self._get_cliente(wsdl, metodo, version, enviar=False)
+            evento.fase('cliente')
+            operacion = getattr(soap.service, metodo)
+            contexto = operacion(**kwargs)
+            evento.fase('armado')
+            request = suds.transport.Request(operacion.method.location,
+                                             contexto.envelope)
+            # sin timeout, igual que suds, para que decida el transporte
+            request.headers = _cabeceras(soap, operacion.method)
+            try:
+                reply = soap.options.transport.send(request)
+                status, reason, body = reply.code, None, reply.message
+            except suds.transport.TransportError as e:
+                # los faults llegan con status 500
+                status, reason = e.httpcode, str(e)
+                body = e.fp.read() if e.fp is not None else b''
+            evento.red(contexto.envelope, body)
+            return leer(evento, operacion.method, contexto, status, reason,
+                        body)
+
+    @contextlib.contextmanager
+    def _medir(self, peticion, metodo, version):
+        '''
+        Devuelve un Evento para registrar los tiempos de una peticion y, al
+        terminar, lo informa a los OYENTES. Sin oyentes, el evento no
+        registra nada.
+        '''
+        if not self.OYENTES:
+            yield _SIN_EVENTO
+            return
+        evento = Evento(peticion, metodo, version)
+        for oyente in self.OYENTES:
+            iniciar = getattr(oyente, 'iniciar', None)
+            if iniciar is not None:
+                iniciar(evento)
+        try:
+            yield evento
+        except Exception as e:
+            evento.finalizar(e)
+            self.__notificar(evento)
+            raise
+        evento.finalizar()
+        self.__notificar(evento)
+
+    def __notificar(self, evento):
+        for oyente in self.OYENTES:
+            oyente(evento)
+
+    def _cacheado(self, cache, clave, calcular):
+        '''
+        Devuelve el valor de la clave en la cache dada, calculandolo si no
+        esta.
+        '''
+        return cache.obtener(clave, calcular)
+
+    def __validar_codigo_postal(self, codigo_postal):
+        '''
+        Lanza CodigoPostalInvalido si la cache de codigos postales sabe que
+        el codigo dado es invalido.
+        '''
+        cache = self.CACHE_CODIGOS_POSTALES
+        if codigo_postal and cache is not None and cache.invalido(
+                codigo_postal):
+            raise CodigoPostalInvalido()
+
+    @staticmethod
+    def _error(fault):
+        '''
+        Devuelve la excepcion de la API correspondiente al fault dado, de
+        SOAP 1.2 (Reason/Text) o SOAP 1.1 (faultstring).
+        '''
+        razon = getattr(fault.fault, 'Reason', None)
+        if razon is None:
+            return API._error_texto(getattr(fault.fault, 'faultstring', None))
+        return API._error_texto(razon.Text)
+
+    @staticmethod
+    def _error_texto(text):
+        '''
+        Devuelve la excepcion de la API correspondiente al texto de un fault.
+        '''
+        if text == "Codigo postal es invalido":
+            return CodigoPostalInvalido()
+        return APIError(text)
+
+    def _get_cliente(self, wsdl, metodo, version, enviar=True):
+        '''
+        Devuelve el cliente suds configurado para el metodo dado.
+
+        Cada instancia guarda un clon por metodo con las credenciales, la
+        version de soap y las cabeceras ya configuradas. Como las peticiones
+        no modifican el clon, puede usarse desde varios hilos a la vez.
+
+        Si enviar es falso, el cliente solo arma el envoltorio de la
+        peticion.
+        '''
+        clave = (wsdl, metodo, enviar)
+        try:
+            return self.__clientes[clave]
+        except KeyError:
+            pass
+        # el clon comparte el wsdl parseado pero tiene sus propias opciones
+        soap = self._cliente(wsdl, self.transporte).clone()
+        # suds toma wsse de las opciones del wsdl, que son compartidas por
+        # todos los clones. Las credenciales se agregan con un plugin
+        plugins = [WssePlugin(self.security)]
+        if self.transporte is not None:
+            # suds enlaza las opciones del transporte a las de un unico
+            # cliente, por lo que cada clon recibe su propio delegado
+            soap.set_options(transport=_Transporte(self.transporte))
+        if version == 1.2:
+            action = getattr(soap.service, metodo).method.soap.action
+            # armo el envoltorio soap 1.2 y configuro content-type de la
+            # peticion
+            plugins.append(Soap12Plugin())
+            soap.set_options(headers={'Content-Type':
+                                      'application/soap+xml;charset=utf-8;' +
+                                      'action=%s' % action})
+        soap.set_options(plugins=plugins, **self._opciones_cliente)
+        if not enviar:
+            soap.set_options(nosend=True)
+        # si dos hilos lo crean a la vez, ambos clones son equivalentes
+        return self.__clientes.setdefault(clave, soap)
+
+    @classmethod
+    def _cliente(cls, wsdl, transporte=None):
+        '''
+        Devuelve el cliente suds para el wsdl dado.
+
+        El wsdl y sus esquemas se descargan y parsean una unica vez por
+        proceso, luego el cliente se reutiliza en cada peticion. Si se indica
+        un transporte, se descargan con el.
+        '''
+        try:
+            return cls._clientes[wsdl]
+        except KeyError:
+            pass
+        with cls._clientes_lock:
+            # otro hilo pudo haberlo creado mientras esperaba el lock
+            if wsdl not in cls._clientes:
+                opciones = (cls.CACHE_WSDL.opciones()
+                            if cls.CACHE_WSDL is not None else {})
+                if transporte is not None:
+                    opciones['transport'] = _Transporte(transporte)
+                cls._clientes[wsdl] = ClienteSoap(wsdl, **opciones)
+            return cls._clientes[wsdl]
 
     def consultar_sucursales(self,
                              codigo_postal=None,
@@ -129,6 +374,7 @@ class API(object):
         Devuelve una lista de sucursales Andreani habilitadas para la entrega
         por mostrador.
         '''
+        self.__validar_codigo_postal(codigo_postal)
         # configuro parametros de la consulta
         if codigo_postal or localidad or provincia:
             consulta = {'CodigoPostal': codigo_postal,
@@ -138,10 +384,18 @@ class API(object):
             # XXX: tengo que forzar enviar null porque el webservice lanza una
             # excepcion si el parametro <consulta> no esta en la peticion
             consulta = {'CodigoPostal': suds.null()}
+        if self.XML_DIRECTO:
+            return self.__leer('consultar_sucursales',
+                               lambda r: list(r.values())[0] if r else [],
+                               consulta=consulta)
+
+        def procesar(r):
+            # devuelvo lista de sucursales
+            return ([self.__to_dict(sucursal) for sucursal in r[0]]
+                    if r else [])
         # realizo la consulta y obtengo el resultado
-        r = self.__soap('consultar_sucursales', consulta=consulta)
-        # devuelvo lista de sucursales
-        return ([self.__to_dict(sucursal) for sucursal in r[0]] if r else [])
+        return self._ejecutar('consultar_sucursales', procesar,
+                              consulta=consulta)
 
     @validator.gt("peso", 0)
     @validator.gt("volumen", 0)
@@ -165,6 +419,12 @@ class API(object):
         peso -- float: Expresado en gramos
         volumen -- float: Expresados en centimetros cúbicos
         '''
+        self.__validar_codigo_postal(cp_destino)
+        cache = self.CACHE_COTIZACIONES
+        if cache is not None:
+            clave, peso, volumen = cache.clave(self.cliente, peso, volumen,
+                                               cp_destino, contrato,
+                                               sucursal_retiro)
         # configuro parametros de la peticion
         parametros = {
             'CPDestino': cp_destino,
@@ -174,9 +434,38 @@ class API(object):
             'SucursalRetiro': sucursal_retiro,
             'Volumen': volumen,
         }
+
+        def cotizar():
+            return self._ejecutar("cotizar_envio", self.__a_dict,
+                                  cotizacionEnvio=parametros)
         # obtengo resultado
-        response = self.__soap("cotizar_envio", cotizacionEnvio=parametros)
-        return self.__to_dict(response) if response else None
+        if cache is None:
+            return cotizar()
+        return self._cacheado(cache, clave, cotizar)
+
+    def cotizar_envios(self, cotizaciones, concurrencia=10, ordenado=True):
+        '''
+        Cotiza un lote de envíos de forma concurrente.
+
+        Genera tuplas (cotizacion, resultado). Las cotizaciones repetidas se
+        consultan una unica vez. Si una cotizacion falla, el resultado es la
+        excepcion lanzada (CodigoPostalInvalido, APIError, etc.) y el lote
+        continua.
+
+        args
+        --------
+        cotizaciones -- iterable: Diccionarios con los parametros de
+                                  cotizar_envio.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        ordenado -- boolean: Si es verdadero los resultados se generan en el
+                             orden de las cotizaciones. Caso contrario, a
+                             medida que se completan.
+        '''
+        return lotes.ejecutar(lambda c: self.cotizar_envio(**c),
+                              cotizaciones,
+                              concurrencia=concurrencia,
+                              ordenado=ordenado,
+                              clave=_clave_cotizacion)
 
     @validator.gt("peso", 0)
     @validator.gt("volumen", 0)
@@ -239,6 +528,7 @@ class API(object):
                            Este valor es de referencia, ya que el sistema
                            recalculará la tarifa junto con el alta.
         '''
+        self.__validar_codigo_postal(kwargs.get('codigo_postal'))
         # configuro parametros de la peticion
         parametros = {
             'SucursalRetiro': kwargs.get('sucursal_retiro'),
@@ -272,8 +562,10 @@ class API(object):
             'Tarifa': kwargs.get('tarifa'),
         }
         # obtengo resultado
-        response = self.__soap("confirmar_compra", compra=parametros)
-        return self.__to_dict(response) if response else None
+        return self.__alta("confirmar_compra", kwargs,
+                           lambda: self._ejecutar("confirmar_compra",
+                                                  self.__a_dict,
+                                                  compra=parametros))
 
     @validator.gt("peso", 0)
     @validator.gt("volumen", 0)
@@ -338,6 +630,7 @@ class API(object):
                            Este valor es de referencia, ya que el sistema
                            recalculará la tarifa junto con el alta.
         '''
+        self.__validar_codigo_postal(kwargs.get('codigo_postal'))
         # configuro parametros de la peticion
         parametros = {
             'SucursalRetiro': kwargs.get('sucursal_retiro'),
@@ -372,19 +665,141 @@ class API(object):
             'NumeroRecibo': kwargs.get('numero_recibo'),
         }
         # obtengo resultado
-        response = self.__soap("confirmar_compra_datos_impresion",
-                               compra=parametros)
-        return self.__to_dict(response) if response else None
+        return self.__alta("confirmar_compra_datos_impresion", kwargs,
+                           lambda: self._ejecutar(
+                               "confirmar_compra_datos_impresion",
+                               self.__a_dict,
+                               compra=parametros))
+
+    def confirmar_compras_datos_impresion(self,
+                                          compras,
+                                          concurrencia=4,
+                                          reintentos=3,
+                                          ordenado=True):
+        '''
+        Genera muchos envíos con confirmar_compra_datos_impresion.
+
+        Genera tuplas (numero_transaccion, resultado). Si el alta falla, el
+        resultado es la excepcion lanzada. Cada compra se valida antes de
+        enviarla, de modo que las compras invalidas no generan peticiones.
+
+        Las peticiones rechazadas por saturacion del servidor (HTTP 429 o
+        503) o por conexion rechazada se reintentan hasta `reintentos` veces,
+        espaciando las peticiones de todo el lote mientras persistan los
+        errores.
+
+        Cada alta se registra en el DIARIO, si esta configurado. Al repetir
+        el lote, por ejemplo luego de una caida del proceso, las compras ya
+        confirmadas devuelven el resultado registrado sin volver a enviarse,
+        y las que se enviaron sin obtener respuesta devuelven EnvioIncierto
+        en lugar de arriesgar un envío duplicado.
+
+        >>> API.DIARIO = Diario("altas.db")
+        >>> for numero, resultado in api.confirmar_compras_datos_impresion(
+        ...         compras):
+        ...     pass
+
+        args
+        --------------
+        compras -- iterable: Diccionarios con los parametros de
+                             confirmar_compra_datos_impresion.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        reintentos -- integer: Cantidad maxima de reintentos por compra.
+        ordenado -- boolean: Si es verdadero los resultados se generan en el
+                             orden de las compras. Caso contrario, a medida
+                             que se completan.
+        '''
+        retroceso = lotes.Retroceso()
+
+        def confirmar(compra):
+            self._validar_compra(**compra)
+            intento = 0
+            while True:
+                retroceso.esperar()
+                try:
+                    resultado = self.confirmar_compra_datos_impresion(**compra)
+                except Exception as e:
+                    if intento < reintentos and reintentable(e):
+                        intento += 1
+                        retroceso.error()
+                        continue
+                    raise
+                retroceso.exito()
+                return resultado
+
+        resultados = lotes.ejecutar(confirmar, compras,
+                                    concurrencia=concurrencia,
+                                    ordenado=ordenado,
+                                    clave=_clave_compra)
+        return ((compra.get('numero_transaccion'), resultado)
+                for compra, resultado in resultados)
+
+    def conciliar_altas(self):
+        '''
+        Resuelve las altas del diario que se enviaron sin obtener respuesta
+        (ver diario.Diario.conciliar). Las de confirmar_compra se buscan en
+        el reporte de envíos pendientes de impresión y las de
+        confirmar_compra_datos_impresion, que ya tienen sus datos de
+        impresión, en el de pendientes de ingreso. Cada reporte se consulta
+        una unica vez y solo si hay altas que resolver con el.
+
+        Debe llamarse cuando no haya altas en curso, por ejemplo al iniciar
+        el proceso.
+        '''
+        resultados = {}
+        for operacion in self.DIARIO.operaciones_pendientes():
+            envios = getattr(self, self._REPORTES_ALTAS[operacion])()
+            resultados.update(self.DIARIO.conciliar(envios, operacion))
+        return resultados
+
+    def __alta(self, operacion, parametros, confirmar):
+        '''
+        Realiza el alta con la funcion dada, registrandola en el diario si
+        esta configurado.
+        '''
+        numero = parametros.get('numero_transaccion')
+        if self.DIARIO is None or not numero:
+            return confirmar()
+        return self._registrado(self.DIARIO, numero, operacion, parametros,
+                                confirmar)
+
+    def _registrado(self, diario, numero, operacion, parametros, confirmar):
+        '''
+        Realiza el alta registrando en el diario su intencion y su resultado.
+        '''
+        confirmada, resultado = diario.iniciar(numero, operacion, parametros)
+        if confirmada:
+            return resultado
+        try:
+            resultado = confirmar()
+        except Exception as e:
+            diario.fallo(numero, e)
+            raise
+        diario.confirmar(numero, resultado)
+        return resultado
+
+    @validator.gt("peso", 0)
+    @validator.gt("volumen", 0)
+    def _validar_compra(self, **kwargs):
+        '''
+        Valida los parametros de una compra sin realizar la peticion.
+        '''
+        self.__validar_codigo_postal(kwargs.get('codigo_postal'))
 
     def consultar_codigo_postal(self, codigo_postal, codigo_pais="ARG"):
         '''
         Permite consultar Códigos Postales, Localidades, Provincias y Países.
         '''
+        def consultar():
+            return self._ejecutar("consultar_codigo_postal", self.__a_dict,
+                                  CodigoDePais=codigo_pais,
+                                  CodigoPostal=codigo_postal)
         # obtengo resultado
-        response = self.__soap("consultar_codigo_postal",
-                               CodigoDePais=codigo_pais,
-                               CodigoPostal=codigo_postal)
-        return self.__to_dict(response) if response else None
+        cache = self.CACHE_CODIGOS_POSTALES
+        if cache is None:
+            return consultar()
+        return self._cacheado(cache, cache.clave(codigo_postal, codigo_pais),
+                              consultar)
 
     def consultar_trazabilidad(self, numero_pieza):
         '''
@@ -398,10 +813,41 @@ class API(object):
                                 distribución.
         '''
         # obtengo resultado
-        response = self.__soap("consultar_trazabilidad", NroPieza={
-            'NroPieza': numero_pieza
-        })
-        return self.__to_dict(response) if response else None
+        if self.XML_DIRECTO:
+            return self.__leer("consultar_trazabilidad", lambda r: r,
+                               NroPieza={'NroPieza': numero_pieza})
+        return self._ejecutar("consultar_trazabilidad", self.__a_dict,
+                              NroPieza={'NroPieza': numero_pieza})
+
+    def consultar_trazabilidades(self,
+                                 numeros_pieza,
+                                 concurrencia=10,
+                                 por_segundo=None,
+                                 ordenado=True):
+        '''
+        Consulta la trazabilidad de muchos envíos de forma concurrente.
+
+        Genera tuplas (numero_pieza, resultado). Si la consulta falla, el
+        resultado es la excepcion lanzada. Los numeros se consumen a medida
+        que se realizan las consultas, por lo que pueden provenir de un
+        generador de cualquier tamaño sin aumentar el uso de memoria.
+
+        args
+        --------------
+        numeros_pieza -- iterable: Numeros de pieza a consultar.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        por_segundo -- float: Cantidad maxima de peticiones por segundo. Si
+                              no se indica, no se limita.
+        ordenado -- boolean: Si es verdadero los resultados se generan en el
+                             orden de los numeros. Caso contrario, a medida
+                             que se completan.
+        '''
+        consultar = self.consultar_trazabilidad
+        if por_segundo:
+            consultar = lotes.Limitador(por_segundo).limitar(consultar)
+        return lotes.ejecutar(consultar, numeros_pieza,
+                              concurrencia=concurrencia,
+                              ordenado=ordenado)
 
     def consulta_ultimo_estado_distribucion(self,
                                             numero_andreani,
@@ -423,9 +869,48 @@ class API(object):
         consulta = {'CodigoCliente': self.cliente,
                     'Piezas': [{'Pieza': pieza}]}
         # obtengo resultado
-        response = self.__soap("consulta_ultimo_estado_distribucion",
-                               Consulta=consulta)
-        return self.__to_dict(response) if response else None
+        return self._ejecutar("consulta_ultimo_estado_distribucion",
+                              self.__a_dict,
+                              Consulta=consulta)
+
+    def consulta_ultimos_estados_distribucion(self,
+                                              piezas,
+                                              por_peticion=50,
+                                              concurrencia=4):
+        '''
+        Devuelve el último estado de la Distribución de muchos envíos.
+
+        Agrupa las piezas en peticiones de a `por_peticion` piezas y las
+        realiza de forma concurrente.
+
+        Devuelve un diccionario que asocia cada tupla (numero_andreani,
+        numero_pieza) con su estado, None si el webservice no lo devolvio, o
+        la excepcion lanzada por la peticion que la incluia.
+
+        args
+        -------------------------------
+        piezas -- iterable: Numeros Andreani o tuplas (numero_andreani,
+                            numero_pieza).
+        por_peticion -- integer: Cantidad maxima de piezas por peticion.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        '''
+        return _estados_por_pieza(lotes.ejecutar(
+            self._consultar_estados,
+            lotes.partir(_piezas(piezas), por_peticion),
+            concurrencia=concurrencia))
+
+    def _consultar_estados(self, piezas):
+        '''
+        Consulta el último estado de una lista de tuplas (numero_andreani,
+        numero_pieza) en una unica peticion.
+        '''
+        consulta = {'CodigoCliente': self.cliente,
+                    'Piezas': [{'Pieza': {'NroPieza': numero_pieza,
+                                          'NroAndreani': numero_andreani}}
+                               for numero_andreani, numero_pieza in piezas]}
+        return self._ejecutar("consulta_ultimo_estado_distribucion",
+                              self.__a_dict,
+                              Consulta=consulta)
 
     def imprimir_constancia(self, numero_andreani):
         '''
@@ -442,10 +927,14 @@ class API(object):
         # armo parametros de la peticion
         parametros = {"ParamImprimirConstancia":
                      {"NumeroAndreani": numero_andreani}}
+
+        def procesar(response):
+            # devuelvo link del pdf para impresion de constancia del envio
+            return (response[key_list][0][key_link]
+                    if response[key_list] else None)
         # realizo peticion soap
-        response = self.__soap("imprimir_constancia", entities=parametros)
-        # devuelvo link del pdf para impresion de constancia del envio
-        return response[key_list][0][key_link] if response[key_list] else None
+        return self._ejecutar("imprimir_constancia", procesar,
+                              entities=parametros)
 
     def anular_envio(self, numero_andreani):
         '''
@@ -459,13 +948,54 @@ class API(object):
         # armo parametros de la peticion
         parametros = {"ParamAnularEnvios":
                      {"NumeroAndreani": numero_andreani}}
+
+        def procesar(response):
+            if response:
+                _dict = self.__to_dict(response)
+                return _dict[key]
+            else:
+                return None
         # realizo peticion soap
-        response = self.__soap("anular_envio", envios=parametros)
-        if response:
-            _dict = self.__to_dict(response)
-            return _dict[key]
-        else:
-            return None
+        return self._ejecutar("anular_envio", procesar, envios=parametros)
+
+    def anular_envios(self, numeros_andreani, por_peticion=50,
+                      concurrencia=4):
+        '''
+        Anula muchos envíos que todavía no hayan ingresado al circuito
+        operativo.
+
+        Agrupa los envíos en peticiones de a `por_peticion` envíos y las
+        realiza de forma concurrente.
+
+        Devuelve un diccionario que asocia cada numero Andreani con su
+        resultado, None si el webservice no lo devolvio, o la excepcion
+        lanzada al anularlo. Si el webservice rechaza una peticion, la
+        reintenta por partes para asociar el error solo a los envíos que
+        fallan.
+
+        args
+        -------------------------------
+        numeros_andreani -- iterable: Números de identificación de envíos
+                                      Andreani.
+        por_peticion -- integer: Cantidad maxima de envíos por peticion.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        '''
+        return _por_numero_andreani(lotes.ejecutar(
+            functools.partial(_por_partes, self._anular_envios),
+            lotes.partir(_sin_repetidos(numeros_andreani), por_peticion),
+            concurrencia=concurrencia))
+
+    def _anular_envios(self, numeros_andreani):
+        '''
+        Anula una lista de envíos en una unica peticion.
+        '''
+        key = "resultado_anular_envios"
+        parametros = {"ParamAnularEnvios": [{"NumeroAndreani": numero}
+                                            for numero in numeros_andreani]}
+
+        def procesar(response):
+            return self.__to_dict(response)[key] if response else None
+        return self._ejecutar("anular_envio", procesar, envios=parametros)
 
     def consultar_datos_impresion(self, numero_andreani):
         '''
@@ -475,9 +1005,57 @@ class API(object):
         # armo parametros de la peticion
         parametros = {"NumeroAndreani": [{'string': numero_andreani}]}
         # realizo peticion soap
-        response = self.__soap("consultar_datos_impresion",
-                               parametros=parametros)
-        return self.__to_dict(response)
+        return self._ejecutar("consultar_datos_impresion", self.__to_dict,
+                              parametros=parametros)
+
+    def consultar_datos_impresiones(self,
+                                    numeros_andreani,
+                                    por_peticion=50,
+                                    concurrencia=4,
+                                    ordenado=True):
+        '''
+        Consulta los datos de impresión de muchas piezas.
+
+        Agrupa las piezas en peticiones de a `por_peticion` piezas y las
+        realiza de forma concurrente. Genera tuplas (numero_andreani, datos)
+        a medida que se completan las peticiones, donde datos es None si el
+        webservice no devolvio la pieza, o la excepcion lanzada al
+        consultarla. Si el webservice rechaza una peticion, la reintenta por
+        partes para asociar el error solo a las piezas que fallan.
+
+        >>> for numero, datos in api.consultar_datos_impresiones(numeros):
+        ...     pass
+
+        args
+        -------------------------------
+        numeros_andreani -- iterable: Números de identificación de envíos
+                                      Andreani. Puede ser un generador.
+        por_peticion -- integer: Cantidad maxima de piezas por peticion.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        ordenado -- boolean: Si es verdadero las piezas se generan en el
+                             orden dado. Caso contrario, a medida que se
+                             completan las peticiones.
+        '''
+        return _resultados_por_numero(_partes(lotes.ejecutar(
+            functools.partial(_por_partes,
+                              self._consultar_datos_impresiones),
+            lotes.partir(numeros_andreani, por_peticion),
+            concurrencia=concurrencia,
+            ordenado=ordenado)))
+
+    def _consultar_datos_impresiones(self, numeros_andreani):
+        '''
+        Consulta los datos de impresión de una lista de piezas en una unica
+        peticion.
+        '''
+        key = "resultado_consultar_datos_de_impresion"
+        parametros = {"NumeroAndreani": [{'string': numero}
+                                         for numero in numeros_andreani]}
+
+        def procesar(response):
+            return self.__to_dict(response).get(key) if response else None
+        return self._ejecutar("consultar_datos_impresion", procesar,
+                              parametros=parametros)
 
     def reporte_envios_pendientes_impresion(self):
         '''
@@ -488,14 +1066,20 @@ class API(object):
         constancias".
         '''
         key = "resultado_reporte_envios_pendientes_impresion"
-        # armo parametros de la peticion y devuelvo resultado
-        response = self.__soap("reporte_envios_pendientes_impresion",
+        if self.XML_DIRECTO:
+            return self.__leer("reporte_envios_pendientes_impresion",
+                               lambda r: r[key] if r else None,
                                ventas={"idCliente": self.cliente})
-        if response:
-            _dict = self.__to_dict(response)
-            return _dict[key]
-        else:
-            return None
+
+        def procesar(response):
+            if response:
+                _dict = self.__to_dict(response)
+                return _dict[key]
+            else:
+                return None
+        # armo parametros de la peticion y devuelvo resultado
+        return self._ejecutar("reporte_envios_pendientes_impresion", procesar,
+                              ventas={"idCliente": self.cliente})
 
     def reporte_envios_pendientes_ingreso(self):
         '''
@@ -503,15 +1087,77 @@ class API(object):
         que todavía no entraron en el circuito operativo de Andreani.
         '''
         key = "resultado_reporte_envios_pendientes_ingreso"
-        # armo parametros de la peticion y devuelvo resultado
-        response = self.__soap("reporte_envios_pendientes_ingreso",
+        if self.XML_DIRECTO:
+            return self.__leer("reporte_envios_pendientes_ingreso",
+                               lambda r: r[key] if r else None,
                                cliente={"Cliente": self.cliente})
-        # devuelvo lista de envios pendientes de ingreso
-        if response:
-            _dict = self.__to_dict(response)
-            return _dict[key]
-        else:
-            return None
+
+        def procesar(response):
+            # devuelvo lista de envios pendientes de ingreso
+            if response:
+                _dict = self.__to_dict(response)
+                return _dict[key]
+            else:
+                return None
+        # armo parametros de la peticion y devuelvo resultado
+        return self._ejecutar("reporte_envios_pendientes_ingreso", procesar,
+                              cliente={"Cliente": self.cliente})
+
+    def iterar_envios_pendientes_impresion(self):
+        '''
+        Igual que reporte_envios_pendientes_impresion, pero genera los envíos
+        de a uno a medida que se lee la respuesta.
+
+        El cuerpo de la respuesta se descarga completo, pero el XML se lee de
+        forma incremental sin armar los objetos de suds, y cada envío se
+        convierte en diccionario y se descarta antes de leer el siguiente.
+        Además del cuerpo, sólo se mantiene en memoria el envío actual.
+
+        >>> for envio in api.iterar_envios_pendientes_impresion():
+        ...     pass
+        '''
+        return self.__filas("reporte_envios_pendientes_impresion",
+                            "ResultadoReporteEnviosPendientesImpresion",
+                            ventas={"idCliente": self.cliente})
+
+    def iterar_envios_pendientes_ingreso(self):
+        '''
+        Igual que reporte_envios_pendientes_ingreso, pero genera los envíos
+        de a uno a medida que se lee la respuesta (ver
+        iterar_envios_pendientes_impresion).
+        '''
+        return self.__filas("reporte_envios_pendientes_ingreso",
+                            "ResultadoReporteEnviosPendientesIngreso",
+                            cliente={"Cliente": self.cliente})
+
+    def __filas(self, peticion, fila, **kwargs):
+        '''
+        Realiza la peticion y devuelve un generador de las filas de la
+        respuesta.
+        '''
+        def procesar(status, reason, body, tipo):
+            hijo = tipo.hijos.get(fila)
+            for item in lector.filas(body, fila, self._error_texto,
+                                     hijo[2] if hijo else None):
+                yield item
+            if status != 200:
+                raise Exception((status, reason))
+        return self._ejecutar_xml(peticion, procesar, **kwargs)
+
+    def __leer(self, peticion, procesar, **kwargs):
+        '''
+        Realiza la peticion leyendo directamente el XML de la respuesta (ver
+        XML_DIRECTO) y devuelve el resultado procesado con la funcion dada.
+
+        La funcion recibe el resultado convertido en diccionario igual que
+        __a_dict, o None si esta vacio.
+        '''
+        def leer(status, reason, body, tipo):
+            resultado = lector.resultado(body, tipo, self._error_texto)
+            if status != 200:
+                raise Exception((status, reason))
+            return procesar(resultado or None)
+        return self._ejecutar_xml(peticion, leer, **kwargs)
 
     def generar_remito_imposicion(self, numero_andreani):
         '''
@@ -529,48 +1175,31 @@ class API(object):
         # armo parametros de la peticion
         param = {"ParamGeneracionRemitodeImposicion":
                 {"NumeroAndreani": numero_andreani}}
+
+        def procesar(response):
+            # devuelvo link del pdf para impresion de constancia del envio
+            if response:
+                _dict = self.__to_dict(response)
+                return _dict[key][0]
+            else:
+                return None
         # realizo peticion soap
-        response = self.__soap("generar_remito_imposicion", entidades=param)
-        # devuelvo link del pdf para impresion de constancia del envio
-        if response:
-            _dict = self.__to_dict(response)
-            return _dict[key][0]
-        else:
-            return None
+        return self._ejecutar("generar_remito_imposicion", procesar,
+                              entidades=param)
 
-    def __to_dict(self, obj):
+    def __a_dict(self, response):
         '''
-        Convierte un objeto en diccionario.
+        Convierte la respuesta en diccionario, o devuelve None si esta vacia.
         '''
-        out = {}
-        for k, v in asdict(obj).items():
-            k = self.__pythonize(k)
-            if hasattr(v, '__keylist__'):
-                out[k] = self.__to_dict(v)
-            elif isinstance(v, list):
-                out[k] = []
-                for item in v:
-                    if hasattr(item, '__keylist__'):
-                        out[k].append(self.__to_dict(item))
-                    else:
-                        out[k].append(item)
-            else:
-                out[k] = v
-        return out
+        return self.__to_dict(response) if response else None
 
-    def __pythonize(self, attr):
+    def __to_dict(self, obj):
         '''
-        Pythoniza el nombre de un atributo de formato CamelCase a under_score.
+        Convierte un objeto en diccionario.
         '''
-        result = [attr[0].lower()]
-        for char in attr[1:]:
-            if char in string.ascii_letters:
-                if char in string.ascii_uppercase:
-                    result.append("_")
-                result.append(char.lower())
-        return ''.join(result)
+        return conversion.a_dict(obj)
 
-    def __get_wsdl(self, peticion):
+    def _get_wsdl(self, peticion):
         '''
         Obtiene la URL del WSDL y el nombre del metodo para la peticion
         dada. Tiene en cuenta el ambiente en el que se ejecuta.
@@ -579,15 +1208,304 @@ class API(object):
             return self._URL['Staging'][peticion]
 
 
-class CodigoPostalInvalido(ValueError):
+def _cabeceras(soap, metodo):
+    '''
+    Devuelve las cabeceras HTTP de la peticion, igual que suds.
+    '''
+    headers = {'Content-Type': 'text/xml; charset=utf-8',
+               'SOAPAction': metodo.soap.action}
+    headers.update(soap.options.headers)
+    return headers
+
+
+def _respuesta(status, reason, body):
+    '''
+    Verifica el status HTTP de una respuesta SOAP igual que suds y devuelve
+    la tupla (status, reason, body).
+    '''
+    if status not in (200, 500):
+        raise Exception((status, reason))
+    return status, reason, body
+
+
+def _clave_cotizacion(cotizacion):
+    '''
+    Devuelve una clave que identifica los parametros de una cotizacion.
+    '''
+    return frozenset((k, str(v)) for k, v in cotizacion.items()
+                     if v is not None)
+
+
+def _piezas(piezas):
+    '''
+    Devuelve la lista de tuplas (numero_andreani, numero_pieza) sin
+    repetidos.
+    '''
+    return _sin_repetidos(
+        (pieza, None) if isinstance(pieza, str) else tuple(pieza)
+        for pieza in piezas)
+
+
+def _clave_compra(compra):
+    '''
+    Devuelve una clave que identifica las compras repetidas de un lote.
+    '''
+    return compra.get('numero_transaccion') or id(compra)
+
+
+def _sin_repetidos(items):
+    '''
+    Devuelve la lista de items sin repetidos, en el orden original.
+    '''
+    return list(collections.OrderedDict.fromkeys(items))
+
+
+def _por_numero_andreani(resultados):
+    '''
+    Arma el diccionario de resultados por numero Andreani a partir de las
+    tuplas (numeros, partes) de cada lote (ver _por_partes).
+    '''
+    return dict(_resultados_por_numero(_partes(resultados)))
+
+
+def _por_partes(funcion, numeros):
+    '''
+    Llama a la funcion con la lista de numeros y devuelve la lista de tuplas
+    (numeros, respuesta) de las peticiones realizadas.
+
+    Un solo numero invalido hace que el webservice rechace toda la
+    peticion, por lo que ante un rechazo parte la lista en dos y reintenta
+    cada mitad, hasta aislar los numeros que fallan. Los demas errores se
+    lanzan, ya que afectan a la peticion completa.
+    '''
+    try:
+        return [(numeros, funcion(numeros))]
+    except (APIError, ValueError) as e:
+        if len(numeros) == 1:
+            return [(numeros, e)]
+        mitad = len(numeros) // 2
+        return (_por_partes(funcion, numeros[:mitad]) +
+                _por_partes(funcion, numeros[mitad:]))
+
+
+def _partes(resultados):
+    '''
+    Genera las tuplas (numeros, respuesta) de cada peticion a partir de las
+    tuplas (numeros, partes) de cada lote, donde partes es la lista devuelta
+    por _por_partes o la excepcion que lanzo.
+    '''
+    for numeros, partes in resultados:
+        if isinstance(partes, Exception):
+            yield numeros, partes
+        else:
+            for parte in partes:
+                yield parte
+
+
+def _resultados_por_numero(resultados):
+    '''
+    Genera tuplas (numero_andreani, resultado) a partir de las tuplas
+    (numeros, respuesta) de cada peticion.
+    '''
+    for numeros, respuesta in resultados:
+        for resultado in _resultados_lote(numeros, respuesta):
+            yield resultado
+
+
+def _resultados_lote(numeros, respuesta):
+    '''
+    Devuelve la lista de tuplas (numero_andreani, resultado) de la respuesta
+    de una peticion.
+    '''
+    if isinstance(respuesta, Exception):
+        return [(numero, respuesta) for numero in numeros]
+    recibidos = {}
+    for item in respuesta or []:
+        recibidos.setdefault(item.get('numero_andreani'), item)
+    return [(numero, recibidos.get(numero)) for numero in numeros]
+
+
+def _estados_por_pieza(resultados):
+    '''
+    Arma el diccionario de estados a partir de las tuplas (piezas,
+    respuesta) de cada peticion.
+    '''
+    estados = {}
+    for piezas, respuesta in resultados:
+        if isinstance(respuesta, Exception):
+            estados.update((pieza, respuesta) for pieza in piezas)
+            continue
+        por_numero = {}
+        por_pieza = {}
+        for item in (respuesta or {}).get('piezas') or []:
+            estado = item.get('pieza')
+            if estado:
+                por_numero.setdefault(estado.get('nro_andreani'), estado)
+                por_pieza.setdefault(estado.get('nro_pieza'), estado)
+        for numero_andreani, numero_pieza in piezas:
+            if numero_pieza is not None and numero_pieza in por_pieza:
+                estado = por_pieza[numero_pieza]
+            else:
+                estado = por_numero.get(numero_andreani)
+            estados[numero_andreani, numero_pieza] = estado
+    return estados
+
+
+class Evento(object):
+    '''
+    Tiempos de una peticion SOAP, informados a los oyentes de la API (ver
+    API.OYENTES).
+
+    atributos
+    --------
+    operacion -- string: Nombre de la peticion en API._URL
+                         (cotizar_envio, etc.).
+    metodo -- string: Metodo SOAP.
+    version -- float: Version de SOAP.
+    fases -- dict: Segundos de cada fase, en el orden en que ocurrieron:
+                   wsdl (obtencion del wsdl parseado), cliente (obtencion del
+                   cliente suds), armado (del envoltorio), red (envio y
+                   espera de la respuesta), lectura (de la respuesta por suds
+                   o lector) y conversion (del resultado a diccionario).
+    bytes_peticion -- integer: Tamaño del envoltorio enviado.
+    bytes_respuesta -- integer: Tamaño de la respuesta recibida.
+    duracion -- float: Segundos totales de la peticion.
+    resultado -- string: "ok", o el nombre de la clase de la excepcion
+                         lanzada (APIError para los faults,
+                         CodigoPostalInvalido, etc.).
+    error -- Exception: Excepcion lanzada, o None.
+    '''
+
+    def __init__(self, operacion, metodo, version):
+        self.operacion = operacion
+        self.metodo = metodo
+        self.version = version
+        self.fases = {}
+        self.bytes_peticion = 0
+        self.bytes_respuesta = 0
+        self.duracion = None
+        self.resultado = None
+        self.error = None
+        self.__inicio = self.__ultima = time.perf_counter()
+
+    def fase(self, nombre):
+        '''
+        Registra la duracion de la fase que termina, desde el final de la
+        anterior.
+        '''
+        ahora = time.perf_counter()
+        self.fases[nombre] = self.fases.get(nombre, 0) + ahora - self.__ultima
+        self.__ultima = ahora
+
+    def red(self, envoltorio, body):
+        '''
+        Registra la fase de red y los tamaños de la peticion y la respuesta.
+        '''
+        self.fase('red')
+        self.bytes_peticion = len(envoltorio or b'')
+        self.bytes_respuesta = len(body or b'')
+
+    def finalizar(self, error=None):
+        self.duracion = time.perf_counter() - self.__inicio
+        self.error = error
+        self.resultado = 'ok' if error is None else type(error).__name__
+
+    def __repr__(self):
+        return '<Evento %s %s %.3fs>' % (self.operacion, self.resultado,
+                                         self.duracion or 0)
+
+
+class _SinEvento(object):
+    '''
+    Evento que no registra nada, utilizado cuando la API no tiene oyentes.
+    '''
+
+    def fase(self, nombre):
+        pass
+
+    def red(self, envoltorio, body):
+        pass
+
+
+_SIN_EVENTO = _SinEvento()
+
+
+class ClienteSoap(suds.client.Client):
+    '''
+    Cliente suds que puede clonarse sin copiar sus opciones.
+
+    suds.client.Client.clone copia las opciones con deepcopy, lo que entra
+    en recursion infinita con las opciones enlazadas al transporte en
+    versiones recientes de python. Los clones de este cliente comparten el
+    wsdl parseado y parten de opciones nuevas.
+    '''
+
+    def clone(self):
+        clon = object.__new__(type(self))
+        clon.options = Options()
+        clon.options.transport = HttpAuthenticated()
+        clon.wsdl = self.wsdl
+        clon.factory = self.factory
+        clon.service = suds.client.ServiceSelector(clon, self.wsdl.services)
+        clon.sd = self.sd
+        clon.messages = dict(tx=None, rx=None)
+        return clon
+
+
+class _Transporte(suds.transport.Transport):
     '''
-    Excepcion lanzada cuando el servidor devuelve codigo postal invalido.
+    Transporte de un cliente suds que delega las peticiones en el transporte
+    compartido por todos los clientes de la API.
     '''
-    pass
+
+    def __init__(self, transporte):
+        super().__init__()
+        self.transporte = transporte
+
+    def open(self, request):
+        return self.transporte.open(request)
+
+    def send(self, request):
+        return self.transporte.send(request)
 
 
-class APIError(Exception):
+class WssePlugin(suds.plugin.MessagePlugin):
     '''
-    Excepcion lanzada cada vez que haya un error con el webservice de Andreani.
+    Plugin suds que agrega la cabecera de seguridad WS-Security a la
+    peticion.
     '''
-    pass
+
+    def __init__(self, security):
+        self.security = security
+
+    def marshalled(self, context):
+        '''
+        Agrega las credenciales a la cabecera del envoltorio.
+        '''
+        context.envelope.getChild('Header').append(self.security.xml())
+
+
+class Soap12Plugin(suds.plugin.MessagePlugin):
+    '''
+    Plugin suds que arma el envoltorio de la peticion con el namespace de
+    SOAP 1.2.
+
+    suds solo genera envoltorios SOAP 1.1. Reemplazando el namespace en cada
+    mensaje, en lugar de modificar el global suds.bindings.binding.envns, se
+    pueden realizar peticiones 1.1 y 1.2 desde distintos hilos a la vez.
+    '''
+    namespace = 'http://www.w3.org/2003/05/soap-envelope'
+
+    def marshalled(self, context):
+        '''
+        Reemplaza el namespace del envoltorio, la cabecera y el cuerpo.
+        '''
+        namespace = binding.envns[1]
+        envelope = context.envelope
+        # suds puede declarar el namespace con distintos prefijos
+        for elemento in [envelope] + envelope.children:
+            for prefijo, uri in elemento.nsprefixes.items():
+                if uri == namespace:
+                    elemento.nsprefixes[prefijo] = self.namespace
+            if elemento.expns == namespace:
+                elemento.expns = self.namespace
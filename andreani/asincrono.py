@@ -0,0 +1,475 @@
+'''
+Cliente asincronico (asyncio) de los servicios de andreani.
+'''
+import asyncio
+import functools
+import ssl
+import urllib.parse
+
+from . import lotes
+from .andreani import (API, _cabeceras, _clave_compra, _clave_cotizacion,
+                       _estados_por_pieza, _partes, _piezas,
+                       _por_numero_andreani, _resultados_por_numero,
+                       _sin_repetidos)
+from .excepciones import APIError
+from .utiles import reintentable
+
+
+class AsyncAPI(API):
+    '''
+    Version asincronica de API.
+
+    Ofrece los mismos metodos que API, pero cada uno devuelve una corrutina.
+    Los envoltorios se arman y las respuestas se procesan con suds igual que
+    en API, mientras que las peticiones HTTP se realizan con conexiones
+    no bloqueantes, de modo que muchas consultas concurrentes no necesitan
+    un hilo cada una.
+
+    >>> api = AsyncAPI(usuario, password, cliente)
+    >>> cotizacion = await api.cotizar_envio(...)
+    '''
+
+    # suds arma el envoltorio pero no realiza la peticion
+    _opciones_cliente = {'nosend': True}
+
+    def __init__(self, username, password, cliente, transporte=None):
+        '''
+        Inicializa datos del objeto
+
+        args
+        --------
+        transporte -- TransporteAsincrono: Transporte HTTP utilizado en todas
+                      las peticiones. Si no se indica se crea uno para esta
+                      instancia.
+        '''
+        super().__init__(username, password, cliente)
+        self.transporte_asincrono = transporte or TransporteAsincrono()
+
+    async def _ejecutar(self, peticion, procesar, **kwargs):
+        '''
+        Realiza la peticion SOAP de forma asincronica y devuelve el
+        resultado procesado con la funcion dada.
+        '''
+        return await self.__enviar(peticion, self._leer_suds(procesar),
+                                   **kwargs)
+
+    async def _ejecutar_xml(self, peticion, procesar, **kwargs):
+        '''
+        Realiza la peticion SOAP de forma asincronica y devuelve el
+        resultado de procesar el XML de la respuesta con la funcion dada.
+        '''
+        return await self.__enviar(peticion, self._leer_xml(procesar),
+                                   **kwargs)
+
+    async def __enviar(self, peticion, leer, **kwargs):
+        '''
+        Arma el envoltorio con suds, lo envia y devuelve el resultado de leer
+        la respuesta con la funcion dada (ver API._leer_suds).
+        '''
+        # obtengo url del wsdl, nombre de metodo y version de soap
+        wsdl, metodo, version = self._get_wsdl(peticion)
+        with self._medir(peticion, metodo, version) as evento:
+            if wsdl not in self._clientes:
+                # la descarga y el parseo del wsdl son bloqueantes y ocurren
+                # una unica vez por proceso
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self._cliente, wsdl)
+            evento.fase('wsdl')
+            soap = self._get_cliente(wsdl, metodo, version)
+            evento.fase('cliente')
+            operacion = getattr(soap.service, metodo)
+            contexto = operacion(**kwargs)
+            evento.fase('armado')
+            status, reason, body = await self.transporte_asincrono.enviar(
+                operacion.method.location,
+                contexto.envelope,
+                _cabeceras(soap, operacion.method))
+            evento.red(contexto.envelope, body)
+            return leer(evento, operacion.method, contexto, status, reason,
+                        body)
+
+    async def _cacheado(self, cache, clave, calcular):
+        '''
+        Devuelve el valor de la clave en la cache dada, calculandolo de
+        forma asincronica si no esta.
+        '''
+        return await cache.obtener_asincrono(clave, calcular)
+
+    async def _registrado(self, diario, numero, operacion, parametros,
+                          confirmar):
+        '''
+        Realiza el alta de forma asincronica registrando en el diario su
+        intencion y su resultado.
+        '''
+        confirmada, resultado = diario.iniciar(numero, operacion, parametros)
+        if confirmada:
+            return resultado
+        try:
+            resultado = await confirmar()
+        except Exception as e:
+            diario.fallo(numero, e)
+            raise
+        diario.confirmar(numero, resultado)
+        return resultado
+
+    async def conciliar_altas(self):
+        '''
+        Resuelve las altas del diario que se enviaron sin obtener respuesta.
+
+        Igual que API.conciliar_altas.
+        '''
+        resultados = {}
+        for operacion in self.DIARIO.operaciones_pendientes():
+            envios = await getattr(self, self._REPORTES_ALTAS[operacion])()
+            resultados.update(self.DIARIO.conciliar(envios, operacion))
+        return resultados
+
+    def cotizar_envios(self, cotizaciones, concurrencia=10, ordenado=True):
+        '''
+        Cotiza un lote de envíos de forma concurrente.
+
+        Igual que API.cotizar_envios, pero genera las tuplas (cotizacion,
+        resultado) de forma asincronica.
+
+        >>> async for cotizacion, resultado in api.cotizar_envios(lote):
+        ...     pass
+        '''
+        return lotes.ejecutar_asincrono(lambda c: self.cotizar_envio(**c),
+                                        cotizaciones,
+                                        concurrencia=concurrencia,
+                                        ordenado=ordenado,
+                                        clave=_clave_cotizacion)
+
+    def consultar_trazabilidades(self,
+                                 numeros_pieza,
+                                 concurrencia=10,
+                                 por_segundo=None,
+                                 ordenado=True):
+        '''
+        Consulta la trazabilidad de muchos envíos de forma concurrente.
+
+        Igual que API.consultar_trazabilidades, pero genera las tuplas
+        (numero_pieza, resultado) de forma asincronica.
+        '''
+        consultar = self.consultar_trazabilidad
+        if por_segundo:
+            consultar = lotes.Limitador(por_segundo).limitar_asincrono(
+                consultar)
+        return lotes.ejecutar_asincrono(consultar, numeros_pieza,
+                                        concurrencia=concurrencia,
+                                        ordenado=ordenado)
+
+    async def confirmar_compras_datos_impresion(self,
+                                                compras,
+                                                concurrencia=4,
+                                                reintentos=3,
+                                                ordenado=True):
+        '''
+        Genera muchos envíos con confirmar_compra_datos_impresion.
+
+        Igual que API.confirmar_compras_datos_impresion, pero genera las
+        tuplas (numero_transaccion, resultado) de forma asincronica.
+        '''
+        retroceso = lotes.Retroceso()
+
+        async def confirmar(compra):
+            self._validar_compra(**compra)
+            intento = 0
+            while True:
+                await retroceso.esperar_asincrono()
+                try:
+                    resultado = await self.confirmar_compra_datos_impresion(
+                        **compra)
+                except Exception as e:
+                    if intento < reintentos and reintentable(e):
+                        intento += 1
+                        retroceso.error()
+                        continue
+                    raise
+                retroceso.exito()
+                return resultado
+
+        async for compra, resultado in lotes.ejecutar_asincrono(
+                confirmar, compras, concurrencia=concurrencia,
+                ordenado=ordenado, clave=_clave_compra):
+            yield compra.get('numero_transaccion'), resultado
+
+    async def consulta_ultimos_estados_distribucion(self,
+                                                    piezas,
+                                                    por_peticion=50,
+                                                    concurrencia=4):
+        '''
+        Devuelve el último estado de la Distribución de muchos envíos.
+
+        Igual que API.consulta_ultimos_estados_distribucion.
+        '''
+        resultados = [r async for r in lotes.ejecutar_asincrono(
+            self._consultar_estados,
+            lotes.partir(_piezas(piezas), por_peticion),
+            concurrencia=concurrencia)]
+        return _estados_por_pieza(resultados)
+
+    async def anular_envios(self, numeros_andreani, por_peticion=50,
+                            concurrencia=4):
+        '''
+        Anula muchos envíos que todavía no hayan ingresado al circuito
+        operativo.
+
+        Igual que API.anular_envios.
+        '''
+        resultados = [r async for r in lotes.ejecutar_asincrono(
+            functools.partial(_por_partes, self._anular_envios),
+            lotes.partir(_sin_repetidos(numeros_andreani), por_peticion),
+            concurrencia=concurrencia)]
+        return _por_numero_andreani(resultados)
+
+    async def consultar_datos_impresiones(self,
+                                          numeros_andreani,
+                                          por_peticion=50,
+                                          concurrencia=4,
+                                          ordenado=True):
+        '''
+        Consulta los datos de impresión de muchas piezas.
+
+        Igual que API.consultar_datos_impresiones, pero genera las tuplas
+        (numero_andreani, datos) de forma asincronica.
+        '''
+        async for lote in lotes.ejecutar_asincrono(
+                functools.partial(_por_partes,
+                                  self._consultar_datos_impresiones),
+                lotes.partir(numeros_andreani, por_peticion),
+                concurrencia=concurrencia,
+                ordenado=ordenado):
+            for resultado in _resultados_por_numero(_partes([lote])):
+                yield resultado
+
+    async def cerrar(self):
+        '''
+        Cierra las conexiones del transporte.
+        '''
+        await self.transporte_asincrono.cerrar()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.cerrar()
+
+
+class TransporteAsincrono(object):
+    '''
+    Cliente HTTP/1.1 asincronico con un pool de conexiones persistentes
+    (keep-alive) por host.
+    '''
+
+    def __init__(self,
+                 conexiones=10,
+                 timeout_conexion=10,
+                 timeout_lectura=60,
+                 contexto_ssl=None):
+        '''
+        args
+        --------
+        conexiones -- integer: Cantidad maxima de conexiones simultaneas por
+                               host. Las peticiones que la excedan esperan a
+                               que se libere una conexion.
+        timeout_conexion -- float: Segundos de espera para establecer una
+                                   conexion.
+        timeout_lectura -- float: Segundos de espera de la respuesta del
+                                  servidor.
+        contexto_ssl -- ssl.SSLContext: Contexto para las conexiones https.
+        '''
+        self.conexiones = conexiones
+        self.timeout_conexion = timeout_conexion
+        self.timeout_lectura = timeout_lectura
+        self.contexto_ssl = contexto_ssl
+        self.__pools = {}
+
+    async def enviar(self, url, mensaje, headers):
+        '''
+        Envia un POST con el mensaje dado.
+
+        Devuelve una tupla (status, reason, body).
+        '''
+        url = urllib.parse.urlsplit(url)
+        ruta = url.path or '/'
+        if url.query:
+            ruta += '?' + url.query
+        pool = self.__pool(url)
+        async with pool.semaforo:
+            conexion, reutilizada = await pool.obtener()
+            while True:
+                enviada = False
+                try:
+                    await self.__enviar(conexion, url, ruta, mensaje,
+                                        headers)
+                    enviada = True
+                    respuesta = await asyncio.wait_for(
+                        self.__leer(conexion.reader), self.timeout_lectura)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conexion.cerrar()
+                    # el servidor cerro la conexion mientras estaba ociosa.
+                    # Reintento una unica vez con una conexion nueva solo si
+                    # la peticion no llego completa: un POST ya enviado pudo
+                    # haberse procesado y reenviarlo lo duplicaria
+                    if not reutilizada or enviada:
+                        raise
+                    conexion, reutilizada = await pool.nueva(), False
+                except BaseException:
+                    conexion.cerrar()
+                    raise
+            status, reason, mantener, body = respuesta
+            if mantener:
+                pool.devolver(conexion)
+            else:
+                conexion.cerrar()
+        return status, reason, body
+
+    async def cerrar(self):
+        '''
+        Cierra todas las conexiones ociosas.
+        '''
+        for pool in self.__pools.values():
+            pool.cerrar()
+
+    def __pool(self, url):
+        '''
+        Devuelve el pool de conexiones del host de la url dada.
+        '''
+        clave = (url.scheme, url.hostname, url.port)
+        if clave not in self.__pools:
+            https = url.scheme == 'https'
+            port = url.port or (443 if https else 80)
+            contexto = None
+            if https:
+                contexto = self.contexto_ssl or ssl.create_default_context()
+            self.__pools[clave] = _Pool(url.hostname, port, contexto,
+                                        self.timeout_conexion,
+                                        self.conexiones)
+        return self.__pools[clave]
+
+    async def __enviar(self, conexion, url, ruta, mensaje, headers):
+        '''
+        Envia la peticion por la conexion dada.
+        '''
+        host = url.hostname
+        if url.port:
+            host = '%s:%d' % (host, url.port)
+        lineas = ['POST %s HTTP/1.1' % ruta,
+                  'Host: %s' % host,
+                  'Content-Length: %d' % len(mensaje)]
+        for nombre, valor in headers.items():
+            if isinstance(valor, bytes):
+                valor = valor.decode('latin-1')
+            lineas.append('%s: %s' % (nombre, valor))
+        cabecera = ('\r\n'.join(lineas) + '\r\n\r\n').encode('latin-1')
+        conexion.writer.write(cabecera + mensaje)
+        await conexion.writer.drain()
+
+    async def __leer(self, reader):
+        '''
+        Lee una respuesta HTTP/1.1 del stream dado.
+
+        Devuelve una tupla (status, reason, mantener conexion, body).
+        '''
+        linea = await reader.readuntil(b'\r\n')
+        version, status, reason = (linea.decode('latin-1').rstrip('\r\n')
+                                   .split(' ', 2) + [''])[:3]
+        headers = {}
+        while True:
+            linea = await reader.readuntil(b'\r\n')
+            if linea == b'\r\n':
+                break
+            nombre, valor = linea.decode('latin-1').split(':', 1)
+            headers[nombre.strip().lower()] = valor.strip()
+        mantener = (version == 'HTTP/1.1' and
+                    headers.get('connection', '').lower() != 'close')
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            partes = []
+            while True:
+                linea = await reader.readuntil(b'\r\n')
+                largo = int(linea.split(b';', 1)[0], 16)
+                if not largo:
+                    # descarto trailers hasta la linea vacia
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    break
+                partes.append(await reader.readexactly(largo))
+                await reader.readexactly(2)
+            body = b''.join(partes)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            # el cuerpo termina al cerrarse la conexion
+            body = await reader.read()
+            mantener = False
+        return int(status), reason, mantener, body
+
+
+class _Conexion(object):
+    '''
+    Conexion TCP (reader, writer) hacia un host.
+    '''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def cerrar(self):
+        self.writer.close()
+
+
+class _Pool(object):
+    '''
+    Pool de conexiones asincronicas hacia un mismo host.
+    '''
+
+    def __init__(self, host, port, contexto_ssl, timeout, maximo):
+        self.host = host
+        self.port = port
+        self.contexto_ssl = contexto_ssl
+        self.timeout = timeout
+        self.libres = []
+        self.semaforo = asyncio.Semaphore(maximo)
+
+    async def obtener(self):
+        '''
+        Devuelve una tupla (conexion, reutilizada). Prefiere la conexion
+        ociosa usada mas recientemente.
+        '''
+        while self.libres:
+            conexion = self.libres.pop()
+            if not conexion.reader.at_eof():
+                return conexion, True
+            conexion.cerrar()
+        return await self.nueva(), False
+
+    async def nueva(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port,
+                                    ssl=self.contexto_ssl),
+            self.timeout)
+        return _Conexion(reader, writer)
+
+    def devolver(self, conexion):
+        self.libres.append(conexion)
+
+    def cerrar(self):
+        while self.libres:
+            self.libres.pop().cerrar()
+
+
+async def _por_partes(funcion, numeros):
+    '''
+    Version asincronica de andreani._por_partes. La funcion debe devolver
+    una corrutina.
+    '''
+    try:
+        return [(numeros, await funcion(numeros))]
+    except (APIError, ValueError) as e:
+        if len(numeros) == 1:
+            return [(numeros, e)]
+        mitad = len(numeros) // 2
+        return (await _por_partes(funcion, numeros[:mitad]) +
+                await _por_partes(funcion, numeros[mitad:]))
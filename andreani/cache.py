@@ -0,0 +1,313 @@
+'''
+Caches utilizadas por el modulo andreani.
+'''
+import asyncio
+import collections
+import hashlib
+import math
+import os
+import pickle
+import sys
+import threading
+import time
+
+import suds
+import suds.cache
+
+from .excepciones import CodigoPostalInvalido
+
+
+class CacheWSDL(suds.cache.ObjectCache):
+    '''
+    Cache persistente en disco de los wsdl ya parseados.
+
+    Guarda el modelo del servicio (definiciones del wsdl y sus esquemas) tal
+    como lo deja suds luego de parsearlo, de modo que un proceso nuevo lo
+    levanta del disco sin descargar ni parsear nada.
+
+    Las entradas se guardan en un subdirectorio que depende de la huella del
+    entorno (versiones de python, suds y protocolo de pickle). Si alguna de
+    ellas cambia, las entradas viejas dejan de usarse.
+    '''
+    protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, directorio, ttl=86400):
+        '''
+        args
+        --------
+        directorio -- string: Directorio donde se guarda la cache.
+        ttl -- integer: Segundos de validez de cada entrada (0 = sin
+                        vencimiento).
+        '''
+        self.directorio = directorio
+        super().__init__(os.path.join(directorio, self.huella()),
+                         seconds=ttl)
+
+    @classmethod
+    def huella(cls):
+        '''
+        Devuelve la huella del entorno con el que se generan las entradas.
+        '''
+        entorno = "%s|%s|%s" % (sys.version, suds.__version__, cls.protocol)
+        return hashlib.sha1(entorno.encode()).hexdigest()[:16]
+
+    def opciones(self):
+        '''
+        Devuelve las opciones de suds que activan esta cache.
+        '''
+        # cachingpolicy 1 guarda el wsdl parseado en lugar del xml crudo
+        return {'cache': self, 'cachingpolicy': 1}
+
+
+class CacheTTL(object):
+    '''
+    Cache en memoria con vencimiento por tiempo (TTL) y descarte de las
+    entradas usadas menos recientemente (LRU).
+
+    Opcionalmente, una entrada vencida puede seguir devolviendose durante
+    `obsoleto` segundos mientras se vuelve a calcular en segundo plano.
+
+    Cuenta los aciertos, fallos y entradas obsoletas devueltas.
+    '''
+
+    def __init__(self, maximo=10000, ttl=3600, obsoleto=0):
+        '''
+        args
+        --------
+        maximo -- integer: Cantidad maxima de entradas.
+        ttl -- float: Segundos de validez de cada entrada.
+        obsoleto -- float: Segundos durante los cuales una entrada vencida se
+                           sigue devolviendo mientras se actualiza.
+        '''
+        self.maximo = maximo
+        self.ttl = ttl
+        self.obsoleto = obsoleto
+        self.aciertos = 0
+        self.fallos = 0
+        self.obsoletos = 0
+        self.reloj = time.monotonic
+        # clave -> (vencimiento, valor), de la menos a la mas usada
+        self.__datos = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        # claves que se estan actualizando en segundo plano
+        self.__actualizando = set()
+        # tareas asyncio de actualizacion en curso
+        self.__tareas = set()
+
+    def obtener(self, clave, calcular):
+        '''
+        Devuelve el valor de la clave. Si no esta en la cache, lo obtiene
+        llamando a la funcion calcular y lo guarda.
+        '''
+        valor, estado = self.__buscar(clave)
+        if estado is None:
+            valor = calcular()
+            self.guardar(clave, valor)
+        elif estado == 'actualizar':
+            threading.Thread(target=self.__actualizar,
+                             args=(clave, calcular),
+                             daemon=True).start()
+        return valor
+
+    async def obtener_asincrono(self, clave, calcular):
+        '''
+        Version asincronica de obtener. La funcion calcular debe devolver una
+        corrutina.
+        '''
+        valor, estado = self.__buscar(clave)
+        if estado is None:
+            valor = await calcular()
+            self.guardar(clave, valor)
+        elif estado == 'actualizar':
+            tarea = asyncio.ensure_future(
+                self.__actualizar_asincrono(clave, calcular))
+            self.__tareas.add(tarea)
+            tarea.add_done_callback(self.__tareas.discard)
+        return valor
+
+    def get(self, clave, defecto=None):
+        '''
+        Devuelve el valor vigente de la clave, o el valor por defecto si no
+        esta en la cache o esta vencido.
+        '''
+        with self.__lock:
+            entrada = self.__datos.get(clave)
+            if entrada is not None and self.reloj() < entrada[0]:
+                self.aciertos += 1
+                self.__datos.move_to_end(clave)
+                return entrada[1]
+            self.fallos += 1
+            return defecto
+
+    def guardar(self, clave, valor):
+        '''
+        Guarda el valor de la clave, descartando la entrada menos usada si la
+        cache esta llena.
+        '''
+        with self.__lock:
+            self.__datos[clave] = (self.reloj() + self.ttl, valor)
+            self.__datos.move_to_end(clave)
+            while len(self.__datos) > self.maximo:
+                self.__datos.popitem(last=False)
+
+    def invalidar(self, clave=None):
+        '''
+        Descarta la entrada de la clave dada, o todas si no se indica.
+        '''
+        with self.__lock:
+            if clave is None:
+                self.__datos.clear()
+            else:
+                self.__datos.pop(clave, None)
+
+    def __len__(self):
+        return len(self.__datos)
+
+    def __buscar(self, clave):
+        '''
+        Devuelve una tupla (valor, estado). El estado es None si la clave no
+        esta en la cache, 'actualizar' si la entrada esta obsoleta y hay que
+        actualizarla, o 'ok'.
+        '''
+        with self.__lock:
+            entrada = self.__datos.get(clave)
+            if entrada is not None:
+                vencimiento, valor = entrada
+                ahora = self.reloj()
+                if ahora < vencimiento:
+                    self.aciertos += 1
+                    self.__datos.move_to_end(clave)
+                    return valor, 'ok'
+                if ahora < vencimiento + self.obsoleto:
+                    self.aciertos += 1
+                    self.obsoletos += 1
+                    self.__datos.move_to_end(clave)
+                    if clave in self.__actualizando:
+                        return valor, 'ok'
+                    self.__actualizando.add(clave)
+                    return valor, 'actualizar'
+                del self.__datos[clave]
+            self.fallos += 1
+            return None, None
+
+    def __actualizar(self, clave, calcular):
+        try:
+            self.guardar(clave, calcular())
+        except Exception:
+            # la entrada obsoleta se sigue usando hasta que se descarte
+            pass
+        finally:
+            self.__actualizando.discard(clave)
+
+    async def __actualizar_asincrono(self, clave, calcular):
+        try:
+            self.guardar(clave, await calcular())
+        except Exception:
+            pass
+        finally:
+            self.__actualizando.discard(clave)
+
+
+class CacheCotizaciones(CacheTTL):
+    '''
+    Cache de cotizaciones de envios (ver API.CACHE_COTIZACIONES).
+
+    La clave de cada cotizacion es (cliente, contrato, cp_destino,
+    sucursal_retiro, peso, volumen). El peso y el volumen pueden agruparse en
+    rangos: en ese caso se cotiza con el limite superior del rango y la
+    tarifa se reutiliza para todos los envios del mismo rango. Los rangos
+    deben coincidir con las categorias de peso de la tarifa contratada.
+    '''
+
+    def __init__(self, maximo=10000, ttl=3600, obsoleto=0, rango_peso=None,
+                 rango_volumen=None):
+        '''
+        args
+        --------
+        rango_peso -- float: Tamaño en gramos de los rangos de peso. Si no
+                             se indica, cada peso se cotiza por separado.
+        rango_volumen -- float: Tamaño en centimetros cubicos de los rangos
+                                de volumen.
+        '''
+        super().__init__(maximo=maximo, ttl=ttl, obsoleto=obsoleto)
+        self.rango_peso = rango_peso
+        self.rango_volumen = rango_volumen
+
+    def clave(self, cliente, peso, volumen, cp_destino, contrato,
+              sucursal_retiro=None):
+        '''
+        Devuelve una tupla (clave, peso, volumen) con la clave de la
+        cotizacion y el peso y volumen con los que debe cotizarse.
+        '''
+        peso = self.__redondear(peso, self.rango_peso)
+        volumen = self.__redondear(volumen, self.rango_volumen)
+        clave = (cliente, contrato, _texto(cp_destino),
+                 _texto(sucursal_retiro), float(peso), float(volumen))
+        return clave, peso, volumen
+
+    @staticmethod
+    def __redondear(valor, rango):
+        '''
+        Devuelve el limite superior del rango del valor dado.
+        '''
+        if not rango:
+            return valor
+        return math.ceil(float(valor) / rango) * rango
+
+
+class CacheCodigosPostales(CacheTTL):
+    '''
+    Cache de consultas de codigos postales (ver API.CACHE_CODIGOS_POSTALES).
+
+    Los codigos postales invalidos se guardan aparte, en una cache con un
+    vencimiento mas corto. Ademas de consultar_codigo_postal, las
+    operaciones que reciben un codigo postal (cotizar_envio,
+    consultar_sucursales y confirmar_compra) la consultan para rechazar los
+    codigos invalidos conocidos sin realizar la peticion.
+    '''
+
+    def __init__(self, maximo=10000, ttl=86400, ttl_invalidos=300):
+        '''
+        args
+        --------
+        ttl_invalidos -- float: Segundos durante los cuales se recuerda que un
+                                codigo postal es invalido.
+        '''
+        super().__init__(maximo=maximo, ttl=ttl)
+        self.invalidos = CacheTTL(maximo=maximo, ttl=ttl_invalidos)
+
+    @staticmethod
+    def clave(codigo_postal, codigo_pais="ARG"):
+        '''
+        Devuelve la clave de la consulta de un codigo postal.
+        '''
+        return str(codigo_postal).strip().upper(), codigo_pais
+
+    def invalido(self, codigo_postal, codigo_pais="ARG"):
+        '''
+        Indica si se sabe que el codigo postal es invalido.
+        '''
+        clave = self.clave(codigo_postal, codigo_pais)
+        return self.invalidos.get(clave, False)
+
+    def obtener(self, clave, calcular):
+        if self.invalidos.get(clave, False):
+            raise CodigoPostalInvalido()
+        try:
+            return super().obtener(clave, calcular)
+        except CodigoPostalInvalido:
+            self.invalidos.guardar(clave, True)
+            raise
+
+    async def obtener_asincrono(self, clave, calcular):
+        if self.invalidos.get(clave, False):
+            raise CodigoPostalInvalido()
+        try:
+            return await super().obtener_asincrono(clave, calcular)
+        except CodigoPostalInvalido:
+            self.invalidos.guardar(clave, True)
+            raise
+
+
+def _texto(valor):
+    return None if valor is None else str(valor)
@@ -0,0 +1,70 @@
+'''
+Conversion de las respuestas de suds a diccionarios.
+'''
+import string
+
+from suds.sudsobject import Factory, Object, asdict
+
+# nombres de atributos ya pythonizados
+_PYTHONIZADOS = {}
+_LETRAS = frozenset(string.ascii_letters)
+_MAYUSCULAS = frozenset(string.ascii_uppercase)
+
+
+def a_dict(objeto):
+    '''
+    Convierte un objeto suds en diccionario, con las claves pythonizadas.
+
+    Los objetos anidados, tambien dentro de listas, se convierten en
+    diccionarios. El recorrido es iterativo, por lo que la profundidad de la
+    respuesta no esta limitada por la recursion.
+    '''
+    if not isinstance(objeto, Object):
+        # se recorre igual que suds.sudsobject.asdict
+        objeto = Factory.object(dict=asdict(objeto))
+    claves = _PYTHONIZADOS
+    resultado = {}
+    # tuplas (objeto suds, diccionario a completar)
+    pendientes = [(objeto, resultado)]
+    while pendientes:
+        objeto, destino = pendientes.pop()
+        for clave in objeto.__keylist__:
+            valor = getattr(objeto, clave)
+            try:
+                clave = claves[clave]
+            except KeyError:
+                clave = pythonizar(clave)
+            if isinstance(valor, Object):
+                destino[clave] = anidado = {}
+                pendientes.append((valor, anidado))
+            elif isinstance(valor, list):
+                destino[clave] = lista = []
+                for item in valor:
+                    if isinstance(item, Object):
+                        anidado = {}
+                        lista.append(anidado)
+                        pendientes.append((item, anidado))
+                    else:
+                        lista.append(item)
+            else:
+                destino[clave] = valor
+    return resultado
+
+
+def pythonizar(nombre):
+    '''
+    Pythoniza el nombre de un atributo de formato CamelCase a under_score.
+
+    Los caracteres que no son letras se descartan (Telefono1 -> telefono).
+    '''
+    try:
+        return _PYTHONIZADOS[nombre]
+    except KeyError:
+        pass
+    resultado = [nombre[0].lower()]
+    for char in nombre[1:]:
+        if char in _LETRAS:
+            if char in _MAYUSCULAS:
+                resultado.append("_")
+            resultado.append(char.lower())
+    return _PYTHONIZADOS.setdefault(nombre, ''.join(resultado))
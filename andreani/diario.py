@@ -0,0 +1,223 @@
+'''
+Diario persistente de las altas de envios.
+'''
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+from .excepciones import EnvioIncierto
+from .utiles import normalizar, sin_envio
+
+
+class Diario(object):
+    '''
+    Diario en sqlite de las altas realizadas con confirmar_compra y
+    confirmar_compra_datos_impresion, indexado por numero_transaccion.
+
+    Antes de cada alta se registra la intencion de enviarla y, al obtener
+    respuesta, su resultado. De esta forma, al repetir un alta:
+
+    - si ya se confirmo, se devuelve el resultado registrado sin realizar la
+      peticion.
+    - si se envio sin obtener respuesta (por ejemplo, por un timeout o una
+      caida del proceso), se lanza EnvioIncierto en lugar de arriesgar un
+      envio duplicado. Estas altas se resuelven todas juntas con
+      API.conciliar_altas.
+
+    El mismo diario registra las altas de confirmar_compras_datos_impresion.
+
+    Las altas sin numero_transaccion no se registran.
+
+    >>> API.DIARIO = Diario("altas.db")
+    '''
+
+    PENDIENTE = 'pendiente'
+    CONFIRMADA = 'confirmada'
+
+    def __init__(self, ruta):
+        '''
+        args
+        --------
+        ruta -- string: Archivo de la base de datos. Se crea si no existe.
+        '''
+        self.ruta = ruta
+        self.__lock = threading.Lock()
+        # la conexion se comparte entre hilos, protegida por el lock
+        self.__conexion = sqlite3.connect(ruta, check_same_thread=False,
+                                          isolation_level=None)
+        with self.__lock:
+            self.__conexion.execute('PRAGMA journal_mode=WAL')
+            # cada registro llega al disco antes de realizar la peticion
+            self.__conexion.execute('PRAGMA synchronous=FULL')
+            self.__conexion.execute(
+                'CREATE TABLE IF NOT EXISTS altas ('
+                'numero_transaccion TEXT PRIMARY KEY, '
+                'operacion TEXT NOT NULL, '
+                'estado TEXT NOT NULL, '
+                'parametros TEXT NOT NULL, '
+                'resultado TEXT, '
+                'actualizado REAL NOT NULL)')
+
+    def iniciar(self, numero_transaccion, operacion, parametros):
+        '''
+        Registra la intencion de realizar un alta.
+
+        Devuelve una tupla (confirmada, resultado), con el resultado
+        registrado si el alta ya se confirmo anteriormente. Lanza
+        EnvioIncierto si el alta se envio anteriormente sin obtener
+        respuesta.
+        '''
+        with self.__lock:
+            fila = self.__conexion.execute(
+                'SELECT estado, resultado FROM altas '
+                'WHERE numero_transaccion = ?',
+                (numero_transaccion,)).fetchone()
+            if fila is None:
+                self.__conexion.execute(
+                    'INSERT INTO altas VALUES (?, ?, ?, ?, NULL, ?)',
+                    (numero_transaccion, operacion, self.PENDIENTE,
+                     json.dumps(parametros, default=str), time.time()))
+                return False, None
+        estado, resultado = fila
+        if estado == self.CONFIRMADA:
+            return True, json.loads(resultado)
+        raise EnvioIncierto(numero_transaccion)
+
+    def confirmar(self, numero_transaccion, resultado):
+        '''
+        Registra el resultado de un alta.
+        '''
+        with self.__lock:
+            self.__conexion.execute(
+                'UPDATE altas SET estado = ?, resultado = ?, actualizado = ? '
+                'WHERE numero_transaccion = ?',
+                (self.CONFIRMADA, json.dumps(resultado, default=str),
+                 time.time(), numero_transaccion))
+
+    def fallo(self, numero_transaccion, error):
+        '''
+        Registra un alta fallida. Se descarta cuando el error indica que el
+        envio no se genero, y queda pendiente en caso contrario.
+        '''
+        if sin_envio(error):
+            self.descartar(numero_transaccion)
+
+    def descartar(self, numero_transaccion):
+        '''
+        Quita un alta del diario, de modo que pueda volver a realizarse.
+        '''
+        with self.__lock:
+            self.__conexion.execute(
+                'DELETE FROM altas WHERE numero_transaccion = ?',
+                (numero_transaccion,))
+
+    def estado(self, numero_transaccion):
+        '''
+        Devuelve una tupla (estado, resultado) del alta, o None si no esta
+        registrada.
+        '''
+        with self.__lock:
+            fila = self.__conexion.execute(
+                'SELECT estado, resultado FROM altas '
+                'WHERE numero_transaccion = ?',
+                (numero_transaccion,)).fetchone()
+        if fila is None:
+            return None
+        estado, resultado = fila
+        return estado, json.loads(resultado) if resultado else None
+
+    def pendientes(self):
+        '''
+        Devuelve la lista de tuplas (numero_transaccion, operacion,
+        parametros) de las altas enviadas sin respuesta.
+        '''
+        with self.__lock:
+            filas = self.__conexion.execute(
+                'SELECT numero_transaccion, operacion, parametros '
+                'FROM altas WHERE estado = ? ORDER BY actualizado',
+                (self.PENDIENTE,)).fetchall()
+        return [(numero, operacion, json.loads(parametros))
+                for numero, operacion, parametros in filas]
+
+    def operaciones_pendientes(self):
+        '''
+        Devuelve la lista ordenada de operaciones con altas enviadas sin
+        respuesta.
+        '''
+        with self.__lock:
+            filas = self.__conexion.execute(
+                'SELECT DISTINCT operacion FROM altas WHERE estado = ? '
+                'ORDER BY operacion', (self.PENDIENTE,)).fetchall()
+        return [operacion for operacion, in filas]
+
+    def conciliar(self, envios, operacion):
+        '''
+        Resuelve las altas pendientes de la operacion dada a partir del
+        reporte de envios en el que deberian figurar (ver
+        API.conciliar_altas).
+
+        Cada alta pendiente se asocia al envio del reporte con el mismo
+        destinatario, calle, numero, piso y departamento, que no corresponda
+        a un alta ya confirmada. La localidad y la provincia no se comparan,
+        ya que el webservice las reemplaza por sus propios nombres. Si hay
+        mas de un envio o mas de un alta pendiente con el mismo destino, no
+        se sabe cual corresponde a cada alta y quedan pendientes.
+
+        Las altas asociadas se confirman con el numero Andreani del envio.
+        Las demas quedan pendientes, ya que no se sabe si el envio no se
+        genero o si todavia no figura en el reporte; pueden quitarse con
+        descartar para volver a realizarlas.
+
+        Devuelve un diccionario que asocia cada numero_transaccion pendiente
+        de la operacion con su resultado, o None si sigue pendiente.
+        '''
+        with self.__lock:
+            filas = self.__conexion.execute(
+                'SELECT resultado FROM altas WHERE estado = ?',
+                (self.CONFIRMADA,)).fetchall()
+        conocidos = set()
+        for resultado, in filas:
+            resultado = json.loads(resultado) if resultado else None
+            if isinstance(resultado, dict):
+                conocidos.add(resultado.get('numero_andreani'))
+        disponibles = collections.defaultdict(list)
+        for envio in envios or []:
+            if envio.get('numero_andreani') not in conocidos:
+                disponibles[_destino(envio.get('nombrey_apellido'),
+                                     envio)].append(envio)
+        pendientes = [(numero, _destino(parametros.get('nombre_apellido'),
+                                        parametros))
+                      for numero, pendiente, parametros in self.pendientes()
+                      if pendiente == operacion]
+        altas = collections.Counter(destino for numero, destino in pendientes)
+        resultados = {}
+        for numero, destino in pendientes:
+            candidatos = disponibles.get(destino, [])
+            if len(candidatos) == 1 and altas[destino] == 1:
+                resultados[numero] = {
+                    'numero_andreani': candidatos[0].get('numero_andreani')}
+                self.confirmar(numero, resultados[numero])
+            else:
+                resultados[numero] = None
+        return resultados
+
+    def cerrar(self):
+        with self.__lock:
+            self.__conexion.close()
+
+    def __len__(self):
+        with self.__lock:
+            return self.__conexion.execute(
+                'SELECT COUNT(*) FROM altas').fetchone()[0]
+
+
+def _destino(nombre_apellido, datos):
+    '''
+    Devuelve una tupla normalizada con el destinatario y la direccion de un
+    envio, sin la localidad ni la provincia (ver Diario.conciliar).
+    '''
+    return tuple(normalizar(valor or '') for valor in (
+        nombre_apellido, datos.get('calle'), datos.get('numero'),
+        datos.get('piso'), datos.get('departamento')))
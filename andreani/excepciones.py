@@ -0,0 +1,31 @@
+'''
+Excepciones lanzadas por el modulo andreani.
+
+No depende de suds, de modo que puede importarse sin cargarlo.
+'''
+from gettext import gettext as _
+
+
+class CodigoPostalInvalido(ValueError):
+    '''
+    Excepcion lanzada cuando el servidor devuelve codigo postal invalido.
+    '''
+    pass
+
+
+class APIError(Exception):
+    '''
+    Excepcion lanzada cada vez que haya un error con el webservice de Andreani.
+    '''
+    pass
+
+
+class EnvioIncierto(APIError):
+    '''
+    Excepcion lanzada cuando un alta se envio sin obtener respuesta, por lo
+    que no se sabe si el envío se genero.
+    '''
+    def __init__(self, numero_transaccion):
+        super().__init__(_("No se sabe si se genero el envio %s" %
+                           numero_transaccion))
+        self.numero_transaccion = numero_transaccion
@@ -0,0 +1,192 @@
+'''
+Lectura directa del XML de las respuestas SOAP, sin armar los objetos de
+suds.
+'''
+import io
+import xml.etree.ElementTree as ElementTree
+
+from .conversion import pythonizar
+
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+# tipos precalculados por id del elemento de esquema de suds
+_TIPOS = {}
+
+
+def resultado(body, tipo, error):
+    '''
+    Devuelve el elemento del resultado de la respuesta convertido igual que
+    suds y API, o None si la respuesta no lo tiene.
+
+    args
+    --------
+    body -- bytes: Cuerpo de la respuesta HTTP.
+    tipo -- Tipo: Tipo del elemento del resultado (ver tipo_resultado).
+    error -- function: Recibe el texto de un fault y devuelve la excepcion a
+                       lanzar.
+    '''
+    for item in filas(body, tipo.nombre, error, tipo):
+        return item
+    return None
+
+
+def filas(body, fila, error, tipo=None):
+    '''
+    Genera un diccionario por cada elemento `fila` de la respuesta, a medida
+    que se lee el XML.
+
+    Cada elemento se convierte y se descarta antes de leer el siguiente, por
+    lo que ademas del cuerpo solo se mantiene en memoria la fila actual.
+
+    args
+    --------
+    body -- bytes: Cuerpo de la respuesta HTTP.
+    fila -- string: Nombre local de los elementos a generar.
+    error -- function: Recibe el texto de un fault y devuelve la excepcion a
+                       lanzar.
+    tipo -- Tipo: Tipo de los elementos. Si no se indica, se convierten sin
+                  esquema (ver convertir).
+    '''
+    # pila de elementos abiertos, para quitar cada fila de su padre
+    abiertos = []
+    primera = True
+    for evento, elemento in ElementTree.iterparse(io.BytesIO(body),
+                                                  events=('start', 'end')):
+        if evento == 'start':
+            abiertos.append(elemento)
+            continue
+        abiertos.pop()
+        nombre = _local(elemento.tag)
+        if nombre == fila:
+            valor = (convertir(elemento) if tipo is None
+                     else tipo.convertir(elemento))
+            # igual que suds, una primera fila vacia se omite
+            if valor is not None or not primera:
+                yield valor
+            primera = False
+            elemento.clear()
+            if abiertos:
+                abiertos[-1].remove(elemento)
+        elif nombre == 'Fault':
+            raise error(_texto_fault(elemento))
+
+
+def convertir(elemento):
+    '''
+    Convierte un elemento en diccionario, con las claves pythonizadas igual
+    que API. Los elementos sin hijos se convierten en su texto, o None si
+    estan vacios, y los hijos repetidos en listas.
+    '''
+    if elemento.get(XSI_NIL) == 'true':
+        return None
+    if len(elemento) == 0:
+        return elemento.text or None
+    resultado = {}
+    for hijo in elemento:
+        clave = pythonizar(_local(hijo.tag))
+        valor = convertir(hijo)
+        if clave not in resultado:
+            resultado[clave] = valor
+        elif isinstance(resultado[clave], list):
+            resultado[clave].append(valor)
+        else:
+            resultado[clave] = [resultado[clave], valor]
+    return resultado
+
+
+def tipo_resultado(metodo):
+    '''
+    Devuelve el Tipo del resultado del metodo de suds dado.
+    '''
+    esquema = metodo.binding.output.returned_types(metodo)[0]
+    return tipo(esquema)
+
+
+def tipo(esquema):
+    '''
+    Devuelve el Tipo del elemento de esquema de suds dado. Los tipos se
+    calculan una unica vez por elemento.
+    '''
+    try:
+        return _TIPOS[id(esquema)][1]
+    except KeyError:
+        pass
+    nuevo = Tipo(esquema)
+    # registro el tipo antes de recorrer sus hijos, que pueden ser
+    # recursivos
+    _TIPOS.setdefault(id(esquema), (esquema, nuevo))
+    resuelto = esquema.resolve()
+    if not resuelto.builtin():
+        for hijo, ancestros in resuelto.children():
+            nuevo.hijos[hijo.name] = (pythonizar(hijo.name),
+                                      hijo.multi_occurrence(),
+                                      tipo(hijo))
+    return nuevo
+
+
+class Tipo(object):
+    '''
+    Descripcion de un elemento del esquema, precalculada para convertir sus
+    elementos xml igual que suds: los valores se traducen segun su tipo
+    (int, float, etc.), los elementos vacios se convierten en None y los
+    que pueden repetirse en listas.
+    '''
+
+    def __init__(self, esquema):
+        resuelto = esquema.resolve()
+        self.nombre = esquema.name
+        self.simple = resuelto if resuelto.builtin() else None
+        self.nillable = bool(esquema.nillable or
+                             (resuelto.builtin() and resuelto.nillable))
+        # nombre del hijo -> (clave, multiple, Tipo)
+        self.hijos = {}
+
+    def convertir(self, elemento):
+        '''
+        Convierte un elemento xml de este tipo.
+        '''
+        if elemento.get(XSI_NIL) == 'true':
+            return None
+        if len(elemento) == 0:
+            texto = elemento.text
+            if texto is None or (self.simple is None and not texto.strip()):
+                return None if self.nillable else ''
+            if self.simple is not None:
+                return self.simple.translate(texto)
+            return texto
+        resultado = {}
+        for hijo in elemento:
+            nombre = _local(hijo.tag)
+            try:
+                clave, multiple, tipo = self.hijos[nombre]
+            except KeyError:
+                # elemento fuera del esquema
+                resultado[pythonizar(nombre)] = convertir(hijo)
+                continue
+            valor = tipo.convertir(hijo)
+            if multiple and valor is None and clave not in resultado:
+                # igual que suds, si el primer elemento repetido esta vacio
+                # se omite y queda una lista vacia
+                resultado[clave] = []
+            elif multiple:
+                resultado.setdefault(clave, []).append(valor)
+            else:
+                resultado[clave] = valor
+        return resultado
+
+
+def _local(tag):
+    '''
+    Devuelve el nombre del tag sin el espacio de nombres.
+    '''
+    return tag.rsplit('}', 1)[-1]
+
+
+def _texto_fault(fault):
+    '''
+    Devuelve el texto de un fault de SOAP 1.2 (Reason/Text) o SOAP 1.1
+    (faultstring).
+    '''
+    for elemento in fault.iter():
+        if _local(elemento.tag) in ('Text', 'faultstring'):
+            return elemento.text
+    return None
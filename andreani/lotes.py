@@ -0,0 +1,270 @@
+'''
+Ejecucion de lotes de peticiones con concurrencia acotada.
+'''
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+
+
+def ejecutar(funcion, items, concurrencia=10, ordenado=True, clave=None):
+    '''
+    Aplica la funcion a cada item del iterable usando un pool de hilos.
+
+    Genera tuplas (item, resultado). Si la llamada lanza una excepcion, el
+    resultado es la excepcion en lugar de interrumpir el lote. Los items se
+    consumen a medida que se liberan lugares, por lo que el iterable puede
+    ser un generador de cualquier tamaño.
+
+    args
+    --------
+    concurrencia -- integer: Cantidad maxima de llamadas simultaneas.
+    ordenado -- boolean: Si es verdadero los resultados se generan en el orden
+                         de los items. Caso contrario, a medida que se
+                         completan.
+    clave -- function: Si se indica, los items con la misma clave se
+                       resuelven con una unica llamada.
+    '''
+    items = iter(items)
+    # futuros por clave, para los items repetidos
+    compartidos = {}
+    # tuplas (item, futuro) aun no generadas
+    pendientes = collections.deque()
+    # en orden, un item lento no debe frenar a los siguientes
+    ventana = concurrencia * 2 if ordenado else concurrencia
+    executor = concurrent.futures.ThreadPoolExecutor(concurrencia)
+
+    def llenar():
+        for item in items:
+            if clave is None:
+                futuro = executor.submit(funcion, item)
+            else:
+                k = clave(item)
+                futuro = compartidos.get(k)
+                if futuro is None:
+                    futuro = compartidos[k] = executor.submit(funcion, item)
+            pendientes.append((item, futuro))
+            if len(pendientes) >= ventana:
+                return
+
+    try:
+        llenar()
+        while pendientes:
+            if ordenado:
+                item, futuro = pendientes.popleft()
+                yield item, _resultado(futuro)
+            else:
+                concurrent.futures.wait(
+                    [futuro for item, futuro in pendientes],
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                listos = [p for p in pendientes if p[1].done()]
+                for p in listos:
+                    pendientes.remove(p)
+                for item, futuro in listos:
+                    yield item, _resultado(futuro)
+            llenar()
+    finally:
+        # si se abandona el generador, no inicio las llamadas pendientes
+        for item, futuro in pendientes:
+            futuro.cancel()
+        executor.shutdown()
+
+
+async def ejecutar_asincrono(funcion, items, concurrencia=10, ordenado=True,
+                             clave=None):
+    '''
+    Version asincronica de ejecutar. La funcion debe devolver una corrutina.
+
+    Genera tuplas (item, resultado) de forma asincronica.
+    '''
+    items = iter(items)
+    compartidos = {}
+    pendientes = collections.deque()
+    ventana = concurrencia * 2 if ordenado else concurrencia
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def llamar(item):
+        async with semaforo:
+            return await funcion(item)
+
+    def llenar():
+        for item in items:
+            if clave is None:
+                tarea = asyncio.ensure_future(llamar(item))
+            else:
+                k = clave(item)
+                tarea = compartidos.get(k)
+                if tarea is None:
+                    tarea = compartidos[k] = asyncio.ensure_future(
+                        llamar(item))
+            pendientes.append((item, tarea))
+            if len(pendientes) >= ventana:
+                return
+
+    try:
+        llenar()
+        while pendientes:
+            if ordenado:
+                item, tarea = pendientes.popleft()
+                await asyncio.wait([tarea])
+                yield item, _resultado(tarea)
+            else:
+                await asyncio.wait(
+                    set(tarea for item, tarea in pendientes),
+                    return_when=asyncio.FIRST_COMPLETED)
+                listos = [p for p in pendientes if p[1].done()]
+                for p in listos:
+                    pendientes.remove(p)
+                for item, tarea in listos:
+                    yield item, _resultado(tarea)
+            llenar()
+    finally:
+        for item, tarea in pendientes:
+            tarea.cancel()
+
+
+class Limitador(object):
+    '''
+    Limita la cantidad de llamadas por segundo, espaciandolas de forma
+    uniforme. Puede compartirse entre hilos.
+    '''
+
+    def __init__(self, por_segundo):
+        '''
+        args
+        --------
+        por_segundo -- float: Cantidad maxima de llamadas por segundo.
+        '''
+        self.intervalo = 1.0 / por_segundo
+        self.reloj = time.monotonic
+        self.__siguiente = 0
+        self.__lock = threading.Lock()
+
+    def esperar(self):
+        '''
+        Bloquea hasta que pueda realizarse la siguiente llamada.
+        '''
+        demora = self.__reservar()
+        if demora > 0:
+            time.sleep(demora)
+
+    async def esperar_asincrono(self):
+        '''
+        Version asincronica de esperar.
+        '''
+        demora = self.__reservar()
+        if demora > 0:
+            await asyncio.sleep(demora)
+
+    def limitar(self, funcion):
+        '''
+        Devuelve una funcion que espera su turno antes de llamar a la dada.
+        '''
+        def limitada(*args, **kwargs):
+            self.esperar()
+            return funcion(*args, **kwargs)
+        return limitada
+
+    def limitar_asincrono(self, funcion):
+        '''
+        Version asincronica de limitar. La funcion debe devolver una
+        corrutina.
+        '''
+        async def limitada(*args, **kwargs):
+            await self.esperar_asincrono()
+            return await funcion(*args, **kwargs)
+        return limitada
+
+    def __reservar(self):
+        '''
+        Reserva el siguiente turno y devuelve los segundos que faltan para
+        el.
+        '''
+        with self.__lock:
+            ahora = self.reloj()
+            turno = max(ahora, self.__siguiente)
+            self.__siguiente = turno + self.intervalo
+            return turno - ahora
+
+
+class Retroceso(object):
+    '''
+    Demora adaptativa entre llamadas, compartida entre hilos.
+
+    Cada error transitorio multiplica la demora por `factor`, hasta
+    `maximo`, y cada llamada exitosa la divide, hasta volver a cero. Asi las
+    llamadas se espacian mientras el servidor esta saturado y recuperan su
+    ritmo cuando se normaliza.
+    '''
+
+    def __init__(self, inicial=0.5, maximo=60, factor=2):
+        '''
+        args
+        --------
+        inicial -- float: Segundos de demora luego del primer error.
+        maximo -- float: Segundos maximos de demora.
+        factor -- float: Factor por el que crece o decrece la demora.
+        '''
+        self.inicial = inicial
+        self.maximo = maximo
+        self.factor = factor
+        self.demora = 0
+        self.dormir = time.sleep
+        self.__lock = threading.Lock()
+
+    def esperar(self):
+        '''
+        Bloquea durante la demora actual.
+        '''
+        demora = self.demora
+        if demora > 0:
+            self.dormir(demora)
+
+    async def esperar_asincrono(self):
+        '''
+        Version asincronica de esperar.
+        '''
+        demora = self.demora
+        if demora > 0:
+            await asyncio.sleep(demora)
+
+    def error(self):
+        '''
+        Registra un error transitorio y aumenta la demora.
+        '''
+        with self.__lock:
+            self.demora = min(self.maximo,
+                              max(self.inicial, self.demora * self.factor))
+
+    def exito(self):
+        '''
+        Registra una llamada exitosa y reduce la demora.
+        '''
+        with self.__lock:
+            demora = self.demora / self.factor
+            self.demora = demora if demora >= self.inicial else 0
+
+
+def partir(items, cantidad):
+    '''
+    Genera listas de a lo sumo `cantidad` items consecutivos del iterable.
+    '''
+    lote = []
+    for item in items:
+        lote.append(item)
+        if len(lote) >= cantidad:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _resultado(futuro):
+    '''
+    Devuelve el resultado del futuro, o la excepcion que lanzo.
+    '''
+    try:
+        return futuro.result()
+    except Exception as e:
+        return e
@@ -0,0 +1,188 @@
+'''
+Metricas en memoria de las peticiones realizadas por la API.
+'''
+import bisect
+import threading
+
+from .andreani import API
+
+# limites en segundos de los buckets del histograma de latencia
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# caches de la API incluidas en las metricas: nombre -> atributo
+CACHES = {'cotizaciones': 'CACHE_COTIZACIONES',
+          'codigos_postales': 'CACHE_CODIGOS_POSTALES'}
+
+
+class Metricas(object):
+    '''
+    Registro de metricas de las peticiones SOAP, por operacion de API._URL:
+    cantidad de llamadas, errores por clase de excepcion, peticiones en
+    curso e histograma de latencia. Incluye ademas los aciertos y fallos de
+    las caches de la API.
+
+    Se instala como oyente de la API (ver API.OYENTES) y puede exportarse
+    como diccionario o en el formato de texto de Prometheus.
+
+    >>> metricas = Metricas()
+    >>> API.OYENTES = (metricas,)
+    >>> metricas.prometheus()
+    '''
+
+    def __init__(self, api=API, buckets=BUCKETS):
+        '''
+        args
+        --------
+        api -- API: Clase o instancia de la que se toman las operaciones y
+                    las caches.
+        buckets -- tuple: Limites en segundos de los buckets del
+                          histograma, en orden creciente.
+        '''
+        self.api = api
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__operaciones = {}
+        for operaciones in api._URL.values():
+            for operacion in operaciones:
+                self.__operacion(operacion)
+
+    def iniciar(self, evento):
+        '''
+        Registra el comienzo de una peticion.
+        '''
+        with self.__lock:
+            self.__operacion(evento.operacion).en_curso += 1
+
+    def __call__(self, evento):
+        '''
+        Registra una peticion terminada.
+        '''
+        indice = bisect.bisect_left(self.buckets, evento.duracion)
+        with self.__lock:
+            operacion = self.__operacion(evento.operacion)
+            operacion.en_curso -= 1
+            operacion.llamadas += 1
+            operacion.suma += evento.duracion
+            operacion.buckets[indice] += 1
+            if evento.error is not None:
+                operacion.errores[evento.resultado] = (
+                    operacion.errores.get(evento.resultado, 0) + 1)
+
+    def a_dict(self):
+        '''
+        Devuelve una copia de las metricas como diccionario:
+
+        {'operaciones': {operacion: {'llamadas': n, 'en_curso': n,
+                                     'errores': {clase: n},
+                                     'latencia': {'buckets': {limite: n},
+                                                  'suma': segundos,
+                                                  'cantidad': n}}},
+         'caches': {nombre: {'aciertos': n, 'fallos': n}}}
+
+        Los buckets son acumulados, igual que en Prometheus.
+        '''
+        with self.__lock:
+            operaciones = {nombre: operacion.a_dict(self.buckets)
+                           for nombre, operacion
+                           in self.__operaciones.items()}
+        caches = {}
+        for nombre, atributo in CACHES.items():
+            cache = getattr(self.api, atributo, None)
+            if cache is not None:
+                caches[nombre] = {'aciertos': cache.aciertos,
+                                  'fallos': cache.fallos}
+        return {'operaciones': operaciones, 'caches': caches}
+
+    def prometheus(self, prefijo='andreani'):
+        '''
+        Devuelve las metricas en el formato de texto de Prometheus.
+        '''
+        metricas = self.a_dict()
+        operaciones = sorted(metricas['operaciones'].items())
+        lineas = []
+
+        def metrica(nombre, tipo, ayuda, muestras):
+            nombre = '%s_%s' % (prefijo, nombre)
+            lineas.append('# HELP %s %s' % (nombre, ayuda))
+            lineas.append('# TYPE %s %s' % (nombre, tipo))
+            for sufijo, etiquetas, valor in muestras:
+                lineas.append('%s%s{%s} %s' % (
+                    nombre, sufijo,
+                    ','.join('%s="%s"' % (clave, _escapar(etiqueta))
+                             for clave, etiqueta in etiquetas),
+                    valor))
+
+        metrica('llamadas_total', 'counter', 'Peticiones SOAP terminadas.',
+                [('', [('operacion', nombre)], operacion['llamadas'])
+                 for nombre, operacion in operaciones])
+        metrica('errores_total', 'counter',
+                'Peticiones SOAP fallidas por clase de excepcion.',
+                [('', [('operacion', nombre), ('error', error)], cantidad)
+                 for nombre, operacion in operaciones
+                 for error, cantidad in sorted(operacion['errores'].items())])
+        metrica('en_curso', 'gauge', 'Peticiones SOAP en curso.',
+                [('', [('operacion', nombre)], operacion['en_curso'])
+                 for nombre, operacion in operaciones])
+        muestras = []
+        for nombre, operacion in operaciones:
+            latencia = operacion['latencia']
+            for limite, cantidad in latencia['buckets'].items():
+                muestras.append(('_bucket', [('operacion', nombre),
+                                             ('le', limite)], cantidad))
+            muestras.append(('_sum', [('operacion', nombre)],
+                             latencia['suma']))
+            muestras.append(('_count', [('operacion', nombre)],
+                             latencia['cantidad']))
+        metrica('latencia_segundos', 'histogram',
+                'Duracion de las peticiones SOAP.', muestras)
+        caches = sorted(metricas['caches'].items())
+        metrica('cache_aciertos_total', 'counter', 'Aciertos de las caches.',
+                [('', [('cache', nombre)], cache['aciertos'])
+                 for nombre, cache in caches])
+        metrica('cache_fallos_total', 'counter', 'Fallos de las caches.',
+                [('', [('cache', nombre)], cache['fallos'])
+                 for nombre, cache in caches])
+        return '\n'.join(lineas) + '\n'
+
+    def __operacion(self, nombre):
+        '''
+        Devuelve las metricas de la operacion dada, creandolas si no
+        existen. Debe llamarse con el lock tomado.
+        '''
+        try:
+            return self.__operaciones[nombre]
+        except KeyError:
+            operacion = self.__operaciones[nombre] = _Operacion(
+                len(self.buckets))
+            return operacion
+
+
+class _Operacion(object):
+    '''
+    Contadores de una operacion.
+    '''
+
+    def __init__(self, buckets):
+        self.llamadas = 0
+        self.en_curso = 0
+        self.suma = 0.0
+        # cantidad por bucket, sin acumular. El ultimo es +Inf
+        self.buckets = [0] * (buckets + 1)
+        self.errores = {}
+
+    def a_dict(self, limites):
+        buckets = {}
+        acumulado = 0
+        for limite, cantidad in zip(limites + ('+Inf',), self.buckets):
+            acumulado += cantidad
+            buckets[str(limite)] = acumulado
+        return {'llamadas': self.llamadas,
+                'en_curso': self.en_curso,
+                'errores': dict(self.errores),
+                'latencia': {'buckets': buckets,
+                             'suma': self.suma,
+                             'cantidad': self.llamadas}}
+
+
+def _escapar(valor):
+    return (str(valor).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
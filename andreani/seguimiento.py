@@ -0,0 +1,254 @@
+'''
+Seguimiento periodico del estado de distribucion de los envios.
+'''
+import heapq
+import itertools
+import time
+
+from .utiles import normalizar
+
+
+class Seguimiento(object):
+    '''
+    Consulta periodicamente el ultimo estado de distribucion de un conjunto
+    de piezas e informa unicamente los cambios de estado.
+
+    Cada pieza se vuelve a consultar luego de un intervalo que depende de su
+    estado (por ejemplo, seguido mientras esta en distribucion y cada varias
+    horas si recien ingreso) y de su antiguedad, ya que un envio que lleva
+    dias sin entregarse rara vez cambia de un momento a otro. Cada consulta
+    sin cambios multiplica el intervalo por `factor`, hasta
+    `intervalo_maximo`. Las piezas que llegan a un estado final dejan de
+    consultarse.
+
+    Las piezas que vencen juntas se consultan con
+    API.consulta_ultimos_estados_distribucion, varias por peticion.
+
+    >>> seguimiento = Seguimiento(api, al_cambiar=notificar)
+    >>> seguimiento.agregar("*00000000249801")
+    >>> for pieza, anterior, actual in seguimiento.cambios():
+    ...     pass
+    '''
+
+    # segundos entre consultas segun el estado
+    INTERVALOS = {
+        'EN DISTRIBUCION': 15 * 60,
+        'INGRESADO': 6 * 60 * 60,
+        'ENVIO NO INGRESADO': 6 * 60 * 60,
+    }
+    # estados que ya no cambian
+    FINALES = ('ENTREGADA', 'ENTREGADO', 'ANULADA', 'ANULADO')
+    # tuplas (antiguedad en segundos, factor del intervalo)
+    EDADES = ((2 * 24 * 60 * 60, 2), (7 * 24 * 60 * 60, 4))
+
+    def __init__(self,
+                 api,
+                 intervalos=None,
+                 intervalo=60 * 60,
+                 intervalo_maximo=24 * 60 * 60,
+                 factor=1.5,
+                 edades=None,
+                 finales=None,
+                 al_cambiar=None,
+                 por_peticion=50,
+                 concurrencia=4):
+        '''
+        args
+        --------
+        api -- API: Instancia utilizada para consultar los estados.
+        intervalos -- dict: Segundos entre consultas para cada estado. Se
+                            agregan a los de Seguimiento.INTERVALOS.
+        intervalo -- float: Segundos entre consultas de los estados que no
+                            estan en intervalos.
+        intervalo_maximo -- float: Intervalo maximo entre consultas.
+        factor -- float: Factor por el que se multiplica el intervalo luego
+                         de cada consulta sin cambios.
+        edades -- iterable: Tuplas (segundos, factor). El intervalo de las
+                            piezas con al menos esa antiguedad se multiplica
+                            por el factor de la mayor antiguedad alcanzada.
+                            Por defecto Seguimiento.EDADES.
+        finales -- iterable: Estados que ya no cambian. Por defecto
+                             Seguimiento.FINALES.
+        al_cambiar -- function: Se llama con (pieza, anterior, actual) en
+                                cada cambio de estado.
+        por_peticion -- integer: Cantidad maxima de piezas por peticion.
+        concurrencia -- integer: Cantidad maxima de peticiones simultaneas.
+        '''
+        self.api = api
+        self.intervalos = dict((normalizar(k), v) for k, v in
+                               self.INTERVALOS.items())
+        self.intervalos.update((normalizar(k), v) for k, v in
+                               (intervalos or {}).items())
+        self.intervalo = intervalo
+        self.intervalo_maximo = intervalo_maximo
+        self.factor = factor
+        self.edades = sorted(self.EDADES if edades is None else edades)
+        self.finales = set(normalizar(e) for e in
+                           (self.FINALES if finales is None else finales))
+        self.al_cambiar = al_cambiar
+        self.por_peticion = por_peticion
+        self.concurrencia = concurrencia
+        self.reloj = time.time
+        self.dormir = time.sleep
+        self.__piezas = {}
+        # heap de tuplas (proxima consulta, orden, pieza, datos)
+        self.__agenda = []
+        self.__orden = itertools.count()
+
+    def agregar(self, numero_andreani, numero_pieza=None, estado=None,
+                desde=None):
+        '''
+        Agrega una pieza al seguimiento. Se consulta en la proxima ronda.
+
+        args
+        --------
+        estado -- dict: Ultimo estado conocido de la pieza, tal como lo
+                        devuelve consulta_ultimo_estado_distribucion. Si no
+                        se indica, el primer estado consultado se informa
+                        como un cambio.
+        desde -- float: Momento en que se genero el envio (segun reloj,
+                        por defecto time.time), del que depende su
+                        antiguedad. Si no se indica, se toma el momento en
+                        que se agrega.
+        '''
+        pieza = (numero_andreani, numero_pieza)
+        datos = _Pieza(estado, self.reloj() if desde is None else desde)
+        self.__piezas[pieza] = datos
+        self.__agendar(pieza, datos, 0)
+
+    def quitar(self, numero_andreani, numero_pieza=None):
+        '''
+        Quita una pieza del seguimiento.
+        '''
+        self.__piezas.pop((numero_andreani, numero_pieza), None)
+
+    def estado(self, numero_andreani, numero_pieza=None):
+        '''
+        Devuelve el ultimo estado conocido de una pieza en seguimiento.
+        '''
+        datos = self.__piezas.get((numero_andreani, numero_pieza))
+        return datos.estado if datos else None
+
+    def __len__(self):
+        return len(self.__piezas)
+
+    def proxima(self):
+        '''
+        Devuelve los segundos que faltan para la proxima consulta, o None si
+        no hay piezas en seguimiento.
+        '''
+        self.__descartar_invalidas()
+        if not self.__agenda:
+            return None
+        return max(0, self.__agenda[0][0] - self.reloj())
+
+    def consultar(self):
+        '''
+        Consulta las piezas cuyo intervalo vencio.
+
+        Devuelve la lista de cambios como tuplas (pieza, anterior, actual),
+        donde pieza es la tupla (numero_andreani, numero_pieza) y anterior y
+        actual son los estados.
+        '''
+        ahora = self.reloj()
+        vencidas = []
+        self.__descartar_invalidas()
+        while self.__agenda and self.__agenda[0][0] <= ahora:
+            proxima, orden, pieza, datos = heapq.heappop(self.__agenda)
+            vencidas.append((pieza, datos))
+            self.__descartar_invalidas()
+        if not vencidas:
+            return []
+        estados = self.api.consulta_ultimos_estados_distribucion(
+            [pieza for pieza, datos in vencidas],
+            por_peticion=self.por_peticion,
+            concurrencia=self.concurrencia)
+        cambios = []
+        for pieza, datos in vencidas:
+            if self.__piezas.get(pieza) is not datos:
+                # la pieza se quito mientras se consultaba
+                continue
+            actual = estados.get(pieza)
+            if actual is None or isinstance(actual, Exception):
+                # vuelvo a intentar en el proximo intervalo
+                self.__agendar(pieza, datos, self.__intervalo(datos))
+                continue
+            if _nombre(actual) != _nombre(datos.estado):
+                cambios.append((pieza, datos.estado, actual))
+                datos.sin_cambios = 0
+            else:
+                datos.sin_cambios += 1
+            datos.estado = actual
+            if _nombre(actual) in self.finales:
+                del self.__piezas[pieza]
+            else:
+                self.__agendar(pieza, datos, self.__intervalo(datos))
+        if self.al_cambiar is not None:
+            for cambio in cambios:
+                self.al_cambiar(*cambio)
+        return cambios
+
+    def cambios(self):
+        '''
+        Genera los cambios de estado a medida que ocurren, hasta que no
+        queden piezas en seguimiento.
+        '''
+        while self.__piezas:
+            for cambio in self.consultar():
+                yield cambio
+            espera = self.proxima()
+            if espera:
+                self.dormir(espera)
+
+    def __intervalo(self, datos):
+        '''
+        Devuelve los segundos hasta la proxima consulta de la pieza.
+        '''
+        base = self.intervalos.get(_nombre(datos.estado), self.intervalo)
+        edad = self.reloj() - datos.desde
+        # factor de la mayor antiguedad alcanzada
+        for minimo, factor in reversed(self.edades):
+            if edad >= minimo:
+                base *= factor
+                break
+        return min(self.intervalo_maximo,
+                   base * self.factor ** datos.sin_cambios)
+
+    def __agendar(self, pieza, datos, segundos):
+        datos.proxima = self.reloj() + segundos
+        heapq.heappush(self.__agenda,
+                       (datos.proxima, next(self.__orden), pieza, datos))
+
+    def __descartar_invalidas(self):
+        '''
+        Descarta de la agenda las piezas quitadas o reagendadas.
+        '''
+        while self.__agenda:
+            proxima, orden, pieza, datos = self.__agenda[0]
+            if (self.__piezas.get(pieza) is datos and
+                    datos.proxima == proxima):
+                return
+            heapq.heappop(self.__agenda)
+
+
+class _Pieza(object):
+    '''
+    Datos del seguimiento de una pieza.
+    '''
+
+    def __init__(self, estado, desde):
+        self.estado = estado
+        # momento en que se genero el envio
+        self.desde = desde
+        # consultas consecutivas sin cambios de estado
+        self.sin_cambios = 0
+        self.proxima = None
+
+
+def _nombre(estado):
+    '''
+    Devuelve el nombre normalizado del estado.
+    '''
+    if not estado or not estado.get('estado'):
+        return None
+    return normalizar(estado['estado'])
@@ -0,0 +1,317 @@
+'''
+Catalogo local de sucursales Andreani.
+'''
+import collections
+import heapq
+import math
+import threading
+import time
+
+from .utiles import normalizar
+
+
+class IndiceSucursales(object):
+    '''
+    Catalogo en memoria de las sucursales Andreani, indexado por codigo
+    postal, provincia, localidad y numero de sucursal.
+
+    Descarga una unica vez la lista completa de sucursales (consulta sin
+    filtros) y responde las consultas filtradas localmente. La lista se
+    vuelve a descargar en segundo plano cada `intervalo` segundos, mientras
+    se siguen respondiendo consultas con la anterior.
+
+    El codigo postal, la localidad y la provincia se obtienen de la direccion
+    de cada sucursal ("calle numero, codigo postal, localidad, provincia").
+    Las comparaciones no distinguen mayusculas ni acentos.
+
+    Tambien permite buscar las sucursales mas cercanas a un punto, segun su
+    latitud y longitud. Las sucursales sin coordenadas se omiten.
+
+    >>> indice = IndiceSucursales(api)
+    >>> indice.consultar(localidad="San Justo")
+    >>> indice.cercanas(-34.6037, -58.3816, cantidad=3)
+    '''
+
+    def __init__(self, api, intervalo=86400):
+        '''
+        args
+        --------
+        api -- API: Instancia utilizada para descargar las sucursales.
+        intervalo -- float: Segundos entre cada actualizacion de la lista.
+        '''
+        self.api = api
+        self.intervalo = intervalo
+        self.reloj = time.monotonic
+        self.__catalogo = None
+        self.__actualizado = None
+        self.__lock = threading.Lock()
+        self.__actualizando = False
+
+    def actualizar(self):
+        '''
+        Descarga la lista de sucursales y reconstruye los indices.
+        '''
+        sucursales = self.api.consultar_sucursales()
+        catalogo = _Catalogo(sucursales)
+        # reemplazo el catalogo completo de una vez, las consultas en curso
+        # siguen usando el anterior
+        self.__catalogo = catalogo
+        self.__actualizado = self.reloj()
+
+    def consultar(self, codigo_postal=None, localidad=None, provincia=None):
+        '''
+        Devuelve la lista de sucursales que cumplen todos los filtros dados,
+        o todas si no se indica ninguno. Recibe los mismos filtros que
+        API.consultar_sucursales.
+        '''
+        catalogo = self.__obtener_catalogo()
+        filtros = [(indice, normalizar(valor))
+                   for indice, valor in ((catalogo.por_codigo_postal,
+                                          codigo_postal),
+                                         (catalogo.por_localidad, localidad),
+                                         (catalogo.por_provincia, provincia))
+                   if valor]
+        if not filtros:
+            return list(catalogo.sucursales)
+        # parto de la lista mas corta y verifico los demas filtros
+        filtros.sort(key=lambda f: len(f[0].get(f[1], ())))
+        indice, clave = filtros[0]
+        resultado = indice.get(clave, [])
+        for indice, clave in filtros[1:]:
+            numeros = set(s['sucursal'] for s in indice.get(clave, ()))
+            resultado = [s for s in resultado if s['sucursal'] in numeros]
+        return list(resultado)
+
+    def sucursal(self, numero):
+        '''
+        Devuelve la sucursal con el numero dado, o None si no existe.
+        '''
+        return self.__obtener_catalogo().por_numero.get(str(numero))
+
+    def cercanas(self, latitud, longitud, cantidad=1):
+        '''
+        Devuelve las sucursales mas cercanas al punto dado, de la mas cercana
+        a la mas lejana.
+
+        Devuelve una lista de tuplas (sucursal, distancia en kilometros).
+        '''
+        arbol = self.__obtener_catalogo().arbol
+        return arbol.cercanos(_cartesianas(latitud, longitud), cantidad)
+
+    def en_radio(self, latitud, longitud, radio):
+        '''
+        Devuelve las sucursales a menos de `radio` kilometros del punto
+        dado, de la mas cercana a la mas lejana.
+
+        Devuelve una lista de tuplas (sucursal, distancia en kilometros).
+        '''
+        arbol = self.__obtener_catalogo().arbol
+        return arbol.en_radio(_cartesianas(latitud, longitud), radio)
+
+    def __len__(self):
+        return len(self.__obtener_catalogo().sucursales)
+
+    def __obtener_catalogo(self):
+        '''
+        Devuelve el catalogo vigente. La primera vez lo descarga, y si esta
+        vencido inicia su actualizacion en segundo plano.
+        '''
+        if self.__catalogo is None:
+            with self.__lock:
+                if self.__catalogo is None:
+                    self.actualizar()
+        elif self.reloj() - self.__actualizado >= self.intervalo:
+            with self.__lock:
+                if self.__actualizando:
+                    return self.__catalogo
+                self.__actualizando = True
+            threading.Thread(target=self.__actualizar_en_segundo_plano,
+                             daemon=True).start()
+        return self.__catalogo
+
+    def __actualizar_en_segundo_plano(self):
+        try:
+            self.actualizar()
+        except Exception:
+            # sigo usando el catalogo anterior hasta el proximo intento
+            self.__actualizado = self.reloj()
+        finally:
+            self.__actualizando = False
+
+
+class _Catalogo(object):
+    '''
+    Lista de sucursales con sus indices.
+    '''
+
+    def __init__(self, sucursales):
+        self.sucursales = sucursales
+        self.por_codigo_postal = collections.defaultdict(list)
+        self.por_localidad = collections.defaultdict(list)
+        self.por_provincia = collections.defaultdict(list)
+        self.por_numero = {}
+        for sucursal in sucursales:
+            self.por_numero[str(sucursal.get('sucursal'))] = sucursal
+            codigo_postal, localidad, provincia = _direccion(
+                sucursal.get('direccion'))
+            if codigo_postal:
+                self.por_codigo_postal[codigo_postal].append(sucursal)
+            if localidad:
+                self.por_localidad[localidad].append(sucursal)
+            if provincia:
+                self.por_provincia[provincia].append(sucursal)
+        self.arbol = _ArbolKD(sucursales)
+        # evito que las consultas agreguen claves vacias
+        self.por_codigo_postal = dict(self.por_codigo_postal)
+        self.por_localidad = dict(self.por_localidad)
+        self.por_provincia = dict(self.por_provincia)
+
+
+class _ArbolKD(object):
+    '''
+    Arbol k-d de las sucursales con coordenadas.
+
+    Cada sucursal se representa como un punto sobre la esfera unitaria en
+    coordenadas cartesianas. La distancia euclidea (cuerda) entre dos puntos
+    crece con la distancia sobre la superficie, por lo que las busquedas se
+    hacen con la cuerda y solo se convierte a kilometros el resultado.
+    '''
+
+    def __init__(self, sucursales):
+        puntos = []
+        for sucursal in sucursales:
+            coordenadas = _coordenadas(sucursal)
+            if coordenadas is not None:
+                puntos.append((_cartesianas(*coordenadas), sucursal))
+        self.raiz = self.__construir(puntos, 0)
+
+    def __construir(self, puntos, eje):
+        '''
+        Devuelve el nodo (punto, sucursal, eje, izquierda, derecha) con la
+        mediana de los puntos sobre el eje dado.
+        '''
+        if not puntos:
+            return None
+        puntos.sort(key=lambda p: p[0][eje])
+        medio = len(puntos) // 2
+        siguiente = (eje + 1) % 3
+        return (puntos[medio][0], puntos[medio][1], eje,
+                self.__construir(puntos[:medio], siguiente),
+                self.__construir(puntos[medio + 1:], siguiente))
+
+    def cercanos(self, punto, cantidad):
+        '''
+        Devuelve las `cantidad` sucursales mas cercanas al punto.
+        '''
+        if cantidad <= 0:
+            return []
+        # heap con los mejores candidatos, el mas lejano primero
+        mejores = []
+        pendientes = [self.raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo is None:
+                continue
+            otro, sucursal, eje, izquierda, derecha = nodo
+            distancia = _cuadrado(punto, otro)
+            if len(mejores) < cantidad:
+                heapq.heappush(mejores, (-distancia, id(sucursal), sucursal))
+            elif distancia < -mejores[0][0]:
+                heapq.heapreplace(mejores,
+                                  (-distancia, id(sucursal), sucursal))
+            diferencia = punto[eje] - otro[eje]
+            cerca, lejos = ((izquierda, derecha) if diferencia < 0
+                            else (derecha, izquierda))
+            # la otra rama solo puede mejorar si el plano esta mas cerca que
+            # el peor candidato
+            if (len(mejores) < cantidad or
+                    diferencia * diferencia < -mejores[0][0]):
+                pendientes.append(lejos)
+            pendientes.append(cerca)
+        mejores.sort(reverse=True)
+        return [(sucursal, _kilometros(-distancia))
+                for distancia, i, sucursal in mejores]
+
+    def en_radio(self, punto, radio):
+        '''
+        Devuelve las sucursales a menos de `radio` kilometros del punto.
+        '''
+        cuerda = 2 * math.sin(min(radio / RADIO_TIERRA, math.pi) / 2)
+        limite = cuerda * cuerda
+        resultado = []
+        pendientes = [self.raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo is None:
+                continue
+            otro, sucursal, eje, izquierda, derecha = nodo
+            distancia = _cuadrado(punto, otro)
+            if distancia <= limite:
+                resultado.append((distancia, id(sucursal), sucursal))
+            diferencia = punto[eje] - otro[eje]
+            if diferencia <= 0 or diferencia * diferencia <= limite:
+                pendientes.append(izquierda)
+            if diferencia >= 0 or diferencia * diferencia <= limite:
+                pendientes.append(derecha)
+        resultado.sort()
+        return [(sucursal, _kilometros(distancia))
+                for distancia, i, sucursal in resultado]
+
+
+# radio medio de la tierra en kilometros
+RADIO_TIERRA = 6371.0088
+
+
+def _coordenadas(sucursal):
+    '''
+    Devuelve la tupla (latitud, longitud) de la sucursal, o None si no tiene
+    coordenadas validas.
+    '''
+    try:
+        latitud = float(str(sucursal.get('latitud')).replace(',', '.'))
+        longitud = float(str(sucursal.get('longitud')).replace(',', '.'))
+    except ValueError:
+        return None
+    if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+        return None
+    return latitud, longitud
+
+
+def _cartesianas(latitud, longitud):
+    '''
+    Devuelve las coordenadas cartesianas del punto sobre la esfera unitaria.
+    '''
+    latitud = math.radians(float(latitud))
+    longitud = math.radians(float(longitud))
+    return (math.cos(latitud) * math.cos(longitud),
+            math.cos(latitud) * math.sin(longitud),
+            math.sin(latitud))
+
+
+def _cuadrado(a, b):
+    '''
+    Devuelve el cuadrado de la distancia euclidea entre dos puntos.
+    '''
+    x = a[0] - b[0]
+    y = a[1] - b[1]
+    z = a[2] - b[2]
+    return x * x + y * y + z * z
+
+
+def _kilometros(cuadrado):
+    '''
+    Convierte el cuadrado de una cuerda de la esfera unitaria a kilometros
+    sobre la superficie.
+    '''
+    return 2 * RADIO_TIERRA * math.asin(min(1.0, math.sqrt(cuadrado) / 2))
+
+
+def _direccion(direccion):
+    '''
+    Devuelve una tupla (codigo postal, localidad, provincia) normalizada a
+    partir de la direccion de una sucursal.
+    '''
+    partes = [normalizar(p) for p in (direccion or '').split(',')]
+    if len(partes) < 4:
+        return None, None, None
+    return partes[-3], partes[-2], partes[-1]
@@ -0,0 +1,425 @@
+'''
+Transportes HTTP utilizados para realizar las peticiones SOAP.
+'''
+import hashlib
+import http.client
+import io
+import json
+import os
+import queue
+import re
+import select
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import suds.transport
+
+# cabecera de WS-Security de un envoltorio, con cualquier prefijo
+_SEGURIDAD = re.compile(br'<(?:[\w.-]+:)?Security\b.*?'
+                        br'</(?:[\w.-]+:)?Security>', re.S)
+
+
+class TransportePool(suds.transport.Transport):
+    '''
+    Transporte HTTP con un pool de conexiones persistentes (keep-alive) por
+    host.
+
+    Una misma instancia puede compartirse entre todas las operaciones y
+    todas las instancias de la API, de modo que las peticiones reutilicen
+    las conexiones TCP/TLS ya establecidas en lugar de abrir una nueva cada
+    vez.
+    '''
+
+    # errores que indican que el servidor cerro una conexion ociosa
+    _DESCONEXIONES = (http.client.RemoteDisconnected,
+                      ConnectionResetError,
+                      BrokenPipeError)
+
+    def __init__(self,
+                 conexiones=10,
+                 timeout_conexion=10,
+                 timeout_lectura=60,
+                 contexto_ssl=None):
+        '''
+        args
+        --------
+        conexiones -- integer: Cantidad maxima de conexiones simultaneas por
+                               host. Las peticiones que la excedan esperan a
+                               que se libere una conexion.
+        timeout_conexion -- float: Segundos de espera para establecer una
+                                   conexion.
+        timeout_lectura -- float: Segundos de espera de la respuesta del
+                                  servidor.
+        contexto_ssl -- ssl.SSLContext: Contexto para las conexiones https.
+        '''
+        super().__init__()
+        self.conexiones = conexiones
+        self.timeout_conexion = timeout_conexion
+        self.timeout_lectura = timeout_lectura
+        self.contexto_ssl = contexto_ssl
+        self.__pools = {}
+        self.__lock = threading.Lock()
+
+    def open(self, request):
+        '''
+        Descarga el documento de la url dada con un GET sobre el pool.
+        '''
+        status, reason, headers, body = self.__peticion('GET', request)
+        if status != http.client.OK:
+            raise suds.transport.TransportError(reason, status,
+                                                io.BytesIO(body))
+        return io.BytesIO(body)
+
+    def send(self, request):
+        '''
+        Envia la peticion SOAP y devuelve la respuesta del servidor.
+        '''
+        status, reason, headers, body = self.__peticion('POST', request)
+        if status not in (http.client.OK,
+                          http.client.ACCEPTED,
+                          http.client.NO_CONTENT):
+            raise suds.transport.TransportError(reason, status,
+                                                io.BytesIO(body))
+        return suds.transport.Reply(status, headers, body)
+
+    def cerrar(self):
+        '''
+        Cierra todas las conexiones ociosas del pool.
+        '''
+        with self.__lock:
+            pools = list(self.__pools.values())
+        for pool in pools:
+            pool.cerrar()
+
+    def __deepcopy__(self, memo):
+        # suds copia el transporte al clonar un cliente. Los clones deben
+        # compartir el mismo pool de conexiones
+        return self
+
+    def __pool(self, url):
+        '''
+        Devuelve el pool de conexiones del host de la url dada.
+        '''
+        clave = (url.scheme, url.hostname, url.port)
+        try:
+            return self.__pools[clave]
+        except KeyError:
+            pass
+        with self.__lock:
+            if clave not in self.__pools:
+                self.__pools[clave] = _Pool(self.__fabrica(url),
+                                            self.conexiones)
+            return self.__pools[clave]
+
+    def __fabrica(self, url):
+        '''
+        Devuelve una funcion que crea conexiones hacia el host de la url.
+        '''
+        if url.scheme == 'https':
+            def fabrica():
+                return http.client.HTTPSConnection(
+                    url.hostname, url.port,
+                    timeout=self.timeout_conexion,
+                    context=self.contexto_ssl)
+        else:
+            def fabrica():
+                return http.client.HTTPConnection(
+                    url.hostname, url.port,
+                    timeout=self.timeout_conexion)
+        return fabrica
+
+    def __peticion(self, metodo, request):
+        '''
+        Realiza la peticion HTTP sobre una conexion del pool.
+
+        Devuelve una tupla (status, reason, headers, body).
+        '''
+        url = urllib.parse.urlsplit(request.url)
+        ruta = url.path or '/'
+        if url.query:
+            ruta += '?' + url.query
+        timeout = request.timeout or self.timeout_lectura
+        pool = self.__pool(url)
+        with pool:
+            conexion, reutilizada = pool.obtener()
+            while True:
+                enviada = False
+                try:
+                    self.__enviar(conexion, metodo, ruta, request, timeout)
+                    enviada = True
+                    respuesta = conexion.getresponse()
+                    break
+                except self._DESCONEXIONES:
+                    conexion.close()
+                    # el servidor cerro la conexion mientras estaba ociosa.
+                    # Reintento una unica vez con una conexion nueva si la
+                    # peticion no llego completa o es un GET. Un POST ya
+                    # enviado pudo haberse procesado (por ejemplo, una
+                    # compra confirmada) y reenviarlo lo duplicaria
+                    if not reutilizada or (enviada and metodo != 'GET'):
+                        raise
+                    conexion, reutilizada = pool.nueva(), False
+                except Exception:
+                    conexion.close()
+                    raise
+            try:
+                body = respuesta.read()
+            except Exception:
+                conexion.close()
+                raise
+            if respuesta.will_close:
+                conexion.close()
+            else:
+                pool.devolver(conexion)
+        return (respuesta.status, respuesta.reason,
+                dict(respuesta.getheaders()), body)
+
+    def __enviar(self, conexion, metodo, ruta, request, timeout):
+        '''
+        Envia la peticion por la conexion dada.
+        '''
+        if conexion.sock is None:
+            conexion.connect()
+        # una vez conectado, el timeout aplica a la lectura de la respuesta
+        conexion.sock.settimeout(timeout)
+        conexion.request(metodo, ruta, body=request.message,
+                         headers=request.headers)
+
+
+class TransporteGrabador(suds.transport.Transport):
+    '''
+    Transporte que realiza las peticiones con otro transporte y graba en un
+    directorio cada respuesta, para luego reproducirlas sin conexion con
+    TransporteReproductor.
+
+    Cada peticion, incluidas las descargas de los wsdl, se graba en un
+    archivo JSON identificado por el metodo, la url y el cuerpo de la
+    peticion sin la cabecera de WS-Security. El cuerpo no se guarda, ya que
+    contiene las credenciales.
+
+    >>> api = API(usuario, clave, cliente,
+    ...           transporte=TransporteGrabador("grabaciones"))
+    '''
+
+    def __init__(self, directorio, transporte=None):
+        '''
+        args
+        --------
+        directorio -- string: Directorio de las grabaciones. Se crea si no
+                              existe.
+        transporte -- suds.transport.Transport: Transporte que realiza las
+                      peticiones. Si no se indica se usa TransportePool.
+        '''
+        super().__init__()
+        self.directorio = directorio
+        self.transporte = transporte or TransportePool()
+        os.makedirs(directorio, exist_ok=True)
+
+    def open(self, request):
+        inicio = time.perf_counter()
+        try:
+            body = self.transporte.open(request).read()
+        except suds.transport.TransportError as e:
+            raise self.__error('GET', request, inicio, e)
+        self.__grabar('GET', request, inicio, http.client.OK, None, {}, body)
+        return io.BytesIO(body)
+
+    def send(self, request):
+        inicio = time.perf_counter()
+        try:
+            reply = self.transporte.send(request)
+        except suds.transport.TransportError as e:
+            raise self.__error('POST', request, inicio, e)
+        self.__grabar('POST', request, inicio, reply.code, None,
+                      reply.headers, reply.message)
+        return reply
+
+    def __deepcopy__(self, memo):
+        # los clientes suds clonados comparten el transporte
+        return self
+
+    def __error(self, metodo, request, inicio, error):
+        '''
+        Graba una respuesta de error y devuelve un TransportError
+        equivalente, ya que el cuerpo del original se consume al grabarlo.
+        '''
+        body = error.fp.read() if error.fp is not None else b''
+        self.__grabar(metodo, request, inicio, error.httpcode, str(error),
+                      {}, body)
+        return suds.transport.TransportError(str(error), error.httpcode,
+                                             io.BytesIO(body))
+
+    def __grabar(self, metodo, request, inicio, status, reason, headers,
+                 body):
+        '''
+        Guarda la respuesta en el directorio. El archivo se reemplaza de
+        forma atomica, por lo que pueden grabarse peticiones desde varios
+        hilos a la vez.
+        '''
+        grabacion = {'metodo': metodo,
+                     'url': request.url,
+                     'status': status,
+                     'reason': reason,
+                     'headers': dict(headers or {}),
+                     'body': (body or b'').decode('utf-8', 'surrogateescape'),
+                     'duracion': time.perf_counter() - inicio}
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio,
+                                                suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as archivo:
+            json.dump(grabacion, archivo, indent=1)
+        os.replace(temporal, os.path.join(
+            self.directorio, _clave_grabacion(metodo, request) + '.json'))
+
+
+class TransporteReproductor(suds.transport.Transport):
+    '''
+    Transporte que responde las peticiones con las respuestas grabadas por
+    TransporteGrabador, sin realizar conexiones.
+
+    Permite ejecutar la API completa (armado del envoltorio, transporte y
+    lectura de la respuesta) sin conexion y con la concurrencia deseada.
+    Las peticiones sin grabacion fallan con un TransportError 404.
+
+    >>> api = API(usuario, clave, cliente,
+    ...           transporte=TransporteReproductor("grabaciones",
+    ...                                            velocidad=2))
+    '''
+
+    def __init__(self, directorio, velocidad=1, latencia=0):
+        '''
+        args
+        --------
+        directorio -- string: Directorio de las grabaciones.
+        velocidad -- float: Factor de velocidad de la reproduccion. Cada
+                            respuesta demora la duracion grabada dividida por
+                            la velocidad. Con None o 0 se responde sin
+                            demora.
+        latencia -- float o function: Segundos de demora agregados a cada
+                                      respuesta, o una funcion sin
+                                      argumentos que los devuelve (por
+                                      ejemplo, para simular variaciones).
+        '''
+        super().__init__()
+        self.directorio = directorio
+        self.velocidad = velocidad
+        self.latencia = latencia
+        # funcion de espera, reemplazable en las pruebas
+        self.dormir = time.sleep
+        self.__grabaciones = {}
+        for nombre in os.listdir(directorio):
+            if nombre.endswith('.json'):
+                with open(os.path.join(directorio, nombre)) as archivo:
+                    self.__grabaciones[nombre[:-len('.json')]] = json.load(
+                        archivo)
+
+    def open(self, request):
+        status, reason, headers, body = self.__reproducir('GET', request)
+        return io.BytesIO(body)
+
+    def send(self, request):
+        status, reason, headers, body = self.__reproducir('POST', request)
+        return suds.transport.Reply(status, headers, body)
+
+    def __deepcopy__(self, memo):
+        # los clientes suds clonados comparten el transporte
+        return self
+
+    def __len__(self):
+        return len(self.__grabaciones)
+
+    def __reproducir(self, metodo, request):
+        '''
+        Espera la demora configurada y devuelve una tupla (status, reason,
+        headers, body) de la respuesta grabada. Las respuestas de error se
+        lanzan como TransportError.
+        '''
+        try:
+            grabacion = self.__grabaciones[_clave_grabacion(metodo, request)]
+        except KeyError:
+            raise suds.transport.TransportError(
+                'Sin grabacion para %s %s' % (metodo, request.url),
+                http.client.NOT_FOUND, io.BytesIO(b''))
+        demora = self.latencia() if callable(self.latencia) else self.latencia
+        if self.velocidad:
+            demora += grabacion['duracion'] / self.velocidad
+        if demora > 0:
+            self.dormir(demora)
+        status = grabacion['status']
+        body = grabacion['body'].encode('utf-8', 'surrogateescape')
+        if grabacion['reason'] is not None:
+            raise suds.transport.TransportError(grabacion['reason'], status,
+                                                io.BytesIO(body))
+        return status, None, grabacion['headers'], body
+
+
+def _clave_grabacion(metodo, request):
+    '''
+    Devuelve el nombre de la grabacion de una peticion.
+
+    La cabecera de WS-Security se quita del cuerpo, para que la clave no
+    dependa de las credenciales.
+    '''
+    clave = hashlib.sha1()
+    clave.update(('%s %s\n' % (metodo, request.url)).encode('utf-8'))
+    clave.update(_SEGURIDAD.sub(b'', request.message or b''))
+    return clave.hexdigest()
+
+
+class _Pool(object):
+    '''
+    Pool de conexiones hacia un mismo host.
+    '''
+
+    def __init__(self, fabrica, maximo):
+        self.fabrica = fabrica
+        self.libres = queue.LifoQueue()
+        self.semaforo = threading.BoundedSemaphore(maximo)
+
+    def __enter__(self):
+        self.semaforo.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.semaforo.release()
+
+    def obtener(self):
+        '''
+        Devuelve una tupla (conexion, reutilizada). Prefiere la conexion
+        ociosa usada mas recientemente.
+        '''
+        while True:
+            try:
+                conexion = self.libres.get_nowait()
+            except queue.Empty:
+                return self.nueva(), False
+            if not _cerrada(conexion):
+                return conexion, True
+            conexion.close()
+
+    def nueva(self):
+        return self.fabrica()
+
+    def devolver(self, conexion):
+        self.libres.put(conexion)
+
+    def cerrar(self):
+        while True:
+            try:
+                self.libres.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _cerrada(conexion):
+    '''
+    Indica si el servidor cerro la conexion ociosa dada. Una conexion ociosa
+    abierta no tiene nada para leer.
+    '''
+    if conexion.sock is None:
+        return True
+    try:
+        return bool(select.select([conexion.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
@@ -0,0 +1,47 @@
+'''
+Funciones auxiliares compartidas por los modulos del paquete.
+'''
+import unicodedata
+import urllib.error
+
+from .excepciones import APIError, EnvioIncierto
+
+
+def normalizar(valor):
+    '''
+    Normaliza un texto para compararlo sin distinguir mayusculas, acentos ni
+    espacios repetidos.
+    '''
+    texto = unicodedata.normalize('NFKD', str(valor))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.upper().split())
+
+
+def reintentable(error):
+    '''
+    Devuelve verdadero si el error indica que el servidor no llego a procesar
+    la peticion (saturacion o conexion rechazada), por lo que puede
+    reintentarse sin riesgo de duplicar el envío.
+    '''
+    # suds.transport.TransportError, sin importar suds
+    httpcode = getattr(error, 'httpcode', None)
+    if httpcode is not None:
+        return httpcode in (429, 503)
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+    if (isinstance(error, Exception) and len(error.args) == 1 and
+            isinstance(error.args[0], tuple)):
+        # suds lanza Exception((status, reason)) al procesar una respuesta
+        # HTTP con error
+        return error.args[0][0] in (429, 503)
+    return isinstance(error, ConnectionRefusedError)
+
+
+def sin_envio(error):
+    '''
+    Devuelve verdadero si el error de un alta indica que el envío no se
+    genero.
+    '''
+    if isinstance(error, EnvioIncierto):
+        return False
+    return isinstance(error, (APIError, ValueError)) or reintentable(error)
@@ -11,5 +11,6 @@ setup(name='py-andreani',
       keywords="andreani e-commerce ecommerce argentina oca",
       packages=['andreani'],
       install_requires="suds-jurko",
+      python_requires=">=3.7",
       test_suite="test",
 )
@@ -0,0 +1,385 @@
+'''
+Mediciones de rendimiento de py-andreani.
+
+Las operaciones de la API se miden contra el servidor SOAP local de las
+pruebas (ver servidor.ServidorSOAP), que corre en otro proceso, por lo que
+los resultados no dependen de la red ni del webservice de Andreani.
+
+Uso: python -m test.benchmark [--llamadas N] [--concurrencia N]
+                              [--salida archivo.json]
+'''
+import argparse
+import concurrent.futures
+import functools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import string
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import andreani
+from andreani import conversion
+from suds.sudsobject import Factory, asdict
+
+from .servidor import ServidorSOAP
+
+CLIENTE = "CLIENTE"
+SUCURSAL = {
+    "Descripcion": "9 DE JULIO",
+    "Direccion": "Bme.Mitre 1668,6500,9 DE JULIO,BUENOS AIRES",
+    "HoradeTrabajo": None, "Latitud": None, "Longitud": None, "Mail": None,
+    "Numero": "NDJ", "Responsable": None, "Resumen": "9 DE JULIO",
+    "Sucursal": 71, "Telefono1": "0810-122-1111",
+    "Telefono2": "0800-122-1112", "Telefono3": None, "TipoSucursal": 2,
+    "TipoTelefono1": None, "TipoTelefono2": None, "TipoTelefono3": None,
+}
+ENVIO = {
+    "Calle": "Florencio Varela", "Departamento": None,
+    "DetalleProductosaEntregar": "Producto", "Localidad": "San Justo",
+    "NombreyApellido": "Susana Horia", "Numero": "1903",
+    "NumeroAndreani": "*00000000249801", "Piso": None,
+    "Provincia": "Buenos Aires",
+}
+# respuestas del servidor por metodo, armadas con los datos de las pruebas
+RESPUESTAS = {
+    "ConsultarSucursales": {"ResultadoConsultarSucursales": [
+        dict(SUCURSAL, Sucursal=i) for i in range(50)]},
+    "CotizarEnvio": {
+        "CategoriaDistancia": "INTERIOR 1", "CategoriaDistanciaId": "2",
+        "CategoriaPeso": "1", "CategoriaPesoId": "1", "PesoAforado": 5,
+        "Tarifa": 143.3},
+    "ConfirmarCompra": {"NumeroAndreani": "*00000000249801",
+                        "Recibo": None},
+    "ConfirmarCompraConRecibo": {"NumeroAndreani": "*00000000249801",
+                                 "Recibo": "1"},
+    "ObtenerTrazabilidadSinClienteCodificado": {
+        "NumeroEnvio": "103",
+        "Envios": {
+            "NombreEnvio": "Constancia de Envío",
+            "NroAndreani": "*00000000249801",
+            "FechaAlta": "2015-07-22 10:10:50-03:00",
+            "Eventos": [{"Fecha": "2015-07-22 10:10:50-03:00",
+                         "IdEstado": 30, "Estado": "Envío no ingresado",
+                         "IdMotivo": -1, "Motivo": None,
+                         "Sucursal": "Sucursal Genérica"}] * 5}},
+    "ConsultarCodigoPostal": {"ConsultarCodigoPostalOk": {"Response": [
+        {"Result": {"ResultCode": 10,
+                    "ResultDescription": "Operación exitosa.-"}},
+        {"CodigoPostal": {"CodigoPostal": 1001, "Nombre": "CAPITAL FEDERAL",
+                          "Observaciones": None, "CodigoProvincia": "C",
+                          "NombreProvincia": "Capital Federal"}}]}},
+    "ReporteDeEnviosPendientesImpresion": {
+        "ResultadoReporteEnviosPendientesImpresion": [ENVIO] * 200},
+    "ReporteDeEnviosPendientesIngreso": {
+        "ResultadoReporteEnviosPendientesIngreso": [ENVIO] * 200},
+    "ImprimirConstancia": {"ResultadoImprimirConstancia": {
+        "NumeroAndreani": "*00000000249801",
+        "PdfLinkFile": "http://fake_url.com/pdf"}},
+    "AnularEnvios": {"ResultadoAnularEnvios": {
+        "CodigoTransaccion": "1", "Destinatario": "Susana Horia",
+        "IdCliente": CLIENTE, "NumeroAndreani": "*00000000249801",
+        "Productos": "Producto"}},
+    "GeneracionRemitodeImposicion": {
+        "ResultadoGeneracionRemitodeImposicion": {
+            "Entidades": {"string": ["*00000000249801"]},
+            "Pdf": "JVBERi0xLjQK", "RemitodeImposicion": "1234567890A"}},
+    "ObtenerEstadoDistribucion": {"Piezas": {"Pieza": {
+        "NroPieza": None, "NroAndreani": "*00000000249801",
+        "Estado": "Envío no ingresado", "Fecha": "2015-07-22",
+        "Motivo": None}}},
+    "ConsultarDatosDeImpresion": {"ResultadoConsultarDatosDeImpresion": {
+        "Categoria": "1", "CodigoDeResultado": 0,
+        "NumeroAndreani": "*00000000249801", "IdCliente": CLIENTE}},
+}
+COMPRA = {"sucursal_retiro": "20", "provincia": "Buenos Aires",
+          "localidad": "San Justo", "codigo_postal": "1754",
+          "calle": "Florencio Varela", "numero": "1903",
+          "nombre_apellido": "Susana Horia", "peso": 500, "volumen": 100,
+          "contrato": "AAAA00000"}
+# operaciones medidas: nombre -> funcion que recibe la API
+OPERACIONES = {
+    "consultar_sucursales": lambda api: api.consultar_sucursales(),
+    "cotizar_envio": lambda api: api.cotizar_envio(
+        peso=500, volumen=100, cp_destino="1754", contrato="AAAA00000"),
+    "confirmar_compra": lambda api: api.confirmar_compra(**COMPRA),
+    "confirmar_compra_datos_impresion":
+        lambda api: api.confirmar_compra_datos_impresion(**COMPRA),
+    "consultar_codigo_postal":
+        lambda api: api.consultar_codigo_postal("1001"),
+    "consultar_trazabilidad":
+        lambda api: api.consultar_trazabilidad("*00000000249801"),
+    "consulta_ultimo_estado_distribucion":
+        lambda api: api.consulta_ultimo_estado_distribucion(
+            "*00000000249801"),
+    "imprimir_constancia":
+        lambda api: api.imprimir_constancia("*00000000249801"),
+    "anular_envio": lambda api: api.anular_envio("*00000000249801"),
+    "consultar_datos_impresion":
+        lambda api: api.consultar_datos_impresion("*00000000249801"),
+    "reporte_envios_pendientes_impresion":
+        lambda api: api.reporte_envios_pendientes_impresion(),
+    "reporte_envios_pendientes_ingreso":
+        lambda api: api.reporte_envios_pendientes_ingreso(),
+    "generar_remito_imposicion":
+        lambda api: api.generar_remito_imposicion("*00000000249801"),
+}
+# operaciones que tambien se miden con API.XML_DIRECTO
+XML_DIRECTO = ("consultar_sucursales", "consultar_trazabilidad",
+               "reporte_envios_pendientes_impresion",
+               "reporte_envios_pendientes_ingreso")
+
+
+def reporte(filas):
+    '''
+    Devuelve un reporte de envios como el que arma suds, con la cantidad de
+    filas dada.
+    '''
+    return Factory.object(dict={
+        "ResultadoReporteEnviosPendientesImpresion": [
+            Factory.object(dict={
+                "Calle": "Florencio Varela",
+                "Departamento": None,
+                "DetalleProductosaEntregar": "Producto %d" % i,
+                "Localidad": "San Justo",
+                "NombreyApellido": "Susana Horia",
+                "Numero": str(i),
+                "NumeroAndreani": "*%014d" % i,
+                "Piso": None,
+                "Provincia": "Buenos Aires",
+                "Telefono1": "011 4321 1234",
+                "Destino": Factory.object(dict={
+                    "CodigoPostal": "1754",
+                    "Sucursales": [Factory.object(dict={"Numero": "20"})],
+                }),
+            })
+            for i in range(filas)]})
+
+
+def a_dict_recursivo(obj):
+    '''
+    Conversion recursiva original de API, utilizada como referencia.
+    '''
+    out = {}
+    for k, v in asdict(obj).items():
+        k = _pythonize(k)
+        if hasattr(v, '__keylist__'):
+            out[k] = a_dict_recursivo(v)
+        elif isinstance(v, list):
+            out[k] = []
+            for item in v:
+                if hasattr(item, '__keylist__'):
+                    out[k].append(a_dict_recursivo(item))
+                else:
+                    out[k].append(item)
+        else:
+            out[k] = v
+    return out
+
+
+def _pythonize(attr):
+    result = [attr[0].lower()]
+    for char in attr[1:]:
+        if char in string.ascii_letters:
+            if char in string.ascii_uppercase:
+                result.append("_")
+            result.append(char.lower())
+    return ''.join(result)
+
+
+def conversion_reporte(filas=10000, repeticiones=3):
+    '''
+    Compara la conversion de un reporte grande con la implementacion de
+    referencia.
+
+    Devuelve un diccionario con los segundos de la mejor repeticion de cada
+    implementacion y la mejora obtenida.
+    '''
+    objeto = reporte(filas)
+    recursivo = min(timeit.repeat(lambda: a_dict_recursivo(objeto),
+                                  number=1, repeat=repeticiones))
+    actual = min(timeit.repeat(lambda: conversion.a_dict(objeto),
+                               number=1, repeat=repeticiones))
+    return {'filas': filas,
+            'recursivo': recursivo,
+            'actual': actual,
+            'mejora': recursivo / actual}
+
+
+def importacion(repeticiones=3):
+    '''
+    Mide en un interprete nuevo los segundos de `import andreani` y los del
+    primer acceso a API, que carga suds.
+
+    Devuelve un diccionario con la mejor repeticion de cada medicion y si
+    suds quedo cargado luego de importar el paquete.
+    '''
+    codigo = ("import json, sys, time\n"
+              "inicio = time.perf_counter()\n"
+              "import andreani\n"
+              "paquete = time.perf_counter() - inicio\n"
+              "suds = 'suds' in sys.modules\n"
+              "inicio = time.perf_counter()\n"
+              "andreani.API\n"
+              "api = time.perf_counter() - inicio\n"
+              "print(json.dumps([paquete, api, suds]))\n")
+    # el interprete nuevo importa el paquete de este repositorio
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    mediciones = [json.loads(subprocess.check_output(
+        [sys.executable, "-c", codigo], cwd=raiz))
+        for i in range(repeticiones)]
+    return {'paquete': min(m[0] for m in mediciones),
+            'api': min(m[1] for m in mediciones),
+            'suds': any(m[2] for m in mediciones)}
+
+
+def percentil(ordenados, p):
+    '''
+    Devuelve el percentil p (0 a 100) de una lista ordenada, por el metodo
+    del rango mas cercano.
+    '''
+    rango = int(math.ceil(p / 100.0 * len(ordenados)))
+    return ordenados[min(max(rango, 1), len(ordenados)) - 1]
+
+
+def medir(llamar, llamadas=200, concurrencia=1):
+    '''
+    Realiza la cantidad de llamadas dada desde `concurrencia` hilos a la vez
+    y devuelve un diccionario con los percentiles de la latencia y el maximo
+    (en milisegundos) y las llamadas por segundo.
+    '''
+    def cronometrar(i):
+        inicio = time.perf_counter()
+        llamar()
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrencia) as ejecutor:
+        latencias = sorted(ejecutor.map(cronometrar, range(llamadas)))
+    total = time.perf_counter() - inicio
+    return {'p50': percentil(latencias, 50) * 1000,
+            'p90': percentil(latencias, 90) * 1000,
+            'p99': percentil(latencias, 99) * 1000,
+            'maximo': latencias[-1] * 1000,
+            'por_segundo': llamadas / total}
+
+
+def memoria(llamar, llamadas=1):
+    '''
+    Devuelve el pico de memoria (en bytes) reservada durante las llamadas,
+    realizadas de a una.
+    '''
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        for i in range(llamadas):
+            llamar()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def servidor(respuestas=None):
+    '''
+    Inicia el servidor SOAP en otro proceso, de modo que no compita por el
+    GIL con la API medida.
+
+    Devuelve una tupla (proceso, url).
+    '''
+    padre, hijo = multiprocessing.Pipe()
+    proceso = multiprocessing.Process(
+        target=_servir, args=(respuestas or RESPUESTAS, hijo), daemon=True)
+    proceso.start()
+    url = padre.recv()
+    return proceso, url
+
+
+def _servir(respuestas, conexion):
+    stub = ServidorSOAP()
+    stub.respuestas.update(respuestas)
+    stub.iniciar()
+    conexion.send(stub.url)
+    # el proceso termina cuando el padre lo detiene
+    while True:
+        time.sleep(3600)
+
+
+def operaciones(url, llamadas=200, concurrencia=8, nombres=None):
+    '''
+    Mide cada operacion de la API contra el servidor de la url dada.
+
+    Devuelve un diccionario que asocia cada operacion con las mediciones de
+    latencia de a una llamada por vez, las llamadas por segundo con
+    `concurrencia` hilos y el pico de memoria. Las operaciones de
+    XML_DIRECTO se miden tambien leyendo el XML directamente, con el
+    sufijo "[xml]".
+    '''
+    api = andreani.API("usuario", "clave", CLIENTE)
+    api.DEBUG = True
+    api._URL = {'Staging': {
+        peticion: ("%s/%s?wsdl" % (url, ServidorSOAP.servicio(wsdl)),
+                   metodo, version)
+        for peticion, (wsdl, metodo, version)
+        in andreani.API._URL['Staging'].items()}}
+    medidas = [(nombre, False) for nombre in nombres or OPERACIONES]
+    medidas += [(nombre, True) for nombre, directo in medidas
+                if nombre in XML_DIRECTO]
+    resultados = {}
+    for nombre, directo in medidas:
+        api.XML_DIRECTO = directo
+        llamar = functools.partial(OPERACIONES[nombre], api)
+        # la primer llamada descarga y parsea el wsdl
+        llamar()
+        resultado = medir(llamar, llamadas)
+        resultado['por_segundo_concurrente'] = medir(
+            llamar, llamadas, concurrencia)['por_segundo']
+        resultado['memoria_pico'] = memoria(llamar)
+        resultados[nombre + ("[xml]" if directo else "")] = resultado
+    return resultados
+
+
+def suite(llamadas=200, concurrencia=8, nombres=None):
+    '''
+    Ejecuta todas las mediciones y devuelve un diccionario serializable en
+    JSON, para comparar los resultados entre versiones.
+    '''
+    proceso, url = servidor()
+    try:
+        resultados = operaciones(url, llamadas, concurrencia, nombres)
+    finally:
+        proceso.terminate()
+        proceso.join()
+    return {'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'llamadas': llamadas,
+            'concurrencia': concurrencia,
+            'operaciones': resultados,
+            'conversion': conversion_reporte(),
+            'importacion': importacion()}
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(
+        description="Mediciones de rendimiento de py-andreani.")
+    parser.add_argument("--llamadas", type=int, default=200,
+                        help="llamadas por operacion")
+    parser.add_argument("--concurrencia", type=int, default=8,
+                        help="hilos de la medicion concurrente")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    argumentos = parser.parse_args(argumentos)
+    resultado = suite(argumentos.llamadas, argumentos.concurrencia)
+    if argumentos.salida:
+        with open(argumentos.salida, "w") as salida:
+            json.dump(resultado, salida, indent=2, sort_keys=True)
+    else:
+        json.dump(resultado, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,425 @@
+'''
+Servidor SOAP local que simula los webservices de Andreani.
+
+Sirve un wsdl por cada servicio utilizado en andreani.API y responde las
+peticiones con los datos configurados para cada metodo. Permite probar el
+circuito completo (armado del envoltorio, transporte y parseo de la
+respuesta) sin acceder a los servidores de Andreani.
+'''
+import http.server
+import re
+import threading
+import urllib.parse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+TNS = "urn:andreani:stub"
+ENV_11 = "http://schemas.xmlsoap.org/soap/envelope/"
+ENV_12 = "http://www.w3.org/2003/05/soap-envelope"
+
+STRING = "xs:string"
+INT = "xs:int"
+DOUBLE = "xs:double"
+
+# tipos de datos de los servicios. Cada campo es una tupla
+# (nombre, tipo[, multiple]), donde tipo es un tipo de xml schema o una tupla
+# (nombre del tipo, campos)
+SUCURSAL = ("ResultadoConsultarSucursales", [
+    ("Descripcion", STRING), ("Direccion", STRING), ("HoradeTrabajo", STRING),
+    ("Latitud", STRING), ("Longitud", STRING), ("Mail", STRING),
+    ("Numero", STRING), ("Responsable", STRING), ("Resumen", STRING),
+    ("Sucursal", INT), ("Telefono1", STRING), ("Telefono2", STRING),
+    ("Telefono3", STRING), ("TipoSucursal", INT), ("TipoTelefono1", STRING),
+    ("TipoTelefono2", STRING), ("TipoTelefono3", STRING),
+])
+COMPRA = [
+    ("SucursalRetiro", STRING), ("Provincia", STRING), ("Localidad", STRING),
+    ("CodigoPostalDestino", STRING), ("Calle", STRING), ("Numero", STRING),
+    ("Departamento", STRING), ("Piso", STRING), ("NombreApellido", STRING),
+    ("TipoDocumento", STRING), ("NumeroDocumento", STRING), ("Email", STRING),
+    ("NumeroCelular", STRING), ("NumeroTelefono", STRING),
+    ("NombreApellidoAlternativo", STRING), ("NumeroTransaccion", STRING),
+    ("DetalleProductosEntrega", STRING), ("DetalleProductosRetiro", STRING),
+    ("Peso", STRING), ("Volumen", STRING), ("ValorDeclarado", STRING),
+    ("ValorACobrar", STRING), ("Contrato", STRING),
+    ("SucursalCliente", STRING), ("CategoriaDistancia", STRING),
+    ("CategoriaFacturacion", STRING), ("CategoriaPeso", STRING),
+    ("Tarifa", STRING),
+]
+RESULTADO_COMPRA = [("NumeroAndreani", STRING), ("Recibo", STRING)]
+ENVIO = ("Envio", [
+    ("Calle", STRING), ("Departamento", STRING),
+    ("DetalleProductosaEntregar", STRING), ("Localidad", STRING),
+    ("NombreyApellido", STRING), ("Numero", STRING),
+    ("NumeroAndreani", STRING), ("Piso", STRING), ("Provincia", STRING),
+])
+NUMERO_ANDREANI = [("NumeroAndreani", STRING)]
+PIEZA = ("Pieza", [
+    ("NroPieza", STRING), ("NroAndreani", STRING), ("Estado", STRING),
+    ("Fecha", STRING), ("Motivo", STRING),
+])
+
+# servicios: nombre -> (version de soap, {metodo: (parametros, resultado)})
+SERVICIOS = {
+    "ConsultaSucursales.svc": (1.2, {
+        "ConsultarSucursales": (
+            [("consulta", ("ParamConsultarSucursales", [
+                ("CodigoPostal", STRING), ("Localidad", STRING),
+                ("Provincia", STRING)]))],
+            ("ArrayOfResultadoConsultarSucursales", [
+                ("ResultadoConsultarSucursales", SUCURSAL, True)])),
+    }),
+    "CotizacionEnvio.svc": (1.2, {
+        "CotizarEnvio": (
+            [("cotizacionEnvio", ("ParamCotizacionEnvio", [
+                ("CPDestino", STRING), ("Cliente", STRING),
+                ("Contrato", STRING), ("Peso", STRING),
+                ("SucursalRetiro", STRING), ("Volumen", STRING)]))],
+            ("ResultadoCotizacionEnvio", [
+                ("CategoriaDistancia", STRING),
+                ("CategoriaDistanciaId", STRING),
+                ("CategoriaPeso", STRING), ("CategoriaPesoId", STRING),
+                ("PesoAforado", DOUBLE), ("Tarifa", DOUBLE)])),
+    }),
+    "ImposicionRemota.svc": (1.2, {
+        "ConfirmarCompra": (
+            [("compra", ("ConfirmarCompraModificada", COMPRA))],
+            ("ResultadoConfirmarCompra", RESULTADO_COMPRA)),
+        "ConfirmarCompraConRecibo": (
+            [("compra", ("ConfirmarCompraConRecibo",
+                         COMPRA + [("NumeroRecibo", STRING)]))],
+            ("ResultadoConfirmarCompraConRecibo", RESULTADO_COMPRA)),
+        "ReporteDeEnviosPendientesImpresion": (
+            [("ventas", ("ParamReporteDeEnvios", [("idCliente", STRING)]))],
+            ("ResultadoReporteDeEnviosPendientesImpresion", [
+                ("ResultadoReporteEnviosPendientesImpresion", ENVIO,
+                 True)])),
+        "ReporteDeEnviosPendientesIngreso": (
+            [("cliente", ("ParamCliente", [("Cliente", STRING)]))],
+            ("ResultadoReporteDeEnviosPendientesIngreso", [
+                ("ResultadoReporteEnviosPendientesIngreso", ENVIO, True)])),
+        "ImprimirConstancia": (
+            [("entities", ("ArrayOfParamImprimirConstancia", [
+                ("ParamImprimirConstancia", ("ParamImprimirConstancia",
+                                             NUMERO_ANDREANI), True)]))],
+            ("ResultadoImprimirConstancias", [
+                ("ResultadoImprimirConstancia", ("ResultadoImprimirConstancia",
+                                                 [("NumeroAndreani", STRING),
+                                                  ("PdfLinkFile", STRING)]),
+                 True)])),
+        "AnularEnvios": (
+            [("envios", ("ArrayOfParamAnularEnvios", [
+                ("ParamAnularEnvios", ("ParamAnularEnvios", NUMERO_ANDREANI),
+                 True)]))],
+            ("ResultadoAnularEnviosLista", [
+                ("ResultadoAnularEnvios", ("ResultadoAnularEnvios", [
+                    ("CodigoTransaccion", STRING), ("Destinatario", STRING),
+                    ("IdCliente", STRING), ("NumeroAndreani", STRING),
+                    ("Productos", STRING)]), True)])),
+        "GeneracionRemitodeImposicion": (
+            [("entidades", ("ArrayOfParamGeneracionRemitodeImposicion", [
+                ("ParamGeneracionRemitodeImposicion",
+                 ("ParamGeneracionRemitodeImposicion", NUMERO_ANDREANI),
+                 True)]))],
+            ("ResultadoGeneracionRemitosdeImposicion", [
+                ("ResultadoGeneracionRemitodeImposicion",
+                 ("ResultadoGeneracionRemitodeImposicion", [
+                     ("Entidades", ("ArrayOfstring", [
+                         ("string", STRING, True)])),
+                     ("Pdf", STRING), ("RemitodeImposicion", STRING)]),
+                 True)])),
+    }),
+    "Service.svc": (1.2, {
+        "ObtenerTrazabilidadSinClienteCodificado": (
+            [("NroPieza", ("ParamNroPieza", [("NroPieza", STRING)]))],
+            ("Pieza_", [
+                ("NumeroEnvio", STRING),
+                ("Envios", ("Envios", [
+                    ("NombreEnvio", STRING), ("NroAndreani", STRING),
+                    ("FechaAlta", STRING),
+                    ("Eventos", ("Evento", [
+                        ("Fecha", STRING), ("IdEstado", INT),
+                        ("Estado", STRING), ("IdMotivo", INT),
+                        ("Motivo", STRING), ("Sucursal", STRING)]),
+                     True)]), True)])),
+        "ObtenerEstadoDistribucion": (
+            [("Consulta", ("ConsultaEstado", [
+                ("CodigoCliente", STRING),
+                ("Piezas", ("ParamPiezas", [("Pieza", PIEZA)]), True)]))],
+            ("ResultadoEstadoDistribucion", [
+                ("Piezas", ("Piezas", [("Pieza", PIEZA)]), True)])),
+    }),
+    "ConsultasCodigosPostales": (1.1, {
+        "ConsultarCodigoPostal": (
+            [("CodigoDePais", STRING), ("CodigoPostal", STRING)],
+            ("ResultadoConsultarCodigoPostal", [
+                ("ConsultarCodigoPostalOk", ("ConsultarCodigoPostalOk", [
+                    ("Response", ("Response", [
+                        ("Result", ("Result", [
+                            ("ResultCode", INT),
+                            ("ResultDescription", STRING)]),
+                         True),
+                        ("CodigoPostal", ("CodigoPostal", [
+                            ("CodigoPostal", INT), ("Nombre", STRING),
+                            ("Observaciones", STRING),
+                            ("CodigoProvincia", STRING),
+                            ("NombreProvincia", STRING)]), True)]), True)]),
+                 True)])),
+    }),
+    "DatosImpresion": (1.1, {
+        "ConsultarDatosDeImpresion": (
+            [("parametros", ("ParamDatosImpresion", [
+                ("NumeroAndreani", ("ArrayOfstring", [
+                    ("string", STRING, True)]), True)]))],
+            ("ResultadoConsultarDatosDeImpresionLista", [
+                ("ResultadoConsultarDatosDeImpresion",
+                 ("ResultadoConsultarDatosDeImpresion", [
+                     ("Categoria", STRING), ("CodigoDeResultado", INT),
+                     ("FechaDeRendicion", STRING),
+                     ("FechaDeVencimientoDePrimerVisita", STRING),
+                     ("FechasPactadas", STRING), ("IdCliente", STRING),
+                     ("NumeroAndreani", STRING),
+                     ("NumeroDePermisionaria", STRING),
+                     ("SucursalDeDistribucion", STRING),
+                     ("SucursalDeRendicion", STRING)]), True)])),
+    }),
+}
+
+
+class Fault(Exception):
+    '''
+    Respuesta de error del servidor.
+    '''
+    def __init__(self, texto):
+        super().__init__(texto)
+        self.texto = texto
+
+
+def wsdl(servicio, url):
+    '''
+    Genera el wsdl del servicio dado, publicado en la url indicada.
+    '''
+    version, metodos = SERVICIOS[servicio]
+    soap = "soap12" if version == 1.2 else "soap"
+    tipos = {}
+    elementos = []
+    for metodo, (parametros, resultado) in sorted(metodos.items()):
+        elementos.append(_elemento(metodo, parametros, tipos))
+        elementos.append(_elemento(metodo + "Response",
+                                   [(metodo + "Result", resultado)], tipos))
+    partes = ['<?xml version="1.0" encoding="utf-8"?>',
+              '<wsdl:definitions '
+              'xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" '
+              'xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+              'xmlns:soap12="http://schemas.xmlsoap.org/wsdl/soap12/" '
+              'xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+              'xmlns:tns="%s" targetNamespace="%s">' % (TNS, TNS),
+              '<wsdl:types><xs:schema elementFormDefault="qualified" '
+              'targetNamespace="%s">' % TNS]
+    partes.extend(elementos)
+    partes.extend(tipos.values())
+    partes.append('</xs:schema></wsdl:types>')
+    for metodo in sorted(metodos):
+        partes.append(
+            '<wsdl:message name="{0}Request"><wsdl:part name="parameters" '
+            'element="tns:{0}"/></wsdl:message>'
+            '<wsdl:message name="{0}Response"><wsdl:part name="parameters" '
+            'element="tns:{0}Response"/></wsdl:message>'.format(metodo))
+    partes.append('<wsdl:portType name="Servicio">')
+    for metodo in sorted(metodos):
+        partes.append(
+            '<wsdl:operation name="{0}">'
+            '<wsdl:input message="tns:{0}Request"/>'
+            '<wsdl:output message="tns:{0}Response"/>'
+            '</wsdl:operation>'.format(metodo))
+    partes.append('</wsdl:portType>')
+    partes.append('<wsdl:binding name="Binding" type="tns:Servicio">'
+                  '<%s:binding style="document" '
+                  'transport="http://schemas.xmlsoap.org/soap/http"/>' % soap)
+    for metodo in sorted(metodos):
+        partes.append(
+            '<wsdl:operation name="{0}">'
+            '<{1}:operation soapAction="{2}/{0}" style="document"/>'
+            '<wsdl:input><{1}:body use="literal"/></wsdl:input>'
+            '<wsdl:output><{1}:body use="literal"/></wsdl:output>'
+            '</wsdl:operation>'.format(metodo, soap, TNS))
+    partes.append('</wsdl:binding>')
+    partes.append('<wsdl:service name="Servicio">'
+                  '<wsdl:port name="Port" binding="tns:Binding">'
+                  '<%s:address location="%s"/></wsdl:port>'
+                  '</wsdl:service></wsdl:definitions>' % (soap, escape(url)))
+    return ''.join(partes)
+
+
+def _elemento(nombre, campos, tipos):
+    '''
+    Devuelve la declaracion de un elemento con los campos dados.
+    '''
+    return ('<xs:element name="%s"><xs:complexType>%s</xs:complexType>'
+            '</xs:element>' % (nombre, _secuencia(campos, tipos)))
+
+
+def _secuencia(campos, tipos):
+    '''
+    Devuelve la secuencia de elementos de un tipo complejo. Los tipos
+    complejos encontrados se agregan al diccionario de tipos.
+    '''
+    partes = ['<xs:sequence>']
+    for campo in campos:
+        nombre, tipo = campo[:2]
+        multiple = len(campo) > 2 and campo[2]
+        if isinstance(tipo, tuple):
+            nombre_tipo, subcampos = tipo
+            if nombre_tipo not in tipos:
+                # reservo el nombre antes de recorrer tipos recursivos
+                tipos[nombre_tipo] = ''
+                tipos[nombre_tipo] = (
+                    '<xs:complexType name="%s">%s</xs:complexType>' %
+                    (nombre_tipo, _secuencia(subcampos, tipos)))
+            tipo = "tns:" + nombre_tipo
+        partes.append('<xs:element name="%s" type="%s" minOccurs="0" '
+                      'maxOccurs="%s" nillable="true"/>' %
+                      (nombre, tipo, "unbounded" if multiple else "1"))
+    partes.append('</xs:sequence>')
+    return ''.join(partes)
+
+
+def respuesta(metodo, valor, version):
+    '''
+    Devuelve el envoltorio de respuesta del metodo con el valor dado.
+    '''
+    envns = ENV_12 if version == 1.2 else ENV_11
+    if isinstance(valor, Fault) and version != 1.2:
+        cuerpo = ('<env:Fault><faultcode>env:Server</faultcode>'
+                  '<faultstring>%s</faultstring></env:Fault>'
+                  % escape(valor.texto))
+    elif isinstance(valor, Fault):
+        cuerpo = ('<env:Fault><env:Code><env:Value>env:Receiver</env:Value>'
+                  '</env:Code><env:Reason><env:Text>%s</env:Text>'
+                  '</env:Reason></env:Fault>' % escape(valor.texto))
+    else:
+        cuerpo = ('<{0}Response xmlns="{1}"><{0}Result>{2}</{0}Result>'
+                  '</{0}Response>'.format(metodo, TNS, a_xml(valor)))
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<env:Envelope xmlns:env="%s" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<env:Body>%s</env:Body></env:Envelope>' % (envns, cuerpo))
+
+
+def a_xml(valor):
+    '''
+    Serializa un diccionario como secuencia de elementos xml.
+    '''
+    partes = []
+    for nombre, v in valor.items():
+        for item in (v if isinstance(v, list) else [v]):
+            if item is None:
+                partes.append('<%s xsi:nil="true"/>' % nombre)
+            elif isinstance(item, dict):
+                partes.append('<%s>%s</%s>' % (nombre, a_xml(item), nombre))
+            else:
+                partes.append('<%s>%s</%s>' %
+                              (nombre, escape(str(item)), nombre))
+    return ''.join(partes)
+
+
+class ServidorSOAP(object):
+    '''
+    Servidor SOAP local que corre en un hilo aparte.
+
+    Las peticiones recibidas se guardan en la lista peticiones como tuplas
+    (metodo, envoltorio). Las respuestas de cada metodo se configuran en el
+    diccionario respuestas. El valor puede ser un diccionario con el
+    resultado, una instancia de Fault o una funcion que recibe el elemento de
+    la peticion y devuelve alguno de ellos.
+    '''
+
+    def __init__(self, demora=0):
+        self.respuestas = {}
+        self.peticiones = []
+        self.demora = demora
+        self.__servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                          self.__handler())
+        self.__servidor.daemon_threads = True
+        self.url = "http://127.0.0.1:%d" % self.__servidor.server_port
+
+    def iniciar(self):
+        threading.Thread(target=self.__servidor.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def detener(self):
+        self.__servidor.shutdown()
+        self.__servidor.server_close()
+
+    def urls(self, urls):
+        '''
+        Devuelve una copia del diccionario de urls de la API (API._URL) que
+        apunta a este servidor.
+        '''
+        return {peticion: ("%s/%s?wsdl" % (self.url, self.servicio(wsdl)),
+                           metodo, version)
+                for peticion, (wsdl, metodo, version) in urls.items()}
+
+    @staticmethod
+    def servicio(url):
+        '''
+        Devuelve el nombre del servicio de la url de un wsdl.
+        '''
+        return urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1]
+
+    def responder(self, servicio, headers, body):
+        '''
+        Devuelve (status, content-type, cuerpo) para la peticion dada.
+        '''
+        version, metodos = SERVICIOS[servicio]
+        if version == 1.2:
+            action = re.search(r'action="?([^";]+)',
+                               headers.get("Content-Type", "")).group(1)
+        else:
+            action = headers.get("SOAPAction", "").strip('"')
+        metodo = action.rsplit("/", 1)[-1]
+        raiz = ElementTree.fromstring(body)
+        peticion = next(iter(raiz.find("{%s}Body" % (
+            ENV_12 if version == 1.2 else ENV_11))))
+        self.peticiones.append((metodo, raiz))
+        valor = self.respuestas[metodo]
+        if callable(valor):
+            valor = valor(peticion)
+        content_type = ("application/soap+xml; charset=utf-8"
+                        if version == 1.2 else "text/xml; charset=utf-8")
+        status = 500 if isinstance(valor, Fault) else 200
+        return (status, content_type,
+                respuesta(metodo, valor, version).encode("utf-8"))
+
+    def __handler(self):
+        servidor = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                nombre = servidor.servicio(self.path.split("?")[0])
+                url = "%s/%s" % (servidor.url, nombre)
+                self.__enviar(200, "text/xml; charset=utf-8",
+                              wsdl(nombre, url).encode("utf-8"))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if servidor.demora:
+                    threading.Event().wait(servidor.demora)
+                nombre = servidor.servicio(self.path)
+                self.__enviar(*servidor.responder(nombre, self.headers,
+                                                  body))
+
+            def __enviar(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
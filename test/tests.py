@@ -1,12 +1,31 @@
+import asyncio
+import copy
+import http.server
+import importlib
+import json
 import logging
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
 
 import unittest
 import andreani
 import suds
 import suds.client
+import suds.transport
+from suds.bindings import binding
+from suds.sax.element import Element
 from suds.sudsobject import Factory
 from unittest import TestCase, mock
 
+from . import benchmark
+from .servidor import ServidorSOAP, Fault, ENV_12
+
 # credenciales de prueba
 TEST_USER = "eCommerce_Integra"
 TEST_PASSWD = "passw0rd"
@@ -322,6 +341,186 @@ class ConsultarSucursalesTests(TestCase):
         self.assertFalse(sucursales)
 
 
+class IndiceSucursalesTests(TestCase):
+    '''
+    Prueba el catalogo local de sucursales.
+    '''
+    SUCURSALES = [
+        {"descripcion": "9 DE JULIO",
+         "direccion": "Bme.Mitre 1668,6500,9 DE JULIO,BUENOS AIRES",
+         "sucursal": 71},
+        {"descripcion": "TRIBUNALES",
+         "direccion": "MOLINEDO 1600,1870,AVELLANEDA,BUENOS AIRES",
+         "sucursal": 129},
+        {"descripcion": "AZUL",
+         "direccion": "Perón 441 , 7300 , AZUL , BUENOS AIRES",
+         "sucursal": 34},
+        {"descripcion": "CORDOBA",
+         "direccion": "Av. Colón 1200, 5000, CÓRDOBA, CÓRDOBA",
+         "sucursal": 5},
+        {"descripcion": "SIN DIRECCION", "direccion": None, "sucursal": 1},
+    ]
+
+    def setUp(self):
+        self.api = mock.MagicMock()
+        self.api.consultar_sucursales.return_value = self.SUCURSALES
+        self.indice = andreani.IndiceSucursales(self.api, intervalo=60)
+        self.ahora = 0
+        self.indice.reloj = lambda: self.ahora
+
+    def numeros(self, sucursales):
+        return [s['sucursal'] for s in sucursales]
+
+    def test_filtros(self):
+        '''
+        Pruebo las consultas por codigo postal, localidad y provincia.
+        '''
+        self.assertEqual(
+            self.numeros(self.indice.consultar(codigo_postal=7300)), [34])
+        self.assertEqual(
+            self.numeros(self.indice.consultar(localidad="avellaneda")),
+            [129])
+        self.assertEqual(
+            self.numeros(self.indice.consultar(provincia="Buenos Aires")),
+            [71, 129, 34])
+        self.assertEqual(
+            self.numeros(self.indice.consultar(provincia="cordoba")), [5])
+        self.assertEqual(
+            self.numeros(self.indice.consultar(localidad="Azul",
+                                               provincia="Cordoba")), [])
+        self.assertEqual(len(self.indice.consultar()), 5)
+        # la lista se descarga una unica vez, sin filtros
+        self.api.consultar_sucursales.assert_called_once_with()
+
+    def test_sucursal(self):
+        '''
+        Pruebo la busqueda por numero de sucursal.
+        '''
+        self.assertEqual(self.indice.sucursal(34)['descripcion'], "AZUL")
+        self.assertEqual(self.indice.sucursal("129")['descripcion'],
+                         "TRIBUNALES")
+        self.assertIsNone(self.indice.sucursal(999))
+
+    def test_actualizacion(self):
+        '''
+        Pruebo que la lista vencida se actualice en segundo plano.
+        '''
+        self.assertEqual(len(self.indice), 5)
+        descargar = threading.Event()
+
+        def consultar_sucursales():
+            descargar.wait(5)
+            return self.SUCURSALES[:2]
+        self.api.consultar_sucursales.side_effect = consultar_sucursales
+        self.ahora = 60
+        # mientras se actualiza, se responde con la lista anterior
+        self.assertEqual(len(self.indice), 5)
+        self.assertEqual(len(self.indice), 5)
+        descargar.set()
+        for i in range(100):
+            if len(self.indice) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.indice), 2)
+        self.assertEqual(self.api.consultar_sucursales.call_count, 2)
+
+    def test_error_actualizacion(self):
+        '''
+        Pruebo que un error al actualizar no descarte la lista anterior.
+        '''
+        self.indice.actualizar()
+        self.api.consultar_sucursales.side_effect = andreani.APIError()
+        self.ahora = 60
+        self.assertEqual(len(self.indice), 5)
+        for i in range(100):
+            if self.api.consultar_sucursales.call_count == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.indice.consultar(codigo_postal=7300)), 1)
+
+
+class SucursalesCercanasTests(TestCase):
+    '''
+    Prueba la busqueda de las sucursales mas cercanas a un punto.
+    '''
+    SUCURSALES = [
+        {"sucursal": 1, "latitud": "-34.6037", "longitud": "-58.3816"},
+        {"sucursal": 2, "latitud": "-34.9214", "longitud": "-57.9545"},
+        {"sucursal": 3, "latitud": "-31.4201", "longitud": "-64.1888"},
+        {"sucursal": 4, "latitud": "-32,9442", "longitud": "-60,6505"},
+        {"sucursal": 5, "latitud": "-54.8019", "longitud": "-68.3030"},
+        {"sucursal": 6, "latitud": None, "longitud": None},
+        {"sucursal": 7, "latitud": "", "longitud": "-58.0"},
+    ]
+
+    def setUp(self):
+        api = mock.MagicMock()
+        api.consultar_sucursales.return_value = self.SUCURSALES
+        self.indice = andreani.IndiceSucursales(api)
+
+    def haversine(self, latitud, longitud, sucursal):
+        latitud, longitud = math.radians(latitud), math.radians(longitud)
+        otra_latitud = math.radians(
+            float(sucursal['latitud'].replace(',', '.')))
+        otra_longitud = math.radians(
+            float(sucursal['longitud'].replace(',', '.')))
+        a = (math.sin((otra_latitud - latitud) / 2) ** 2 +
+             math.cos(latitud) * math.cos(otra_latitud) *
+             math.sin((otra_longitud - longitud) / 2) ** 2)
+        return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+    def test_cercanas(self):
+        '''
+        Pruebo la busqueda de las k sucursales mas cercanas.
+        '''
+        cercanas = self.indice.cercanas(-34.58, -58.42, cantidad=3)
+        self.assertEqual([s['sucursal'] for s, d in cercanas], [1, 2, 4])
+        for sucursal, distancia in cercanas:
+            self.assertAlmostEqual(
+                distancia, self.haversine(-34.58, -58.42, sucursal), places=6)
+
+    def test_sin_coordenadas(self):
+        '''
+        Pruebo que se omitan las sucursales sin coordenadas.
+        '''
+        cercanas = self.indice.cercanas(-34.58, -58.42, cantidad=10)
+        self.assertEqual(sorted(s['sucursal'] for s, d in cercanas),
+                         [1, 2, 3, 4, 5])
+
+    def test_en_radio(self):
+        '''
+        Pruebo la busqueda de sucursales dentro de un radio.
+        '''
+        en_radio = self.indice.en_radio(-34.58, -58.42, 100)
+        self.assertEqual([s['sucursal'] for s, d in en_radio], [1, 2])
+        self.assertEqual(self.indice.en_radio(-34.58, -58.42, 1), [])
+        self.assertEqual(len(self.indice.en_radio(0, 0, 100000)), 5)
+
+    def test_fuerza_bruta(self):
+        '''
+        Comparo los resultados con el calculo de todas las distancias.
+        '''
+        aleatorio = random.Random(1)
+        sucursales = [{"sucursal": i,
+                       "latitud": str(aleatorio.uniform(-55, -22)),
+                       "longitud": str(aleatorio.uniform(-73, -53))}
+                      for i in range(500)]
+        api = mock.MagicMock()
+        api.consultar_sucursales.return_value = sucursales
+        indice = andreani.IndiceSucursales(api)
+        for i in range(20):
+            latitud = aleatorio.uniform(-55, -22)
+            longitud = aleatorio.uniform(-73, -53)
+            esperadas = sorted(sucursales, key=lambda s: self.haversine(
+                latitud, longitud, s))
+            cercanas = indice.cercanas(latitud, longitud, cantidad=5)
+            self.assertEqual([s for s, d in cercanas], esperadas[:5])
+            en_radio = indice.en_radio(latitud, longitud, 300)
+            self.assertEqual([s for s, d in en_radio],
+                             [s for s in esperadas
+                              if self.haversine(latitud, longitud, s) < 300])
+
+
 class CotizarEnvioTests(TestCase):
     '''
     Prueba servicios de cotizar envios.
@@ -332,6 +531,8 @@ class CotizarEnvioTests(TestCase):
                                      TEST_PASSWD,
                                      CLIENTE)
         self.andreani.DEBUG = True
+        # descarto clientes suds creados en pruebas anteriores
+        andreani.API._clientes.clear()
 
     def test_cotizar_envio_domicilio(self):
         '''
@@ -379,13 +580,14 @@ class CotizarEnvioTests(TestCase):
         self.assertTrue(cotizacion['tarifa'])
 
     @unittest.skipIf(not MOCK, "Mock desactivados")
-    @mock.patch.object(suds.client.Client, '__new__')
+    @mock.patch('andreani.andreani.ClienteSoap')
     def test_codigo_postal_invalido(self, fake_client):
         '''
         Cotizacion con un codigo postal inexistente.
         '''
         # creo un cliente suds falso
-        client = suds.client.Client('fake_url')
+        client = fake_client('fake_url')
+        client.clone.return_value = client
         # el cliente falso retornará codigo postal invalido
         client.service.CotizarEnvio.side_effect = suds.WebFault(
             type("testclass", (object,), {
@@ -401,13 +603,14 @@ class CotizarEnvioTests(TestCase):
                                         volumen="1000")
 
     @unittest.skipIf(not MOCK, "Mock desactivados")
-    @mock.patch.object(suds.client.Client, '__new__')
+    @mock.patch('andreani.andreani.ClienteSoap')
     def test_api_error(self, fake_client):
         '''
         Prueba como reacciona modulo ante una excepcion en el webservice
         '''
         # creo un cliente suds falso
-        client = suds.client.Client('fake_url')
+        client = fake_client('fake_url')
+        client.clone.return_value = client
         # el cliente falso retornará codigo postal invalido
         client.service.CotizarEnvio.side_effect = suds.WebFault(
             type("testclass", (object,), {
@@ -449,6 +652,100 @@ class CotizarEnvioTests(TestCase):
                                         volumen="10")
 
 
+class CotizarEnviosTests(TestCase):
+    '''
+    Prueba la cotizacion de lotes de envios.
+    '''
+
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER,
+                                     TEST_PASSWD,
+                                     CLIENTE)
+        self.andreani.DEBUG = True
+
+        def cotizar(peticion, cotizacionEnvio):
+            if cotizacionEnvio['CPDestino'] == "1":
+                raise andreani.CodigoPostalInvalido()
+            return Factory.object(dict={
+                "Tarifa": float(cotizacionEnvio['CPDestino']),
+            })
+        self.andreani._API__soap = mock.MagicMock(side_effect=cotizar)
+        self.cotizaciones = [
+            {'cp_destino': cp, 'peso': "1", 'volumen': "1",
+             'contrato': CONTRATO_ESTANDAR}
+            for cp in ["1754", "9410", "1", "1754", "5000"]]
+
+    def test_ordenado(self):
+        '''
+        Pruebo que los resultados se generen en el orden de las cotizaciones.
+        '''
+        resultados = list(self.andreani.cotizar_envios(self.cotizaciones))
+        self.assertEqual([c for c, r in resultados], self.cotizaciones)
+        tarifas = [r['tarifa'] for c, r in resultados
+                   if not isinstance(r, Exception)]
+        self.assertEqual(tarifas, [1754.0, 9410.0, 1754.0, 5000.0])
+
+    def test_errores(self):
+        '''
+        Pruebo que un error no interrumpa el lote.
+        '''
+        resultados = list(self.andreani.cotizar_envios(self.cotizaciones))
+        self.assertIsInstance(resultados[2][1],
+                              andreani.CodigoPostalInvalido)
+        self.assertEqual(len(resultados), 5)
+
+    def test_validacion(self):
+        '''
+        Pruebo que los errores de validacion se devuelvan en el lugar de la
+        cotizacion.
+        '''
+        self.cotizaciones[0]['peso'] = "0"
+        resultados = list(self.andreani.cotizar_envios(self.cotizaciones))
+        self.assertIsInstance(resultados[0][1], ValueError)
+        self.assertEqual(resultados[1][1]['tarifa'], 9410.0)
+
+    def test_repetidas(self):
+        '''
+        Pruebo que las cotizaciones repetidas se consulten una unica vez.
+        '''
+        self.cotizaciones.append(dict(self.cotizaciones[0],
+                                      sucursal_retiro=None))
+        resultados = list(self.andreani.cotizar_envios(self.cotizaciones))
+        self.assertEqual(len(resultados), 6)
+        self.assertEqual(self.andreani._API__soap.call_count, 4)
+        self.assertEqual(resultados[5][1], resultados[0][1])
+
+    def test_desordenado(self):
+        '''
+        Pruebo que los resultados se generen a medida que se completan.
+        '''
+        resultados = list(self.andreani.cotizar_envios(self.cotizaciones,
+                                                       concurrencia=2,
+                                                       ordenado=False))
+        self.assertEqual(len(resultados), 5)
+        for cotizacion, resultado in resultados:
+            if cotizacion['cp_destino'] == "1":
+                self.assertIsInstance(resultado,
+                                      andreani.CodigoPostalInvalido)
+            else:
+                self.assertEqual(resultado['tarifa'],
+                                 float(cotizacion['cp_destino']))
+
+    def test_generador(self):
+        '''
+        Pruebo que las cotizaciones se consuman a medida que se necesitan.
+        '''
+        def cotizaciones():
+            for i in range(1000, 100000):
+                yield {'cp_destino': str(i), 'peso': "1", 'volumen': "1",
+                       'contrato': CONTRATO_ESTANDAR}
+        lote = self.andreani.cotizar_envios(cotizaciones(), concurrencia=2)
+        cotizacion, resultado = next(lote)
+        lote.close()
+        self.assertEqual(resultado['tarifa'], 1000.0)
+        self.assertLess(self.andreani._API__soap.call_count, 10)
+
+
 class ConfirmarCompraTests(TestCase):
     '''
     Prueba servicios de confirmar compra.
@@ -521,6 +818,269 @@ class ConfirmarCompraTests(TestCase):
         self.assertTrue(compra)
 
 
+class ConfirmarComprasTests(TestCase):
+    '''
+    Set de pruebas del alta de muchos envios.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        # errores a lanzar por numero de transaccion, en orden
+        self.errores = {}
+
+        def confirmar(peticion, compra):
+            numero = compra['NumeroTransaccion']
+            errores = self.errores.get(numero)
+            if errores:
+                raise errores.pop(0)
+            return Factory.object(dict={"NumeroAndreani": "*" + numero,
+                                        "Recibo": None})
+        self.andreani._API__soap = mock.MagicMock(side_effect=confirmar)
+
+    def compra(self, numero, **kwargs):
+        compra = {'codigo_postal': '1754', 'peso': '1000', 'volumen': '1000',
+                  'contrato': CONTRATO_ESTANDAR, 'numero_transaccion': numero}
+        compra.update(kwargs)
+        return compra
+
+    def confirmar(self, compras, **kwargs):
+        return dict(self.andreani.confirmar_compras_datos_impresion(
+            compras, **kwargs))
+
+    def test_compras(self):
+        '''
+        Pruebo el alta de un lote y la validacion previa de las compras.
+        '''
+        resultados = self.confirmar([self.compra("1"),
+                                     self.compra("2", peso="0"),
+                                     self.compra("1")])
+        self.assertEqual(resultados["1"]['numero_andreani'], "*1")
+        self.assertIsInstance(resultados["2"], ValueError)
+        # la compra invalida y la repetida no generan peticiones
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+
+    def test_reintentos(self):
+        '''
+        Pruebo que los rechazos por saturacion se reintenten y los demas
+        errores no.
+        '''
+        saturado = suds.transport.TransportError("Service Unavailable", 503)
+        self.errores["1"] = [saturado, saturado]
+        self.errores["2"] = [socket.timeout()]
+        esperas = []
+        with mock.patch('time.sleep', esperas.append):
+            resultados = self.confirmar([self.compra("1"), self.compra("2")],
+                                        concurrencia=1)
+        self.assertEqual(resultados["1"]['numero_andreani'], "*1")
+        self.assertIsInstance(resultados["2"], socket.timeout)
+        self.assertEqual(esperas, [0.5, 1.0, 0.5])
+        self.assertEqual(self.andreani._API__soap.call_count, 4)
+
+    def test_diario(self):
+        '''
+        Pruebo que al repetir el lote no se vuelvan a enviar las compras
+        confirmadas ni las inciertas registradas en el diario.
+        '''
+        self.errores["2"] = [socket.timeout()]
+        self.errores["3"] = [andreani.APIError("error")]
+        compras = [self.compra(n) for n in ("1", "2", "3")]
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, "altas.db")
+            self.andreani.DIARIO = andreani.Diario(ruta)
+            self.confirmar(compras)
+            self.andreani.DIARIO.cerrar()
+            self.andreani.DIARIO = andreani.Diario(ruta)
+            diario = self.andreani.DIARIO
+            self.assertEqual(diario.estado("1")[0], "confirmada")
+            self.assertEqual(diario.estado("2"), ("pendiente", None))
+            self.assertIsNone(diario.estado("3"))
+            resultados = self.confirmar(compras)
+            diario.cerrar()
+        self.assertEqual(resultados["1"]['numero_andreani'], "*1")
+        self.assertIsInstance(resultados["2"], andreani.EnvioIncierto)
+        self.assertEqual(resultados["3"]['numero_andreani'], "*3")
+        self.assertEqual(self.andreani._API__soap.call_count, 4)
+
+
+class DiarioTests(TestCase):
+    '''
+    Set de pruebas del diario de altas.
+    '''
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.ruta = os.path.join(self.directorio.name, "altas.db")
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani.DIARIO = andreani.Diario(self.ruta)
+        self.error = None
+        self.reporte = []
+        self.reporte_ingreso = []
+
+        def soap(peticion, **kwargs):
+            if peticion == "reporte_envios_pendientes_impresion":
+                return Factory.object(dict={
+                    "ResultadoReporteEnviosPendientesImpresion": [
+                        Factory.object(dict=envio) for envio in self.reporte]})
+            if peticion == "reporte_envios_pendientes_ingreso":
+                return Factory.object(dict={
+                    "ResultadoReporteEnviosPendientesIngreso": [
+                        Factory.object(dict=envio)
+                        for envio in self.reporte_ingreso]})
+            if self.error is not None:
+                raise self.error
+            compra = kwargs['compra']
+            return Factory.object(dict={
+                "NumeroAndreani": "*" + compra['NumeroTransaccion'],
+                "Recibo": None})
+        self.andreani._API__soap = mock.MagicMock(side_effect=soap)
+
+    def tearDown(self):
+        self.andreani.DIARIO.cerrar()
+        self.directorio.cleanup()
+
+    def compra(self, numero, nombre="Susana Horia"):
+        return {'codigo_postal': '1754', 'peso': '1000', 'volumen': '1000',
+                'calle': 'Florencio Varela', 'numero': '1903',
+                'localidad': 'San Justo', 'provincia': 'Buenos Aires',
+                'nombre_apellido': nombre, 'numero_transaccion': numero}
+
+    def fila(self, numero_andreani, nombre="Susana Horia"):
+        '''
+        Devuelve una fila del reporte de pendientes tal como la devuelve el
+        webservice, que reemplaza la localidad y la provincia del alta.
+        '''
+        return dict(Calle="Florencio Varela",
+                    Departamento=None,
+                    DetalleProductosaEntregar="Prueba de entrega",
+                    Localidad="11 DE SEPTIEMBRE",
+                    NombreyApellido=nombre,
+                    Numero="1903",
+                    NumeroAndreani=numero_andreani,
+                    Piso=None,
+                    Provincia="BUENOS AIRES")
+
+    def reabrir(self):
+        self.andreani.DIARIO.cerrar()
+        self.andreani.DIARIO = andreani.Diario(self.ruta)
+
+    def test_repeticion(self):
+        '''
+        Pruebo que un alta confirmada se responda desde el diario, aun luego
+        de reabrirlo.
+        '''
+        compra = self.andreani.confirmar_compra(**self.compra("1"))
+        self.reabrir()
+        repetida = self.andreani.confirmar_compra_datos_impresion(
+            **self.compra("1"))
+        self.assertEqual(repetida, compra)
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+
+    def test_incierta(self):
+        '''
+        Pruebo que un alta sin respuesta no se vuelva a enviar.
+        '''
+        self.error = socket.timeout()
+        with self.assertRaises(socket.timeout):
+            self.andreani.confirmar_compra(**self.compra("1"))
+        self.error = None
+        self.reabrir()
+        with self.assertRaises(andreani.EnvioIncierto):
+            self.andreani.confirmar_compra(**self.compra("1"))
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+        self.assertEqual(self.andreani.DIARIO.estado("1"),
+                         ("pendiente", None))
+
+    def test_rechazada(self):
+        '''
+        Pruebo que un alta rechazada pueda volver a realizarse.
+        '''
+        self.error = andreani.APIError("error")
+        with self.assertRaises(andreani.APIError):
+            self.andreani.confirmar_compra(**self.compra("1"))
+        self.error = None
+        compra = self.andreani.confirmar_compra(**self.compra("1"))
+        self.assertEqual(compra['numero_andreani'], "*1")
+
+    def test_sin_numero_transaccion(self):
+        '''
+        Pruebo que las altas sin numero de transaccion no se registren.
+        '''
+        self.andreani.confirmar_compra(**self.compra(""))
+        self.assertEqual(len(self.andreani.DIARIO), 0)
+
+    def test_conciliar(self):
+        '''
+        Pruebo que las altas inciertas se resuelvan con una unica consulta
+        del reporte de pendientes de impresion, aunque el webservice cambie
+        la localidad del alta.
+        '''
+        self.andreani.confirmar_compra(**self.compra("1"))
+        self.error = socket.timeout()
+        for numero, nombre in (("2", "Susana Horia"), ("3", "Elsa Pato")):
+            with self.assertRaises(socket.timeout):
+                self.andreani.confirmar_compra(**self.compra(numero, nombre))
+        self.reporte = [self.fila("*1", "SUSANA HORIA"),
+                        self.fila("*200", "SUSANA HORIA")]
+        llamadas = self.andreani._API__soap.call_count
+        resultados = self.andreani.conciliar_altas()
+        self.assertEqual(self.andreani._API__soap.call_count, llamadas + 1)
+        self.assertEqual(resultados, {"2": {"numero_andreani": "*200"},
+                                      "3": None})
+        self.error = None
+        compra = self.andreani.confirmar_compra(**self.compra("2"))
+        self.assertEqual(compra, {"numero_andreani": "*200"})
+        # el alta sin envio en el reporte sigue pendiente
+        self.assertEqual(self.andreani.DIARIO.estado("3"),
+                         ("pendiente", None))
+        self.andreani.DIARIO.descartar("3")
+        compra = self.andreani.confirmar_compra(**self.compra("3"))
+        self.assertEqual(compra['numero_andreani'], "*3")
+
+    def test_conciliar_ambiguo(self):
+        '''
+        Pruebo que un alta quede pendiente si el reporte tiene mas de un
+        envio con el mismo destino, o si hay mas de un alta pendiente para
+        el mismo envio.
+        '''
+        self.error = socket.timeout()
+        with self.assertRaises(socket.timeout):
+            self.andreani.confirmar_compra(**self.compra("1"))
+        self.reporte = [self.fila("*00000010310340"),
+                        self.fila("*00000010310350"),
+                        self.fila("*00000010310370")]
+        self.assertEqual(self.andreani.conciliar_altas(), {"1": None})
+        with self.assertRaises(socket.timeout):
+            self.andreani.confirmar_compra(**self.compra("2"))
+        self.reporte = [self.fila("*00000010310340")]
+        self.assertEqual(self.andreani.conciliar_altas(),
+                         {"1": None, "2": None})
+        self.assertEqual(self.andreani.DIARIO.estado("1"),
+                         ("pendiente", None))
+
+    def test_conciliar_por_operacion(self):
+        '''
+        Pruebo que las altas con datos de impresion se busquen en el reporte
+        de pendientes de ingreso, y que un resultado vacio no impida
+        conciliar.
+        '''
+        self.andreani.DIARIO.iniciar("0", "confirmar_compra", {})
+        self.andreani.DIARIO.confirmar("0", None)
+        self.error = socket.timeout()
+        with self.assertRaises(socket.timeout):
+            self.andreani.confirmar_compra_datos_impresion(**self.compra("1"))
+        envio = self.fila("*100")
+        self.reporte = [envio]
+        self.assertEqual(self.andreani.conciliar_altas(), {"1": None})
+        self.reporte, self.reporte_ingreso = [], [envio]
+        self.assertEqual(self.andreani.conciliar_altas(),
+                         {"1": {"numero_andreani": "*100"}})
+        peticiones = [c[0][0] for c in
+                      self.andreani._API__soap.call_args_list]
+        self.assertEqual(peticiones.count("reporte_envios_pendientes_ingreso"),
+                         2)
+        self.assertNotIn("reporte_envios_pendientes_impresion", peticiones)
+
+
 class ConsultarTrazabilidadTests(TestCase):
     '''
     Set de pruebas de consulta de trazabilidad de un envio.
@@ -597,6 +1157,92 @@ class ConsultarTrazabilidadTests(TestCase):
         self.assertTrue(trazabilidad)
 
 
+class ConsultarTrazabilidadesTests(TestCase):
+    '''
+    Set de pruebas de consulta de trazabilidad de muchos envios.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+
+        def consultar(peticion, NroPieza):
+            if NroPieza['NroPieza'] == "error":
+                raise andreani.APIError("error")
+            return Factory.object(dict={"NumeroEnvio": NroPieza['NroPieza']})
+        self.andreani._API__soap = mock.MagicMock(side_effect=consultar)
+
+    def test_trazabilidades(self):
+        '''
+        Pruebo que se generen los resultados de cada pieza, con los errores
+        en su lugar.
+        '''
+        resultados = list(self.andreani.consultar_trazabilidades(
+            ["1", "error", "3"]))
+        self.assertEqual(resultados[0], ("1", {"numero_envio": "1"}))
+        self.assertEqual(resultados[1][0], "error")
+        self.assertIsInstance(resultados[1][1], andreani.APIError)
+        self.assertEqual(resultados[2], ("3", {"numero_envio": "3"}))
+
+    def test_generador(self):
+        '''
+        Pruebo que los numeros se consuman a medida que se consultan.
+        '''
+        numeros = (str(i) for i in range(1000000))
+        trazabilidades = self.andreani.consultar_trazabilidades(
+            numeros, concurrencia=4, ordenado=False)
+        for i, resultado in zip(range(10), trazabilidades):
+            pass
+        trazabilidades.close()
+        self.assertLess(self.andreani._API__soap.call_count, 30)
+
+    def test_por_segundo(self):
+        '''
+        Pruebo que se limite la cantidad de peticiones por segundo.
+        '''
+        inicio = time.monotonic()
+        resultados = list(self.andreani.consultar_trazabilidades(
+            [str(i) for i in range(6)], por_segundo=20))
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.25)
+        self.assertEqual(len(resultados), 6)
+
+
+class LimitadorTests(TestCase):
+    '''
+    Set de pruebas del limitador de llamadas por segundo.
+    '''
+    def test_turnos(self):
+        '''
+        Pruebo que las llamadas se espacien de forma uniforme.
+        '''
+        limitador = andreani.lotes.Limitador(por_segundo=10)
+        limitador.reloj = lambda: 5.0
+        esperas = []
+        with mock.patch('time.sleep', esperas.append):
+            for i in range(3):
+                limitador.esperar()
+        self.assertEqual(len(esperas), 2)
+        self.assertAlmostEqual(esperas[0], 0.1)
+        self.assertAlmostEqual(esperas[1], 0.2)
+
+
+class RetrocesoTests(TestCase):
+    '''
+    Set de pruebas de la demora adaptativa.
+    '''
+    def test_demora(self):
+        '''
+        Pruebo que la demora crezca con los errores y se reduzca con los
+        exitos.
+        '''
+        retroceso = andreani.lotes.Retroceso(inicial=1, maximo=5, factor=2)
+        demoras = []
+        for evento in ("error", "error", "error", "error", "exito", "exito",
+                       "exito"):
+            getattr(retroceso, evento)()
+            demoras.append(retroceso.demora)
+        self.assertEqual(demoras, [1, 2, 4, 5, 2.5, 1.25, 0])
+
+
 class CodigoPostalTests(TestCase):
     '''
     Set de pruebas de consulta de codigo postal
@@ -633,6 +1279,78 @@ class CodigoPostalTests(TestCase):
         self.assertTrue(cp)
 
 
+class CacheCodigosPostalesTests(TestCase):
+    '''
+    Set de pruebas de la cache de codigos postales.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.cache = andreani.CacheCodigosPostales(ttl_invalidos=60)
+        self.andreani.CACHE_CODIGOS_POSTALES = self.cache
+
+        def consultar(peticion, CodigoDePais, CodigoPostal):
+            if CodigoPostal == "1":
+                raise andreani.CodigoPostalInvalido()
+            return Factory.object(dict={"CodigoPostal": CodigoPostal})
+        self.andreani._API__soap = mock.MagicMock(side_effect=consultar)
+
+    def test_cache(self):
+        '''
+        Pruebo que las consultas repetidas no realicen peticiones.
+        '''
+        self.assertEqual(self.andreani.consultar_codigo_postal(1001),
+                         {"codigo_postal": 1001})
+        self.assertEqual(self.andreani.consultar_codigo_postal("1001 "),
+                         {"codigo_postal": 1001})
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+        self.andreani.consultar_codigo_postal(1001, codigo_pais="URY")
+        self.assertEqual(self.andreani._API__soap.call_count, 2)
+
+    def test_invalidos(self):
+        '''
+        Pruebo que los codigos postales invalidos se recuerden.
+        '''
+        for i in range(2):
+            with self.assertRaises(andreani.CodigoPostalInvalido):
+                self.andreani.consultar_codigo_postal("1")
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+        self.assertTrue(self.cache.invalido(1))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_vencimiento_invalidos(self):
+        '''
+        Pruebo que los codigos invalidos se olviden luego de su vencimiento.
+        '''
+        ahora = [0]
+        self.cache.invalidos.reloj = lambda: ahora[0]
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.consultar_codigo_postal("1")
+        ahora[0] = 60
+        self.assertFalse(self.cache.invalido("1"))
+
+    def test_otras_operaciones(self):
+        '''
+        Pruebo que las demas operaciones rechacen los codigos invalidos
+        conocidos sin realizar la peticion.
+        '''
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.consultar_codigo_postal("1")
+        self.andreani._API__soap.reset_mock()
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.cotizar_envio(cp_destino="1", peso=1, volumen=1,
+                                        contrato=CONTRATO_ESTANDAR)
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.consultar_sucursales(codigo_postal=1)
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.confirmar_compra(codigo_postal="1", peso=1,
+                                           volumen=1)
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.confirmar_compra_datos_impresion(
+                codigo_postal="1", peso=1, volumen=1)
+        self.assertFalse(self.andreani._API__soap.called)
+
+
 class PendientesImpresionTests(TestCase):
     '''
     Set de pruebas de consulta de reportes de envios pendientes de impresion
@@ -701,6 +1419,8 @@ class ImprimirConstanciaTests(TestCase):
                                      TEST_PASSWD,
                                      CLIENTE)
         self.andreani.DEBUG = True
+        # descarto clientes suds creados en pruebas anteriores
+        andreani.API._clientes.clear()
 
     def test_pendiente_impresion(self):
         '''
@@ -721,14 +1441,15 @@ class ImprimirConstanciaTests(TestCase):
         self.assertIn("http", pdf)
 
     @unittest.skipIf(not MOCK, "Mock desactivados")
-    @mock.patch.object(suds.client.Client, '__new__')
+    @mock.patch('andreani.andreani.ClienteSoap')
     def test_envio_inexistente(self, fake_client):
         '''
         Pruebo que obtenga los links PDF para imprimir en caso de numero de
         envio inexistente.
         '''
         # creo un cliente suds falso
-        client = suds.client.Client('fake_url')
+        client = fake_client('fake_url')
+        client.clone.return_value = client
         # el cliente falso retornará error
         client.service.ImprimirConstancia.side_effect = suds.WebFault(
             type("testclass", (object,), {
@@ -826,6 +1547,8 @@ class AnularEnvioTests(TestCase):
                                      TEST_PASSWD,
                                      CLIENTE)
         self.andreani.DEBUG = True
+        # descarto clientes suds creados en pruebas anteriores
+        andreani.API._clientes.clear()
 
     def test_pendiente_ingreso(self):
         '''
@@ -883,14 +1606,15 @@ class AnularEnvioTests(TestCase):
         self.assertTrue(response)
 
     @unittest.skipIf(not MOCK, "Mock desactivados")
-    @mock.patch.object(suds.client.Client, '__new__')
+    @mock.patch('andreani.andreani.ClienteSoap')
     def test_envio_inexistente(self, fake_client):
         '''
         Pruebo que obtenga los links PDF para imprimir en caso de numero de
         envio inexistente.
         '''
         # creo un cliente suds falso
-        client = suds.client.Client('fake_url')
+        client = fake_client('fake_url')
+        client.clone.return_value = client
         # el cliente falso retornará error
         client.service.AnularEnvios.side_effect = suds.WebFault(
             type("testclass", (object,), {
@@ -914,6 +1638,78 @@ class AnularEnvioTests(TestCase):
         self.assertFalse(response)
 
 
+class AnularEnviosTests(TestCase):
+    '''
+    Set de pruebas de la anulacion de muchos envios.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+
+        def anular(peticion, envios):
+            numeros = [e['NumeroAndreani']
+                       for e in envios['ParamAnularEnvios']]
+            if "error" in numeros:
+                raise andreani.APIError("error")
+            if "caido" in numeros:
+                raise ConnectionRefusedError()
+            return Factory.object(dict={"ResultadoAnularEnvios": [
+                Factory.object(dict={
+                    "CodigoTransaccion": "1234",
+                    "IdCliente": CLIENTE,
+                    "NumeroAndreani": numero,
+                })
+                for numero in numeros if numero != "ingresado"]})
+        self.andreani._API__soap = mock.MagicMock(side_effect=anular)
+
+    def test_lotes(self):
+        '''
+        Pruebo que los envios se agrupen en peticiones.
+        '''
+        numeros = ["*%014d" % i for i in range(120)]
+        resultados = self.andreani.anular_envios(numeros, por_peticion=50)
+        self.assertEqual(self.andreani._API__soap.call_count, 3)
+        self.assertEqual(len(resultados), 120)
+        resultado = resultados["*00000000000007"]
+        self.assertEqual(resultado['numero_andreani'], "*00000000000007")
+        self.assertEqual(resultado['codigo_transaccion'], "1234")
+
+    def test_no_anulados(self):
+        '''
+        Pruebo los envios repetidos y los que no se anularon.
+        '''
+        resultados = self.andreani.anular_envios(["1", "1", "ingresado"])
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+        self.assertEqual(resultados["1"]['numero_andreani'], "1")
+        self.assertIsNone(resultados["ingresado"])
+        self.assertEqual(len(resultados), 2)
+
+    def test_errores(self):
+        '''
+        Pruebo que el rechazo de una peticion se asocie solo a los envios
+        que fallan.
+        '''
+        numeros = ["1", "2", "error", "3", "4"]
+        resultados = self.andreani.anular_envios(numeros, por_peticion=4)
+        self.assertIsInstance(resultados["error"], andreani.APIError)
+        for numero in ["1", "2", "3", "4"]:
+            self.assertEqual(resultados[numero]['numero_andreani'], numero)
+        # el lote [1, 2, error, 3], sus mitades [1, 2] y [error, 3], las
+        # mitades [error] y [3] de esta ultima, y el lote [4]
+        self.assertEqual(self.andreani._API__soap.call_count, 6)
+
+    def test_errores_conexion(self):
+        '''
+        Pruebo que los errores de conexion se asocien a todo el lote, sin
+        reintentarlo por partes.
+        '''
+        resultados = self.andreani.anular_envios(["1", "caido", "2"],
+                                                 por_peticion=3)
+        for numero in ["1", "caido", "2"]:
+            self.assertIsInstance(resultados[numero], ConnectionRefusedError)
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+
+
 class GenerarRemitoImposicionTests(TestCase):
     '''
     Set de pruebas de generar remito de imposicion
@@ -923,6 +1719,8 @@ class GenerarRemitoImposicionTests(TestCase):
                                      TEST_PASSWD,
                                      CLIENTE)
         self.andreani.DEBUG = True
+        # descarto clientes suds creados en pruebas anteriores
+        andreani.API._clientes.clear()
 
     def test_pendiente_impresion(self):
         '''
@@ -983,14 +1781,15 @@ class GenerarRemitoImposicionTests(TestCase):
         self.assertTrue(remito["pdf"])
 
     @unittest.skipIf(not MOCK, "Mock desactivados")
-    @mock.patch.object(suds.client.Client, '__new__')
+    @mock.patch('andreani.andreani.ClienteSoap')
     def test_envio_inexistente(self, fake_client):
         '''
         Pruebo que obtenga los links PDF para imprimir en caso de numero de
         envio inexistente.
         '''
         # creo un cliente suds falso
-        client = suds.client.Client('fake_url')
+        client = fake_client('fake_url')
+        client.clone.return_value = client
         # el cliente falso retornará error
         client.service.GeneracionRemitodeImposicion.side_effect = (
             suds.WebFault(type("testclass", (object,), {
@@ -1040,6 +1839,202 @@ class UltimoEstadoDistribucionTests(TestCase):
         self.assertTrue(estado)
 
 
+class UltimosEstadosDistribucionTests(TestCase):
+    '''
+    Set de pruebas de la consulta del ultimo estado de muchas piezas.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+
+        def consultar(peticion, Consulta):
+            piezas = [p['Pieza'] for p in Consulta['Piezas']]
+            if any(p['NroAndreani'] == "error" for p in piezas):
+                raise andreani.APIError("error")
+            return Factory.object(dict={"Piezas": [
+                Factory.object(dict={"Pieza": Factory.object(dict={
+                    "NroPieza": p['NroPieza'] or "P" + p['NroAndreani'],
+                    "NroAndreani": p['NroAndreani'],
+                    "Estado": "Entregada",
+                    "Fecha": "2012-01-01T00:00:00.00-00:00",
+                    "Motivo": None,
+                })})
+                for p in piezas if p['NroAndreani'] != "inexistente"]})
+        self.andreani._API__soap = mock.MagicMock(side_effect=consultar)
+
+    def test_lotes(self):
+        '''
+        Pruebo que las piezas se agrupen en peticiones.
+        '''
+        numeros = ["*%014d" % i for i in range(120)]
+        estados = self.andreani.consulta_ultimos_estados_distribucion(
+            numeros, por_peticion=50)
+        self.assertEqual(self.andreani._API__soap.call_count, 3)
+        self.assertEqual(len(estados), 120)
+        estado = estados["*00000000000007", None]
+        self.assertEqual(estado['nro_andreani'], "*00000000000007")
+        self.assertEqual(estado['estado'], "Entregada")
+
+    def test_piezas(self):
+        '''
+        Pruebo la consulta por numero de pieza, piezas inexistentes y
+        repetidas.
+        '''
+        estados = self.andreani.consulta_ultimos_estados_distribucion([
+            ("*00000000000001", "a"), ("*00000000000001", "a"),
+            "inexistente"])
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+        self.assertEqual(estados["*00000000000001", "a"]['nro_pieza'], "a")
+        self.assertIsNone(estados["inexistente", None])
+        self.assertEqual(len(estados), 2)
+
+    def test_errores(self):
+        '''
+        Pruebo que el error de una peticion se asocie a sus piezas.
+        '''
+        estados = self.andreani.consulta_ultimos_estados_distribucion(
+            ["1", "2", "error", "3"], por_peticion=2)
+        self.assertEqual(estados["1", None]['estado'], "Entregada")
+        self.assertIsInstance(estados["error", None], andreani.APIError)
+        self.assertIsInstance(estados["3", None], andreani.APIError)
+
+
+class SeguimientoTests(TestCase):
+    '''
+    Set de pruebas del seguimiento periodico de estados.
+    '''
+    def setUp(self):
+        self.estados = {}
+        self.api = mock.MagicMock()
+        self.api.consulta_ultimos_estados_distribucion.side_effect = (
+            lambda piezas, **kwargs: {p: self.estados.get(p) for p in piezas})
+        self.ahora = 0
+        self.al_cambiar = mock.MagicMock()
+        self.seguimiento = andreani.Seguimiento(
+            self.api, intervalo=100, intervalos={"En distribución": 10},
+            factor=2, intervalo_maximo=1000, al_cambiar=self.al_cambiar)
+        self.seguimiento.reloj = lambda: self.ahora
+
+    def estado(self, pieza, estado):
+        self.estados[pieza, None] = {"nro_andreani": pieza, "estado": estado}
+
+    def consultadas(self):
+        return [p for args, kwargs in
+                self.api.consulta_ultimos_estados_distribucion.call_args_list
+                for p in args[0]]
+
+    def test_cambios(self):
+        '''
+        Pruebo que solo se informen los cambios de estado.
+        '''
+        self.estado("1", "Ingresado")
+        self.seguimiento.agregar("1")
+        cambios = self.seguimiento.consultar()
+        self.assertEqual(cambios, [(("1", None), None,
+                                    self.estados["1", None])])
+        # ingresado se consulta con el intervalo maximo
+        self.ahora = 1000
+        self.assertEqual(self.seguimiento.consultar(), [])
+        self.estado("1", "En distribucion")
+        self.ahora = 2000
+        cambios = self.seguimiento.consultar()
+        self.assertEqual(cambios[0][1]['estado'], "Ingresado")
+        self.assertEqual(cambios[0][2]['estado'], "En distribucion")
+        self.assertEqual(self.al_cambiar.call_count, 2)
+
+    def test_intervalos(self):
+        '''
+        Pruebo que el intervalo dependa del estado y crezca mientras no hay
+        cambios.
+        '''
+        self.estado("1", "EN DISTRIBUCION")
+        self.estado("2", "Ingresado")
+        self.seguimiento.agregar("1")
+        self.seguimiento.agregar("2")
+        self.seguimiento.consultar()
+        self.assertEqual(self.seguimiento.proxima(), 10)
+        self.ahora = 10
+        self.seguimiento.consultar()
+        self.assertEqual(self.consultadas(), [("1", None), ("2", None),
+                                              ("1", None)])
+        # sin cambios el intervalo se duplica
+        self.assertEqual(self.seguimiento.proxima(), 20)
+        self.ahora = 29
+        self.assertEqual(self.seguimiento.consultar(), [])
+        self.assertEqual(len(self.consultadas()), 3)
+
+    def test_antiguedad(self):
+        '''
+        Pruebo que el intervalo crezca con la antiguedad del envio.
+        '''
+        self.seguimiento.edades = [(50, 2), (200, 3)]
+        self.estado("1", "En distribucion")
+        self.estado("2", "En distribucion")
+        self.estado("3", "En distribucion")
+        self.ahora = 300
+        self.seguimiento.agregar("1")
+        self.seguimiento.agregar("2", desde=200)
+        self.seguimiento.agregar("3", desde=0)
+        self.seguimiento.consultar()
+        self.assertEqual(self.seguimiento.proxima(), 10)
+        self.ahora = 310
+        self.seguimiento.consultar()
+        self.assertEqual(self.consultadas()[3:], [("1", None)])
+        self.ahora = 320
+        self.seguimiento.consultar()
+        self.assertEqual(self.consultadas()[4:], [("2", None)])
+        self.ahora = 329
+        self.seguimiento.consultar()
+        self.assertEqual(len(self.consultadas()), 5)
+        self.ahora = 330
+        self.seguimiento.consultar()
+        self.assertIn(("3", None), self.consultadas()[5:])
+
+    def test_finales(self):
+        '''
+        Pruebo que las piezas entregadas dejen de consultarse.
+        '''
+        self.estado("1", "Entregada")
+        self.seguimiento.agregar("1", estado={"estado": "En distribucion"})
+        self.assertEqual(len(self.seguimiento.consultar()), 1)
+        self.assertEqual(len(self.seguimiento), 0)
+        self.assertIsNone(self.seguimiento.proxima())
+
+    def test_errores(self):
+        '''
+        Pruebo que las piezas que fallan se vuelvan a consultar.
+        '''
+        self.estados["1", None] = andreani.APIError("error")
+        self.seguimiento.agregar("1")
+        self.assertEqual(self.seguimiento.consultar(), [])
+        self.assertEqual(self.seguimiento.proxima(), 100)
+
+    def test_quitar(self):
+        '''
+        Pruebo que las piezas quitadas no se consulten.
+        '''
+        self.seguimiento.agregar("1")
+        self.seguimiento.agregar("2")
+        self.seguimiento.quitar("1")
+        self.seguimiento.consultar()
+        self.assertEqual(self.consultadas(), [("2", None)])
+
+    def test_generador(self):
+        '''
+        Pruebo que el generador espere hasta la proxima consulta.
+        '''
+        def dormir(segundos):
+            self.ahora += segundos
+            self.estado("1", "Entregada")
+        self.seguimiento.dormir = dormir
+        self.estado("1", "En distribucion")
+        self.seguimiento.agregar("1")
+        cambios = [actual['estado'] for pieza, anterior, actual
+                   in self.seguimiento.cambios()]
+        self.assertEqual(cambios, ["En distribucion", "Entregada"])
+        self.assertEqual(self.ahora, 10)
+
+
 class DatosImpresionTests(TestCase):
     '''
     Set de pruebas de consultar datos de impresion
@@ -1075,6 +2070,1571 @@ class DatosImpresionTests(TestCase):
         self.assertTrue(datos)
 
 
+class DatosImpresionesTests(TestCase):
+    '''
+    Set de pruebas de la consulta de datos de impresion de muchas piezas.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+
+        def consultar(peticion, parametros):
+            numeros = [n['string'] for n in parametros['NumeroAndreani']]
+            if "error" in numeros:
+                raise andreani.APIError("error")
+            return Factory.object(dict={
+                'ResultadoConsultarDatosDeImpresion': [
+                    Factory.object(dict={
+                        "Categoria": "Estandar",
+                        "CodigoDeResultado": 1,
+                        "NumeroAndreani": numero,
+                        "SucursalDeDistribucion": "BAHIA BLANCA",
+                    })
+                    for numero in numeros if numero != "inexistente"]})
+        self.andreani._API__soap = mock.MagicMock(side_effect=consultar)
+
+    def test_lotes(self):
+        '''
+        Pruebo que las piezas se agrupen en peticiones y se generen en
+        orden.
+        '''
+        numeros = ["*%014d" % i for i in range(120)]
+        datos = list(self.andreani.consultar_datos_impresiones(
+            iter(numeros), por_peticion=50))
+        self.assertEqual(self.andreani._API__soap.call_count, 3)
+        self.assertEqual([numero for numero, d in datos], numeros)
+        numero, datos = datos[7]
+        self.assertEqual(datos['numero_andreani'], numero)
+        self.assertEqual(datos['sucursal_de_distribucion'], "BAHIA BLANCA")
+
+    def test_errores(self):
+        '''
+        Pruebo las piezas inexistentes y que el rechazo de una peticion se
+        asocie solo a las piezas que fallan.
+        '''
+        datos = list(self.andreani.consultar_datos_impresiones(
+            ["1", "inexistente", "error", "3", "4"], por_peticion=5))
+        self.assertEqual([numero for numero, d in datos],
+                         ["1", "inexistente", "error", "3", "4"])
+        datos = dict(datos)
+        self.assertEqual(datos["1"]['categoria'], "Estandar")
+        self.assertIsNone(datos["inexistente"])
+        self.assertIsInstance(datos["error"], andreani.APIError)
+        self.assertEqual(datos["3"]['categoria'], "Estandar")
+        self.assertEqual(datos["4"]['categoria'], "Estandar")
+
+
+class ClientesSoapTests(TestCase):
+    '''
+    Set de pruebas de reutilizacion de clientes suds.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+
+    @mock.patch('andreani.andreani.ClienteSoap')
+    def test_cliente_compartido(self, fake_client):
+        '''
+        Pruebo que las operaciones de un mismo wsdl compartan el cliente suds
+        aun entre distintas instancias de la API.
+        '''
+        client = fake_client('fake_url')
+        client.clone.return_value = client
+        client.service.ImprimirConstancia.return_value = Factory.object(
+            dict={"ResultadoImprimirConstancia": []})
+        client.service.AnularEnvios.return_value = None
+        client.service.GeneracionRemitodeImposicion.return_value = None
+        fake_client.reset_mock()
+        fake_client.return_value = client
+        api1 = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        api1.DEBUG = True
+        api2 = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        api2.DEBUG = True
+        api1.imprimir_constancia("*00000010310370")
+        api1.anular_envio("*00000010310370")
+        api2.generar_remito_imposicion("*00000010310370")
+        # ImposicionRemota.svc se parsea una unica vez
+        self.assertEqual(fake_client.call_count, 1)
+        self.assertEqual(len(andreani.API._clientes), 1)
+
+
+class ServidorSOAPTests(TestCase):
+    '''
+    Pruebas del circuito completo de suds contra un servidor SOAP local.
+    '''
+    WSSE = ("http://docs.oasis-open.org/wss/2004/01/"
+            "oasis-200401-wss-wssecurity-secext-1.0.xsd")
+
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        self.servidor = ServidorSOAP().iniciar()
+        self.addCleanup(self.servidor.detener)
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani._URL = {
+            'Staging': self.servidor.urls(andreani.API._URL['Staging'])}
+
+    def test_clon(self):
+        '''
+        Pruebo que los clones compartan el wsdl parseado y no las opciones.
+        '''
+        wsdl = self.andreani._URL['Staging']['cotizar_envio'][0]
+        cliente = andreani.API._cliente(wsdl)
+        clon = cliente.clone()
+        self.assertIs(clon.wsdl, cliente.wsdl)
+        self.assertIsNot(clon.options, cliente.options)
+
+    def test_cotizar_envio(self):
+        '''
+        Pruebo una peticion SOAP 1.2 con credenciales.
+        '''
+        self.servidor.respuestas['CotizarEnvio'] = {
+            "CategoriaDistancia": "INTERIOR 1",
+            "CategoriaDistanciaId": "2",
+            "CategoriaPeso": "1",
+            "CategoriaPesoId": "1",
+            "PesoAforado": 1.0,
+            "Tarifa": 55.9,
+        }
+        cotizacion = self.andreani.cotizar_envio(cp_destino="9410",
+                                                 peso="1",
+                                                 contrato=CONTRATO_ESTANDAR,
+                                                 volumen="1")
+        self.assertEqual(cotizacion['tarifa'], 55.9)
+        metodo, envoltorio = self.servidor.peticiones[-1]
+        self.assertEqual(envoltorio.tag, "{%s}Envelope" % ENV_12)
+        usuario = envoltorio.find(".//{%s}Username" % self.WSSE)
+        self.assertEqual(usuario.text, TEST_USER)
+
+    def test_fault(self):
+        '''
+        Pruebo que un fault del servidor se traduzca a la excepcion de la
+        API.
+        '''
+        self.servidor.respuestas['CotizarEnvio'] = Fault(
+            "Codigo postal es invalido")
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.cotizar_envio(cp_destino="1",
+                                        peso="1",
+                                        contrato=CONTRATO_ESTANDAR,
+                                        volumen="1")
+
+    def test_fault_soap_11(self):
+        '''
+        Pruebo que un fault de SOAP 1.1 se traduzca a la excepcion de la API
+        y quede en la cache de codigos postales invalidos.
+        '''
+        self.andreani.CACHE_CODIGOS_POSTALES = andreani.CacheCodigosPostales()
+        self.servidor.respuestas['ConsultarCodigoPostal'] = Fault(
+            "Codigo postal es invalido")
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.consultar_codigo_postal("1")
+        self.assertTrue(self.andreani.CACHE_CODIGOS_POSTALES.invalido("1"))
+        envoltorio = self.servidor.peticiones[-1][1]
+        self.assertNotEqual(envoltorio.tag, "{%s}Envelope" % ENV_12)
+        self.servidor.respuestas['ConsultarDatosDeImpresion'] = Fault(
+            "Numero inexistente")
+        with self.assertRaisesRegex(andreani.APIError, "Numero inexistente"):
+            self.andreani.consultar_datos_impresion("*00000000249801")
+
+    def test_soap_11(self):
+        '''
+        Pruebo una peticion SOAP 1.1.
+        '''
+        self.servidor.respuestas['ConsultarDatosDeImpresion'] = {
+            'ResultadoConsultarDatosDeImpresion': [
+                {"NumeroAndreani": "*00000000249801", "CodigoDeResultado": 1}
+            ]}
+        datos = self.andreani.consultar_datos_impresion("*00000000249801")
+        resultado = datos['resultado_consultar_datos_de_impresion'][0]
+        self.assertEqual(resultado['numero_andreani'], "*00000000249801")
+        metodo, envoltorio = self.servidor.peticiones[-1]
+        self.assertNotEqual(envoltorio.tag, "{%s}Envelope" % ENV_12)
+        self.assertIsNotNone(envoltorio.find(".//{%s}Username" % self.WSSE))
+
+
+class ConversionTests(TestCase):
+    '''
+    Set de pruebas de la conversion de respuestas a diccionarios.
+    '''
+    def test_identica(self):
+        '''
+        Pruebo que la conversion coincida con la implementacion recursiva
+        original.
+        '''
+        objeto = benchmark.reporte(50)
+        self.assertEqual(andreani.conversion.a_dict(objeto),
+                         benchmark.a_dict_recursivo(objeto))
+
+    def test_pythonizar(self):
+        '''
+        Pruebo la conversion de nombres, que descarta lo que no son letras.
+        '''
+        pythonizar = andreani.conversion.pythonizar
+        self.assertEqual(pythonizar("NumeroAndreani"), "numero_andreani")
+        self.assertEqual(pythonizar("Telefono1"), "telefono")
+        self.assertEqual(pythonizar("idCliente"), "id_cliente")
+        self.assertEqual(pythonizar("Pieza_"), "pieza")
+
+    def test_profundidad(self):
+        '''
+        Pruebo que la conversion no este limitada por la recursion.
+        '''
+        objeto = Factory.object(dict={"Valor": 1})
+        for i in range(5000):
+            objeto = Factory.object(dict={"Hijo": objeto})
+        resultado = andreani.conversion.a_dict(objeto)
+        for i in range(5000):
+            resultado = resultado["hijo"]
+        self.assertEqual(resultado, {"valor": 1})
+
+
+class BenchmarkTests(TestCase):
+    '''
+    Set de pruebas de las mediciones de rendimiento.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+
+    def test_percentil(self):
+        '''
+        Pruebo el calculo de percentiles por rango mas cercano.
+        '''
+        valores = list(range(1, 101))
+        self.assertEqual(benchmark.percentil(valores, 50), 50)
+        self.assertEqual(benchmark.percentil(valores, 99), 99)
+        self.assertEqual(benchmark.percentil([7], 90), 7)
+
+    def test_operaciones(self):
+        '''
+        Pruebo que se midan todas las operaciones contra el servidor local y
+        que el resultado pueda serializarse en JSON.
+        '''
+        proceso, url = benchmark.servidor()
+        try:
+            resultados = benchmark.operaciones(url, llamadas=2,
+                                               concurrencia=2)
+        finally:
+            proceso.terminate()
+            proceso.join()
+        self.assertEqual(
+            set(resultados),
+            set(benchmark.OPERACIONES) |
+            set(nombre + "[xml]" for nombre in benchmark.XML_DIRECTO))
+        for resultado in resultados.values():
+            self.assertLessEqual(resultado['p50'], resultado['maximo'])
+            self.assertGreater(resultado['por_segundo'], 0)
+            self.assertGreater(resultado['memoria_pico'], 0)
+        json.dumps(resultados)
+
+
+class ImportacionTests(TestCase):
+    '''
+    Set de pruebas de la importacion del paquete.
+    '''
+    def test_sin_suds(self):
+        '''
+        Pruebo que importar el paquete no cargue suds.
+        '''
+        self.assertFalse(benchmark.importacion(repeticiones=1)['suds'])
+
+    def test_exportados(self):
+        '''
+        Pruebo que los nombres exportados se resuelvan al usarse.
+        '''
+        for nombre in andreani.__all__:
+            self.assertTrue(hasattr(andreani, nombre), nombre)
+        self.assertIs(andreani.APIError, andreani.andreani.APIError)
+        self.assertIs(andreani.lotes, importlib.import_module(
+            "andreani.lotes"))
+        with self.assertRaises(AttributeError):
+            andreani.Inexistente
+
+
+class IterarEnviosTests(TestCase):
+    '''
+    Set de pruebas de los reportes de envios generados de a uno.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        self.servidor = ServidorSOAP().iniciar()
+        self.addCleanup(self.servidor.detener)
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani._URL = {
+            'Staging': self.servidor.urls(andreani.API._URL['Staging'])}
+        self.envios = [{"Calle": "Florencio Varela", "Departamento": None,
+                        "NombreyApellido": "Susana Horia",
+                        "Numero": str(1900 + i),
+                        "NumeroAndreani": "*%014d" % i} for i in range(20)]
+
+    def test_pendientes_impresion(self):
+        '''
+        Pruebo que los envios generados coincidan con el reporte.
+        '''
+        self.servidor.respuestas['ReporteDeEnviosPendientesImpresion'] = {
+            "ResultadoReporteEnviosPendientesImpresion": self.envios}
+        envios = self.andreani.iterar_envios_pendientes_impresion()
+        self.assertNotIsInstance(envios, list)
+        self.assertEqual(list(envios),
+                         self.andreani.reporte_envios_pendientes_impresion())
+
+    def test_pendientes_ingreso(self):
+        '''
+        Pruebo el reporte de envios pendientes de ingreso.
+        '''
+        self.servidor.respuestas['ReporteDeEnviosPendientesIngreso'] = {
+            "ResultadoReporteEnviosPendientesIngreso": self.envios}
+        envios = list(self.andreani.iterar_envios_pendientes_ingreso())
+        self.assertEqual(envios,
+                         self.andreani.reporte_envios_pendientes_ingreso())
+        self.assertEqual(envios[3]['numero_andreani'], "*00000000000003")
+        self.assertIsNone(envios[3]['departamento'])
+
+    def test_vacio(self):
+        '''
+        Pruebo un reporte sin envios.
+        '''
+        self.servidor.respuestas['ReporteDeEnviosPendientesIngreso'] = {}
+        self.assertEqual(
+            list(self.andreani.iterar_envios_pendientes_ingreso()), [])
+
+    def test_fault(self):
+        '''
+        Pruebo que un fault se traduzca a la excepcion de la API.
+        '''
+        self.servidor.respuestas['ReporteDeEnviosPendientesImpresion'] = (
+            Fault("Cliente inexistente"))
+        with self.assertRaises(andreani.APIError):
+            list(self.andreani.iterar_envios_pendientes_impresion())
+
+    def test_incremental(self):
+        '''
+        Pruebo que las filas se generen antes de leer el resto del XML.
+        '''
+        body = (b'<r><Fila><NumeroAndreani>1</NumeroAndreani></Fila>'
+                b'<Fila><NumeroAnd')
+        filas = andreani.lector.filas(body, "Fila", andreani.APIError)
+        self.assertEqual(next(filas), {"numero_andreani": "1"})
+        with self.assertRaises(ElementTree.ParseError):
+            next(filas)
+
+
+class XMLDirectoTests(TestCase):
+    '''
+    Set de pruebas de la lectura directa del XML de las respuestas. Cada
+    resultado debe coincidir con el obtenido a traves de suds.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        self.servidor = ServidorSOAP().iniciar()
+        self.addCleanup(self.servidor.detener)
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani._URL = {
+            'Staging': self.servidor.urls(andreani.API._URL['Staging'])}
+
+    def comparar(self, metodo, *args):
+        '''
+        Devuelve el resultado del metodo leyendo el XML directamente, luego
+        de verificar que coincida con el obtenido a traves de suds.
+        '''
+        esperado = getattr(self.andreani, metodo)(*args)
+        self.andreani.XML_DIRECTO = True
+        try:
+            resultado = getattr(self.andreani, metodo)(*args)
+        finally:
+            self.andreani.XML_DIRECTO = False
+        self.assertEqual(resultado, esperado)
+        return resultado
+
+    def test_sucursales(self):
+        '''
+        Pruebo la consulta de sucursales, con valores enteros y vacios.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": [
+                {"Descripcion": "Sucursal %d" % i, "Sucursal": i,
+                 "Mail": None, "Telefono1": ""} for i in range(3)]}
+        sucursales = self.comparar('consultar_sucursales')
+        self.assertEqual(sucursales[2]['sucursal'], 2)
+        self.assertIsNone(sucursales[0]['telefono'])
+
+    def test_una_sucursal(self):
+        '''
+        Pruebo que una unica sucursal tambien se devuelva en una lista.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": {"TipoSucursal": 1}}
+        self.assertEqual(self.comparar('consultar_sucursales', "1754"),
+                         [{"tipo_sucursal": 1}])
+
+    def test_sin_sucursales(self):
+        '''
+        Pruebo una consulta sin sucursales.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = {}
+        self.assertEqual(self.comparar('consultar_sucursales'), [])
+
+    def test_codigo_postal_invalido(self):
+        '''
+        Pruebo que el fault de codigo postal invalido lance
+        CodigoPostalInvalido.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = Fault(
+            "Codigo postal es invalido")
+        self.andreani.XML_DIRECTO = True
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.consultar_sucursales("9999")
+
+    def test_trazabilidad(self):
+        '''
+        Pruebo la trazabilidad, con listas anidadas.
+        '''
+        self.servidor.respuestas[
+            'ObtenerTrazabilidadSinClienteCodificado'] = {
+                "NumeroEnvio": "1",
+                "Envios": {"NroAndreani": "*1", "Eventos": [
+                    {"IdEstado": i, "Estado": "Estado %d" % i,
+                     "Motivo": None} for i in range(3)]}}
+        resultado = self.comparar('consultar_trazabilidad', "1")
+        self.assertEqual(resultado['envios'][0]['eventos'][1]['id_estado'],
+                         1)
+
+    def test_fault(self):
+        '''
+        Pruebo que un fault se traduzca a APIError.
+        '''
+        self.servidor.respuestas[
+            'ObtenerTrazabilidadSinClienteCodificado'] = Fault(
+                "Pieza inexistente")
+        self.andreani.XML_DIRECTO = True
+        with self.assertRaises(andreani.APIError) as contexto:
+            self.andreani.consultar_trazabilidad("1")
+        self.assertEqual(str(contexto.exception), "Pieza inexistente")
+
+    def test_reportes(self):
+        '''
+        Pruebo los reportes de envios pendientes.
+        '''
+        envios = [{"Calle": "Florencio Varela", "Departamento": None,
+                   "NumeroAndreani": "*%014d" % i} for i in range(5)]
+        self.servidor.respuestas['ReporteDeEnviosPendientesImpresion'] = {
+            "ResultadoReporteEnviosPendientesImpresion": envios}
+        self.servidor.respuestas['ReporteDeEnviosPendientesIngreso'] = {
+            "ResultadoReporteEnviosPendientesIngreso": envios[0]}
+        self.assertEqual(
+            len(self.comparar('reporte_envios_pendientes_impresion')), 5)
+        self.assertEqual(
+            len(self.comparar('reporte_envios_pendientes_ingreso')), 1)
+
+    def test_reporte_vacio(self):
+        '''
+        Pruebo un reporte sin envios.
+        '''
+        self.servidor.respuestas['ReporteDeEnviosPendientesIngreso'] = {}
+        self.assertIsNone(self.comparar('reporte_envios_pendientes_ingreso'))
+
+    def test_elementos_vacios(self):
+        '''
+        Pruebo que los elementos complejos vacios se omitan igual que en
+        suds.
+        '''
+        traza = 'ObtenerTrazabilidadSinClienteCodificado'
+        self.servidor.respuestas[traza] = {"NumeroEnvio": "1", "Envios": {}}
+        self.assertEqual(self.comparar('consultar_trazabilidad', "1"),
+                         {"numero_envio": "1", "envios": []})
+        self.servidor.respuestas[traza] = {
+            "NumeroEnvio": "1",
+            "Envios": [{}, {"NroAndreani": "*1", "Eventos": {}}]}
+        self.assertEqual(self.comparar('consultar_trazabilidad', "1"),
+                         {"numero_envio": "1",
+                          "envios": [{"nro_andreani": "*1", "eventos": []}]})
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": {}}
+        self.assertEqual(self.comparar('consultar_sucursales'), [])
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": [{}, {"Sucursal": 1}]}
+        self.assertEqual(self.comparar('consultar_sucursales'),
+                         [{"sucursal": 1}])
+        self.servidor.respuestas['ReporteDeEnviosPendientesIngreso'] = {
+            "ResultadoReporteEnviosPendientesIngreso": [
+                {}, {"NumeroAndreani": "*1"}]}
+        self.assertEqual(self.comparar('reporte_envios_pendientes_ingreso'),
+                         [{"numero_andreani": "*1"}])
+        self.assertEqual(
+            list(self.andreani.iterar_envios_pendientes_ingreso()),
+            [{"numero_andreani": "*1"}])
+
+
+class CacheWSDLTests(TestCase):
+    '''
+    Set de pruebas de la cache persistente de wsdl.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+
+    def tearDown(self):
+        andreani.API.CACHE_WSDL = None
+
+    def test_persistencia(self):
+        '''
+        Pruebo que una entrada guardada por una cache sea leida por otra
+        instancia sobre el mismo directorio.
+        '''
+        cache = andreani.CacheWSDL(self.directorio.name)
+        cache.put("wsdl", {"servicio": "CotizacionEnvio"})
+        otra = andreani.CacheWSDL(self.directorio.name)
+        self.assertEqual(otra.get("wsdl"), {"servicio": "CotizacionEnvio"})
+        # las entradas quedan bajo el subdirectorio de la huella del entorno
+        self.assertEqual(cache.location,
+                         os.path.join(self.directorio.name,
+                                      andreani.CacheWSDL.huella()))
+
+    def test_huella_distinta(self):
+        '''
+        Pruebo que las entradas de otra huella no sean utilizadas.
+        '''
+        cache = andreani.CacheWSDL(self.directorio.name)
+        cache.put("wsdl", "viejo")
+        with mock.patch.object(andreani.CacheWSDL, 'huella',
+                               return_value="otra"):
+            otra = andreani.CacheWSDL(self.directorio.name)
+        self.assertIsNone(otra.get("wsdl"))
+
+    @mock.patch('andreani.andreani.ClienteSoap')
+    def test_cliente_con_cache(self, fake_client):
+        '''
+        Pruebo que los clientes suds se construyan usando la cache
+        configurada.
+        '''
+        cache = andreani.CacheWSDL(self.directorio.name)
+        andreani.API.CACHE_WSDL = cache
+        andreani.API._cliente("http://example.com/servicio?wsdl")
+        fake_client.assert_called_once_with(
+            "http://example.com/servicio?wsdl", cache=cache, cachingpolicy=1)
+
+
+class CacheTTLTests(TestCase):
+    '''
+    Set de pruebas de la cache en memoria con vencimiento.
+    '''
+    def setUp(self):
+        self.ahora = 0
+        self.cache = andreani.CacheTTL(maximo=2, ttl=10, obsoleto=5)
+        self.cache.reloj = lambda: self.ahora
+        self.calcular = mock.MagicMock(side_effect=lambda: self.ahora)
+
+    def test_aciertos(self):
+        '''
+        Pruebo que el valor se calcule una unica vez mientras es valido.
+        '''
+        self.assertEqual(self.cache.obtener("a", self.calcular), 0)
+        self.ahora = 9
+        self.assertEqual(self.cache.obtener("a", self.calcular), 0)
+        self.assertEqual(self.calcular.call_count, 1)
+        self.assertEqual((self.cache.aciertos, self.cache.fallos), (1, 1))
+
+    def test_vencimiento(self):
+        '''
+        Pruebo que las entradas vencidas se vuelvan a calcular.
+        '''
+        self.cache.obsoleto = 0
+        self.cache.obtener("a", self.calcular)
+        self.ahora = 10
+        self.assertEqual(self.cache.obtener("a", self.calcular), 10)
+        self.assertEqual(self.cache.fallos, 2)
+
+    def test_lru(self):
+        '''
+        Pruebo que al llenarse se descarte la entrada menos usada.
+        '''
+        self.cache.guardar("a", 1)
+        self.cache.guardar("b", 2)
+        self.cache.obtener("a", self.calcular)
+        self.cache.guardar("c", 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.obtener("a", self.calcular), 1)
+        self.assertEqual(self.cache.obtener("c", self.calcular), 3)
+        self.assertEqual(self.cache.obtener("b", self.calcular), 0)
+
+    def test_obsoleto(self):
+        '''
+        Pruebo que una entrada vencida se devuelva mientras se actualiza en
+        segundo plano.
+        '''
+        self.cache.guardar("a", "viejo")
+        self.ahora = 12
+        actualizado = threading.Event()
+
+        def calcular():
+            actualizado.wait(5)
+            return "nuevo"
+        self.assertEqual(self.cache.obtener("a", calcular), "viejo")
+        self.assertEqual(self.cache.obtener("a", calcular), "viejo")
+        self.assertEqual(self.cache.obsoletos, 2)
+        actualizado.set()
+        for i in range(100):
+            if self.cache.obtener("a", calcular) == "nuevo":
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.cache.obtener("a", calcular), "nuevo")
+        # pasado el periodo de obsolescencia se calcula nuevamente
+        self.ahora = 100
+        self.assertEqual(self.cache.obtener("a", self.calcular), 100)
+
+    def test_errores(self):
+        '''
+        Pruebo que los errores no se guarden en la cache.
+        '''
+        self.calcular.side_effect = andreani.APIError("error")
+        with self.assertRaises(andreani.APIError):
+            self.cache.obtener("a", self.calcular)
+        self.assertEqual(len(self.cache), 0)
+
+
+class CacheCotizacionesTests(TestCase):
+    '''
+    Set de pruebas de la cache de cotizaciones.
+    '''
+    def setUp(self):
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani.CACHE_COTIZACIONES = andreani.CacheCotizaciones(
+            rango_peso=500)
+        self.andreani._API__soap = mock.MagicMock(
+            side_effect=lambda peticion, cotizacionEnvio: Factory.object(
+                dict={"Tarifa": 50.0,
+                      "PesoAforado": cotizacionEnvio['Peso']}))
+
+    def cotizar(self, **kwargs):
+        parametros = {'cp_destino': "1754", 'peso': "1000", 'volumen': "1",
+                      'contrato': CONTRATO_ESTANDAR}
+        parametros.update(kwargs)
+        return self.andreani.cotizar_envio(**parametros)
+
+    def test_cache(self):
+        '''
+        Pruebo que las cotizaciones repetidas no realicen peticiones.
+        '''
+        self.assertEqual(self.cotizar(), self.cotizar())
+        self.assertEqual(self.andreani._API__soap.call_count, 1)
+        cache = self.andreani.CACHE_COTIZACIONES
+        self.assertEqual((cache.aciertos, cache.fallos), (1, 1))
+
+    def test_rangos(self):
+        '''
+        Pruebo que los pesos del mismo rango compartan la cotizacion y que se
+        cotice con el limite superior del rango.
+        '''
+        self.assertEqual(self.cotizar(peso="501")['peso_aforado'], 1000)
+        self.assertEqual(self.cotizar(peso=999)['peso_aforado'], 1000)
+        self.assertEqual(self.cotizar(peso="1001")['peso_aforado'], 1500)
+        self.assertEqual(self.andreani._API__soap.call_count, 2)
+
+    def test_clave(self):
+        '''
+        Pruebo que cambie la clave con el destino, el contrato y el cliente.
+        '''
+        self.cotizar()
+        self.cotizar(cp_destino="9410")
+        self.cotizar(contrato=CONTRATO_URGENTE)
+        self.cotizar(sucursal_retiro=20)
+        otro = andreani.API(TEST_USER, TEST_PASSWD, "OTRO")
+        otro.CACHE_COTIZACIONES = self.andreani.CACHE_COTIZACIONES
+        otro._API__soap = self.andreani._API__soap
+        otro.cotizar_envio(cp_destino="1754", peso="1000", volumen="1",
+                           contrato=CONTRATO_ESTANDAR)
+        self.assertEqual(self.andreani._API__soap.call_count, 5)
+
+
+class Soap12Tests(TestCase):
+    '''
+    Set de pruebas del envoltorio SOAP 1.2.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+
+    def test_plugin(self):
+        '''
+        Pruebo que el plugin cambie el namespace del envoltorio sin tocar el
+        contenido del mensaje.
+        '''
+        envelope = Element("Envelope", ns=binding.envns)
+        body = Element("Body", ns=binding.envns)
+        body.append(Element("CotizarEnvio", ns=("ns0", "urn:andreani")))
+        envelope.append(Element("Header", ns=binding.envns))
+        envelope.append(body)
+        andreani.andreani.Soap12Plugin().marshalled(
+            mock.Mock(envelope=envelope))
+        xml = envelope.plain()
+        self.assertIn('"http://www.w3.org/2003/05/soap-envelope"', xml)
+        self.assertNotIn(binding.envns[1], xml)
+        self.assertIn('xmlns:ns0="urn:andreani"', xml)
+
+    @mock.patch('andreani.andreani.ClienteSoap')
+    def test_sin_estado_global(self, fake_client):
+        '''
+        Pruebo que las peticiones SOAP 1.2 no modifiquen el namespace global
+        de suds y que cada metodo tenga su propio cliente configurado.
+        '''
+        envns = binding.envns
+        client = fake_client('fake_url')
+        client.clone.side_effect = lambda: mock.MagicMock()
+        fake_client.return_value = client
+        api = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        api.DEBUG = True
+        api.consultar_codigo_postal(1001)
+        api.cotizar_envio(cp_destino="1001", peso="1", volumen="1",
+                          contrato=CONTRATO_ESTANDAR)
+        self.assertEqual(binding.envns, envns)
+        clientes = api._API__clientes
+        self.assertEqual(len(clientes), 2)
+        # solo el metodo SOAP 1.2 lleva el plugin
+        for (wsdl, metodo, enviar), soap in clientes.items():
+            opciones = soap.set_options.call_args_list
+            plugins = [p for c in opciones for p in c[1].get('plugins', [])]
+            soap12 = [p for p in plugins
+                      if isinstance(p, andreani.andreani.Soap12Plugin)]
+            self.assertEqual(bool(soap12), metodo == 'CotizarEnvio')
+
+
+class ServidorEco(http.server.BaseHTTPRequestHandler):
+    '''
+    Servidor HTTP de pruebas que devuelve el cuerpo de cada peticion.
+    '''
+    protocol_version = "HTTP/1.1"
+    conexiones = 0
+    # cuerpos recibidos en /cortar
+    cortadas = []
+
+    def setup(self):
+        type(self).conexiones += 1
+        super().setup()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == "/cortar":
+            # proceso la peticion y cierro la conexion sin responder
+            self.cortadas.append(body)
+            self.close_connection = True
+            return
+        self.send_response(500 if self.path == "/error" else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == "/ociosa":
+            # cierro la conexion sin avisar, como un servidor que cierra las
+            # conexiones ociosas
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class TransportePoolTests(TestCase):
+    '''
+    Set de pruebas del transporte con pool de conexiones.
+    '''
+    def setUp(self):
+        ServidorEco.conexiones = 0
+        ServidorEco.cortadas = []
+        self.servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                        ServidorEco)
+        threading.Thread(target=self.servidor.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(self.servidor.server_close)
+        self.addCleanup(self.servidor.shutdown)
+        self.url = "http://127.0.0.1:%d" % self.servidor.server_port
+        self.transporte = andreani.TransportePool(conexiones=2)
+        self.addCleanup(self.transporte.cerrar)
+
+    def test_keep_alive(self):
+        '''
+        Pruebo que las peticiones sucesivas reutilicen la conexion.
+        '''
+        for i in range(5):
+            request = suds.transport.Request(self.url + "/servicio",
+                                             b"peticion %d" % i)
+            reply = self.transporte.send(request)
+            self.assertEqual(reply.message, b"peticion %d" % i)
+        self.assertEqual(ServidorEco.conexiones, 1)
+
+    def test_error_http(self):
+        '''
+        Pruebo que un error HTTP se informe a suds con el cuerpo de la
+        respuesta.
+        '''
+        request = suds.transport.Request(self.url + "/error", b"fault")
+        with self.assertRaises(suds.transport.TransportError) as cm:
+            self.transporte.send(request)
+        self.assertEqual(cm.exception.httpcode, 500)
+        self.assertEqual(cm.exception.fp.read(), b"fault")
+
+    def test_clon_comparte_pool(self):
+        '''
+        Pruebo que los clientes suds clonados compartan el transporte.
+        '''
+        self.assertIs(copy.deepcopy(self.transporte), self.transporte)
+
+    def test_conexion_ociosa_cerrada(self):
+        '''
+        Pruebo que una conexion ociosa cerrada por el servidor se descarte
+        antes de enviar la peticion.
+        '''
+        request = suds.transport.Request(self.url + "/ociosa", b"uno")
+        self.transporte.send(request)
+        time.sleep(0.2)
+        request = suds.transport.Request(self.url + "/eco", b"dos")
+        self.assertEqual(self.transporte.send(request).message, b"dos")
+        self.assertEqual(ServidorEco.conexiones, 2)
+
+    def test_post_enviado_no_se_reintenta(self):
+        '''
+        Pruebo que un POST enviado por una conexion reutilizada no se
+        reenvie si el servidor la cierra sin responder.
+        '''
+        request = suds.transport.Request(self.url + "/eco", b"uno")
+        self.transporte.send(request)
+        request = suds.transport.Request(self.url + "/cortar", b"compra")
+        with self.assertRaises(ConnectionError):
+            self.transporte.send(request)
+        self.assertEqual(ServidorEco.cortadas, [b"compra"])
+
+
+class EventosTests(TestCase):
+    '''
+    Set de pruebas de los eventos con los tiempos de cada peticion.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        self.servidor = ServidorSOAP().iniciar()
+        self.addCleanup(self.servidor.detener)
+        self.andreani = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani._URL = {
+            'Staging': self.servidor.urls(andreani.API._URL['Staging'])}
+        self.eventos = []
+        self.andreani.OYENTES = (self.eventos.append,)
+        self.servidor.respuestas['CotizarEnvio'] = {
+            "CategoriaDistancia": "INTERIOR 1", "Tarifa": 143.3}
+
+    def cotizar(self):
+        return self.andreani.cotizar_envio(peso=1, volumen=1,
+                                           cp_destino="1754",
+                                           contrato="AAAA00000")
+
+    def test_fases(self):
+        '''
+        Pruebo el evento de una peticion exitosa.
+        '''
+        resultado = self.cotizar()
+        self.assertEqual(resultado, {"categoria_distancia": "INTERIOR 1",
+                                     "tarifa": 143.3})
+        evento, = self.eventos
+        self.assertEqual((evento.operacion, evento.metodo, evento.version),
+                         ("cotizar_envio", "CotizarEnvio", 1.2))
+        self.assertEqual(list(evento.fases), ["wsdl", "cliente", "armado",
+                                              "red", "lectura",
+                                              "conversion"])
+        self.assertEqual(evento.resultado, "ok")
+        self.assertIsNone(evento.error)
+        self.assertGreater(evento.bytes_peticion, 0)
+        self.assertGreater(evento.bytes_respuesta, 0)
+        self.assertAlmostEqual(sum(evento.fases.values()), evento.duracion,
+                               places=2)
+
+    def test_timeout_transporte(self):
+        '''
+        Pruebo que con oyentes el timeout de lectura lo siga decidiendo el
+        transporte.
+        '''
+        transporte = andreani.TransportePool(timeout_lectura=7)
+        self.addCleanup(transporte.cerrar)
+        self.andreani.transporte = transporte
+        with mock.patch.object(transporte, 'send',
+                               wraps=transporte.send) as send:
+            self.cotizar()
+        request, = send.call_args[0]
+        self.assertIsNone(request.timeout)
+
+    def test_sin_oyentes(self):
+        '''
+        Pruebo que sin oyentes no se creen eventos.
+        '''
+        self.andreani.OYENTES = ()
+        with mock.patch('andreani.andreani.Evento') as evento:
+            self.cotizar()
+        evento.assert_not_called()
+
+    def test_fault(self):
+        '''
+        Pruebo el evento de una peticion que devuelve un fault.
+        '''
+        self.servidor.respuestas['CotizarEnvio'] = Fault("Contrato invalido")
+        self.servidor.respuestas['ConsultarSucursales'] = Fault(
+            "Codigo postal es invalido")
+        with self.assertRaises(andreani.APIError):
+            self.cotizar()
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.andreani.consultar_sucursales("9999")
+        self.assertEqual([e.resultado for e in self.eventos],
+                         ["APIError", "CodigoPostalInvalido"])
+        self.assertIsInstance(self.eventos[0].error, andreani.APIError)
+        self.assertIn("red", self.eventos[0].fases)
+
+    def test_xml_directo(self):
+        '''
+        Pruebo el evento de una peticion leida directamente del XML.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": [{"Sucursal": 1}]}
+        self.andreani.XML_DIRECTO = True
+        self.andreani.consultar_sucursales()
+        evento, = self.eventos
+        self.assertEqual(evento.operacion, "consultar_sucursales")
+        self.assertEqual(list(evento.fases), ["wsdl", "cliente", "armado",
+                                              "red", "lectura"])
+
+
+class MetricasTests(TestCase):
+    '''
+    Set de pruebas del registro de metricas.
+    '''
+    def setUp(self):
+        self.metricas = andreani.Metricas(buckets=(0.1, 1))
+
+    def registrar(self, operacion, duracion, error=None):
+        evento = andreani.Evento(operacion, "Metodo", 1.2)
+        self.metricas.iniciar(evento)
+        evento.finalizar(error)
+        evento.duracion = duracion
+        self.metricas(evento)
+
+    def test_operaciones(self):
+        '''
+        Pruebo que las metricas incluyan todas las operaciones de la API.
+        '''
+        operaciones = self.metricas.a_dict()['operaciones']
+        self.assertEqual(set(operaciones),
+                         set(andreani.API._URL['Staging']))
+        self.assertEqual(operaciones['cotizar_envio']['llamadas'], 0)
+
+    def test_llamadas(self):
+        '''
+        Pruebo los contadores y el histograma de una operacion.
+        '''
+        self.registrar("cotizar_envio", 0.05)
+        self.registrar("cotizar_envio", 0.5, andreani.APIError("error"))
+        self.registrar("cotizar_envio", 5, andreani.CodigoPostalInvalido())
+        operacion = self.metricas.a_dict()['operaciones']['cotizar_envio']
+        self.assertEqual(operacion['llamadas'], 3)
+        self.assertEqual(operacion['en_curso'], 0)
+        self.assertEqual(operacion['errores'], {"APIError": 1,
+                                                "CodigoPostalInvalido": 1})
+        self.assertEqual(operacion['latencia'],
+                         {'buckets': {'0.1': 1, '1': 2, '+Inf': 3},
+                          'suma': 5.55, 'cantidad': 3})
+
+    def test_en_curso(self):
+        '''
+        Pruebo el contador de peticiones en curso.
+        '''
+        self.metricas.iniciar(andreani.Evento("anular_envio", "Metodo", 1.2))
+        operacion = self.metricas.a_dict()['operaciones']['anular_envio']
+        self.assertEqual(operacion['en_curso'], 1)
+
+    def test_caches(self):
+        '''
+        Pruebo los aciertos y fallos de las caches de la API.
+        '''
+        api = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        api.CACHE_COTIZACIONES = andreani.CacheCotizaciones()
+        api.CACHE_COTIZACIONES.obtener("a", lambda: 1)
+        api.CACHE_COTIZACIONES.obtener("a", lambda: 1)
+        metricas = andreani.Metricas(api)
+        self.assertEqual(metricas.a_dict()['caches'],
+                         {'cotizaciones': {'aciertos': 1, 'fallos': 1}})
+
+    def test_prometheus(self):
+        '''
+        Pruebo la exportacion en el formato de texto de Prometheus.
+        '''
+        self.registrar("cotizar_envio", 0.5, andreani.APIError("error"))
+        texto = self.metricas.prometheus()
+        lineas = texto.splitlines()
+        self.assertIn("# TYPE andreani_latencia_segundos histogram", lineas)
+        self.assertIn('andreani_llamadas_total{operacion="cotizar_envio"} 1',
+                      lineas)
+        self.assertIn('andreani_errores_total{operacion="cotizar_envio",'
+                      'error="APIError"} 1', lineas)
+        self.assertIn('andreani_latencia_segundos_bucket{'
+                      'operacion="cotizar_envio",le="+Inf"} 1', lineas)
+        self.assertIn('andreani_latencia_segundos_count{'
+                      'operacion="cotizar_envio"} 1', lineas)
+        self.assertTrue(texto.endswith("\n"))
+
+    def test_oyente(self):
+        '''
+        Pruebo las metricas de peticiones reales como oyente de la API.
+        '''
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        servidor = ServidorSOAP().iniciar()
+        self.addCleanup(servidor.detener)
+        servidor.respuestas['ConsultarSucursales'] = Fault("Sin sucursales")
+        api = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE)
+        api.DEBUG = True
+        api._URL = {'Staging': servidor.urls(andreani.API._URL['Staging'])}
+        api.OYENTES = (self.metricas,)
+        with self.assertRaises(andreani.APIError):
+            api.consultar_sucursales()
+        operacion = self.metricas.a_dict()['operaciones'][
+            'consultar_sucursales']
+        self.assertEqual((operacion['llamadas'], operacion['en_curso']),
+                         (1, 0))
+        self.assertEqual(operacion['errores'], {"APIError": 1})
+
+
+class GrabacionTests(TestCase):
+    '''
+    Set de pruebas de la grabacion y reproduccion de respuestas.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        self.servidor = ServidorSOAP().iniciar()
+        self.addCleanup(self.servidor.detener)
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        self.urls = {
+            'Staging': self.servidor.urls(andreani.API._URL['Staging'])}
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": [{"Sucursal": 1}]}
+        self.servidor.respuestas[
+            'ObtenerTrazabilidadSinClienteCodificado'] = Fault(
+                "Pieza inexistente")
+
+    def api(self, transporte):
+        api = andreani.API(TEST_USER, TEST_PASSWD, CLIENTE,
+                           transporte=transporte)
+        api.DEBUG = True
+        api._URL = self.urls
+        return api
+
+    def grabar(self):
+        '''
+        Graba una consulta de sucursales y una consulta fallida.
+        '''
+        grabador = andreani.TransporteGrabador(self.directorio.name)
+        self.addCleanup(grabador.transporte.cerrar)
+        api = self.api(grabador)
+        self.assertEqual(api.consultar_sucursales(), [{"sucursal": 1}])
+        with self.assertRaises(andreani.APIError):
+            api.consultar_trazabilidad("1")
+
+    def test_reproduccion(self):
+        '''
+        Pruebo que las respuestas se reproduzcan sin realizar peticiones al
+        servidor.
+        '''
+        self.grabar()
+        reproductor = andreani.TransporteReproductor(self.directorio.name,
+                                                     velocidad=None)
+        # dos wsdl y dos peticiones
+        self.assertEqual(len(reproductor), 4)
+        # sin servidor y sin los wsdl ya cargados, con otras credenciales
+        self.servidor.detener()
+        andreani.API._clientes.clear()
+        api = andreani.API("otro", "otra", CLIENTE, transporte=reproductor)
+        api.DEBUG = True
+        api._URL = self.urls
+        self.assertEqual(api.consultar_sucursales(), [{"sucursal": 1}])
+        api.XML_DIRECTO = True
+        self.assertEqual(api.consultar_sucursales(), [{"sucursal": 1}])
+        with self.assertRaises(andreani.APIError) as contexto:
+            api.consultar_trazabilidad("1")
+        self.assertEqual(str(contexto.exception), "Pieza inexistente")
+        self.assertEqual(len(self.servidor.peticiones), 2)
+
+    def test_sin_grabacion(self):
+        '''
+        Pruebo que una peticion no grabada falle.
+        '''
+        self.grabar()
+        api = self.api(andreani.TransporteReproductor(self.directorio.name))
+        with self.assertRaises(Exception) as contexto:
+            api.consultar_sucursales("1754")
+        self.assertEqual(contexto.exception.args[0][0], 404)
+
+    def test_demora(self):
+        '''
+        Pruebo la demora de la reproduccion segun la velocidad y la latencia
+        configuradas.
+        '''
+        self.grabar()
+        reproductor = andreani.TransporteReproductor(
+            self.directorio.name, velocidad=2, latencia=lambda: 0.5)
+        demoras = []
+        reproductor.dormir = demoras.append
+        api = self.api(reproductor)
+        api.consultar_sucursales()
+        self.assertEqual(len(demoras), 1)
+        self.assertGreater(demoras[0], 0.5)
+        # sin demora
+        reproductor.velocidad = None
+        reproductor.latencia = 0
+        api.consultar_sucursales()
+        self.assertEqual(len(demoras), 1)
+
+    def test_clon_comparte_transporte(self):
+        '''
+        Pruebo que los clientes suds clonados compartan los transportes.
+        '''
+        grabador = andreani.TransporteGrabador(self.directorio.name)
+        reproductor = andreani.TransporteReproductor(self.directorio.name)
+        self.assertIs(copy.deepcopy(grabador), grabador)
+        self.assertIs(copy.deepcopy(reproductor), reproductor)
+
+
+class AsyncAPITests(TestCase):
+    '''
+    Set de pruebas del cliente asincronico contra el servidor SOAP local.
+    '''
+    def setUp(self):
+        andreani.API._clientes.clear()
+        self.addCleanup(andreani.API._clientes.clear)
+        self.servidor = ServidorSOAP().iniciar()
+        self.addCleanup(self.servidor.detener)
+        self.andreani = andreani.AsyncAPI(TEST_USER, TEST_PASSWD, CLIENTE)
+        self.andreani.DEBUG = True
+        self.andreani._URL = {
+            'Staging': self.servidor.urls(andreani.API._URL['Staging'])}
+        self.servidor.respuestas['CotizarEnvio'] = {
+            "CategoriaDistancia": "INTERIOR 1",
+            "CategoriaDistanciaId": "2",
+            "CategoriaPeso": "1",
+            "CategoriaPesoId": "1",
+            "PesoAforado": 1.0,
+            "Tarifa": 55.9,
+        }
+
+    def ejecutar(self, corrutina):
+        async def ejecutar():
+            async with self.andreani:
+                return await corrutina
+        return asyncio.run(ejecutar())
+
+    def test_cotizar_envio(self):
+        '''
+        Pruebo una peticion SOAP 1.2.
+        '''
+        cotizacion = self.ejecutar(self.andreani.cotizar_envio(
+            cp_destino="9410", peso="1", contrato=CONTRATO_ESTANDAR,
+            volumen="1"))
+        self.assertEqual(cotizacion, {
+            "categoria_distancia": "INTERIOR 1",
+            "categoria_distancia_id": "2",
+            "categoria_peso": "1",
+            "categoria_peso_id": "1",
+            "peso_aforado": 1.0,
+            "tarifa": 55.9,
+        })
+        metodo, envoltorio = self.servidor.peticiones[-1]
+        self.assertEqual(metodo, "CotizarEnvio")
+        self.assertEqual(envoltorio.tag, "{%s}Envelope" % ENV_12)
+
+    def test_soap_11(self):
+        '''
+        Pruebo una peticion SOAP 1.1.
+        '''
+        self.servidor.respuestas['ConsultarDatosDeImpresion'] = {
+            'ResultadoConsultarDatosDeImpresion': [
+                {"NumeroAndreani": "*00000000249801", "CodigoDeResultado": 1}
+            ]}
+        datos = self.ejecutar(
+            self.andreani.consultar_datos_impresion("*00000000249801"))
+        resultado = datos['resultado_consultar_datos_de_impresion'][0]
+        self.assertEqual(resultado['codigo_de_resultado'], 1)
+
+    def test_procesa_resultado(self):
+        '''
+        Pruebo que el resultado se procese igual que en la API sincronica.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            'ResultadoConsultarSucursales': [
+                {"Descripcion": "Tucuman", "Sucursal": 33},
+                {"Descripcion": "Rosario", "Sucursal": 7},
+            ]}
+        sucursales = self.ejecutar(self.andreani.consultar_sucursales())
+        self.assertEqual([s['sucursal'] for s in sucursales], [33, 7])
+
+    def test_codigo_postal_invalido(self):
+        '''
+        Pruebo que los faults se traduzcan a las excepciones de la API.
+        '''
+        self.servidor.respuestas['CotizarEnvio'] = Fault(
+            "Codigo postal es invalido")
+        with self.assertRaises(andreani.CodigoPostalInvalido):
+            self.ejecutar(self.andreani.cotizar_envio(
+                cp_destino="1", peso="1", contrato=CONTRATO_ESTANDAR,
+                volumen="1"))
+
+    def test_api_error(self):
+        '''
+        Pruebo que un fault desconocido lance APIError.
+        '''
+        self.servidor.respuestas['CotizarEnvio'] = Fault("Error 500")
+        with self.assertRaises(andreani.APIError):
+            self.ejecutar(self.andreani.cotizar_envio(
+                cp_destino="1", peso="1", contrato=CONTRATO_ESTANDAR,
+                volumen="1"))
+
+    def test_concurrencia(self):
+        '''
+        Pruebo que las peticiones concurrentes no se esperen entre si y
+        reutilicen las conexiones.
+        '''
+        self.servidor.demora = 0.2
+        self.andreani.transporte_asincrono = andreani.TransporteAsincrono(
+            conexiones=5)
+
+        async def cotizar():
+            return await asyncio.gather(*[
+                self.andreani.cotizar_envio(cp_destino=str(cp), peso="1",
+                                            contrato=CONTRATO_ESTANDAR,
+                                            volumen="1")
+                for cp in range(1000, 1020)])
+
+        inicio = time.monotonic()
+        cotizaciones = self.ejecutar(cotizar())
+        # en secuencia demoraria 4 segundos
+        self.assertLess(time.monotonic() - inicio, 2)
+        self.assertEqual(len(cotizaciones), 20)
+        self.assertEqual(len(self.servidor.peticiones), 20)
+
+    def test_cotizar_envios(self):
+        '''
+        Pruebo la cotizacion asincronica de un lote.
+        '''
+        def cotizar(peticion):
+            cp = peticion.find(".//{urn:andreani:stub}CPDestino").text
+            if cp == "1":
+                return Fault("Codigo postal es invalido")
+            return {"Tarifa": float(cp)}
+        self.servidor.respuestas['CotizarEnvio'] = cotizar
+        cotizaciones = [
+            {'cp_destino': cp, 'peso': "1", 'volumen': "1",
+             'contrato': CONTRATO_ESTANDAR}
+            for cp in ["1754", "1", "1754", "5000"]]
+
+        async def cotizar_lote():
+            return [resultado async for cotizacion, resultado in
+                    self.andreani.cotizar_envios(cotizaciones)]
+
+        resultados = self.ejecutar(cotizar_lote())
+        self.assertEqual(resultados[0]['tarifa'], 1754.0)
+        self.assertIsInstance(resultados[1], andreani.CodigoPostalInvalido)
+        self.assertEqual(resultados[2]['tarifa'], 1754.0)
+        self.assertEqual(resultados[3]['tarifa'], 5000.0)
+        self.assertEqual(len(self.servidor.peticiones), 3)
+
+    def test_cache_cotizaciones(self):
+        '''
+        Pruebo la cache de cotizaciones en el cliente asincronico.
+        '''
+        self.andreani.CACHE_COTIZACIONES = andreani.CacheCotizaciones()
+
+        async def cotizar():
+            return [await self.andreani.cotizar_envio(
+                cp_destino="9410", peso="1", contrato=CONTRATO_ESTANDAR,
+                volumen="1") for i in range(3)]
+
+        cotizaciones = self.ejecutar(cotizar())
+        self.assertEqual(cotizaciones[0], cotizaciones[2])
+        self.assertEqual(len(self.servidor.peticiones), 1)
+
+    def test_ultimos_estados_distribucion(self):
+        '''
+        Pruebo la consulta asincronica del estado de muchas piezas.
+        '''
+        def consultar(peticion):
+            numeros = [e.text for e in peticion.iter(
+                "{urn:andreani:stub}NroAndreani")]
+            return {"Piezas": [{"Pieza": {"NroAndreani": numero,
+                                          "Estado": "Entregada"}}
+                               for numero in numeros]}
+        self.servidor.respuestas['ObtenerEstadoDistribucion'] = consultar
+        numeros = ["*%014d" % i for i in range(10)]
+        estados = self.ejecutar(
+            self.andreani.consulta_ultimos_estados_distribucion(
+                numeros, por_peticion=4))
+        self.assertEqual(len(self.servidor.peticiones), 3)
+        self.assertEqual(set(estados), set((n, None) for n in numeros))
+        self.assertEqual(estados[numeros[9], None]['estado'], "Entregada")
+
+    def test_anular_envios(self):
+        '''
+        Pruebo la anulacion asincronica de muchos envios.
+        '''
+        def anular(peticion):
+            numeros = [e.text for e in peticion.iter(
+                "{urn:andreani:stub}NumeroAndreani")]
+            return {"ResultadoAnularEnvios": [{"NumeroAndreani": numero}
+                                              for numero in numeros]}
+        self.servidor.respuestas['AnularEnvios'] = anular
+        numeros = ["*%014d" % i for i in range(5)]
+        resultados = self.ejecutar(
+            self.andreani.anular_envios(numeros, por_peticion=2))
+        self.assertEqual(len(self.servidor.peticiones), 3)
+        self.assertEqual(sorted(resultados), numeros)
+        self.assertEqual(resultados[numeros[4]]['numero_andreani'],
+                         numeros[4])
+
+    def test_anular_envios_errores(self):
+        '''
+        Pruebo que la anulacion asincronica asocie el rechazo de una
+        peticion solo a los envios que fallan.
+        '''
+        def anular(peticion):
+            numeros = [e.text for e in peticion.iter(
+                "{urn:andreani:stub}NumeroAndreani")]
+            if "error" in numeros:
+                return Fault("Envio inexistente.")
+            return {"ResultadoAnularEnvios": [{"NumeroAndreani": numero}
+                                              for numero in numeros]}
+        self.servidor.respuestas['AnularEnvios'] = anular
+        resultados = self.ejecutar(
+            self.andreani.anular_envios(["1", "error", "2"], por_peticion=3))
+        self.assertIsInstance(resultados["error"], andreani.APIError)
+        self.assertEqual(resultados["1"]['numero_andreani'], "1")
+        self.assertEqual(resultados["2"]['numero_andreani'], "2")
+
+    def test_datos_impresiones(self):
+        '''
+        Pruebo la consulta asincronica de datos de impresion de muchas
+        piezas.
+        '''
+        def consultar(peticion):
+            numeros = [e.text for e in peticion.iter(
+                "{urn:andreani:stub}string")]
+            return {"ResultadoConsultarDatosDeImpresion": [
+                {"NumeroAndreani": numero, "Categoria": "Estandar"}
+                for numero in numeros]}
+        self.servidor.respuestas['ConsultarDatosDeImpresion'] = consultar
+        numeros = ["*%014d" % i for i in range(5)]
+
+        async def consultar_todas():
+            return [r async for r in self.andreani.consultar_datos_impresiones(
+                numeros, por_peticion=2)]
+
+        datos = self.ejecutar(consultar_todas())
+        self.assertEqual(len(self.servidor.peticiones), 3)
+        self.assertEqual([numero for numero, d in datos], numeros)
+        self.assertEqual(datos[4][1]['numero_andreani'], numeros[4])
+
+    def test_datos_impresiones_errores(self):
+        '''
+        Pruebo que la consulta asincronica asocie el rechazo de una
+        peticion solo a las piezas que fallan.
+        '''
+        def consultar(peticion):
+            numeros = [e.text for e in peticion.iter(
+                "{urn:andreani:stub}string")]
+            if "error" in numeros:
+                return Fault("Envio inexistente.")
+            return {"ResultadoConsultarDatosDeImpresion": [
+                {"NumeroAndreani": numero, "Categoria": "Estandar"}
+                for numero in numeros]}
+        self.servidor.respuestas['ConsultarDatosDeImpresion'] = consultar
+
+        async def consultar_todas():
+            return dict([r async for r in
+                         self.andreani.consultar_datos_impresiones(
+                             ["1", "error", "2"], por_peticion=3)])
+
+        datos = self.ejecutar(consultar_todas())
+        self.assertIsInstance(datos["error"], andreani.APIError)
+        self.assertEqual(datos["1"]['numero_andreani'], "1")
+        self.assertEqual(datos["2"]['numero_andreani'], "2")
+
+    def test_confirmar_compras(self):
+        '''
+        Pruebo el alta asincronica de muchos envios.
+        '''
+        def confirmar(peticion):
+            numero = next(peticion.iter(
+                "{urn:andreani:stub}NumeroTransaccion")).text
+            return {"NumeroAndreani": "*" + numero}
+        self.servidor.respuestas['ConfirmarCompraConRecibo'] = confirmar
+        compras = [{'codigo_postal': '1754', 'peso': peso, 'volumen': '1',
+                    'numero_transaccion': str(i)}
+                   for i, peso in enumerate(["1", "0", "1"])]
+
+        async def confirmar_todas():
+            return dict([r async for r in
+                         self.andreani.confirmar_compras_datos_impresion(
+                             compras)])
+
+        resultados = self.ejecutar(confirmar_todas())
+        self.assertEqual(len(self.servidor.peticiones), 2)
+        self.assertEqual(resultados["2"], {"numero_andreani": "*2"})
+        self.assertIsInstance(resultados["1"], ValueError)
+
+    def test_diario(self):
+        '''
+        Pruebo que el alta asincronica se registre en el diario.
+        '''
+        self.servidor.respuestas['ConfirmarCompra'] = {
+            "NumeroAndreani": "*1"}
+        compra = {'codigo_postal': '1754', 'peso': '1', 'volumen': '1',
+                  'numero_transaccion': "1"}
+        with tempfile.TemporaryDirectory() as directorio:
+            self.andreani.DIARIO = andreani.Diario(
+                os.path.join(directorio, "altas.db"))
+
+            async def confirmar():
+                return [await self.andreani.confirmar_compra(**compra)
+                        for i in range(2)]
+
+            resultados = self.ejecutar(confirmar())
+            self.andreani.DIARIO.cerrar()
+        self.assertEqual(resultados, [{"numero_andreani": "*1"}] * 2)
+        self.assertEqual(len(self.servidor.peticiones), 1)
+
+    def test_iterar_envios(self):
+        '''
+        Pruebo el reporte asincronico de envios generados de a uno.
+        '''
+        self.servidor.respuestas['ReporteDeEnviosPendientesIngreso'] = {
+            "ResultadoReporteEnviosPendientesIngreso": [
+                {"NumeroAndreani": "*%014d" % i} for i in range(3)]}
+        envios = self.ejecutar(
+            self.andreani.iterar_envios_pendientes_ingreso())
+        self.assertEqual([e['numero_andreani'] for e in envios],
+                         ["*%014d" % i for i in range(3)])
+
+    def test_eventos(self):
+        '''
+        Pruebo los eventos de las peticiones asincronicas.
+        '''
+        eventos = []
+        self.andreani.OYENTES = (eventos.append,)
+        self.ejecutar(self.andreani.cotizar_envio(
+            peso=1, volumen=1, cp_destino="1754", contrato="AAAA00000"))
+        evento, = eventos
+        self.assertEqual(evento.operacion, "cotizar_envio")
+        self.assertEqual(evento.resultado, "ok")
+        self.assertEqual(list(evento.fases), ["wsdl", "cliente", "armado",
+                                              "red", "lectura",
+                                              "conversion"])
+
+    def test_xml_directo(self):
+        '''
+        Pruebo la lectura directa asincronica del XML de la respuesta.
+        '''
+        self.servidor.respuestas['ConsultarSucursales'] = {
+            "ResultadoConsultarSucursales": [{"Sucursal": 1}]}
+        self.andreani.XML_DIRECTO = True
+        self.assertEqual(
+            self.ejecutar(self.andreani.consultar_sucursales()),
+            [{"sucursal": 1}])
+
+    def test_trazabilidades(self):
+        '''
+        Pruebo la consulta asincronica de la trazabilidad de muchos envios.
+        '''
+        def consultar(peticion):
+            numero = peticion.find("{urn:andreani:stub}NroPieza/"
+                                   "{urn:andreani:stub}NroPieza").text
+            if numero == "error":
+                return Fault("Pieza inexistente")
+            return {"NumeroEnvio": numero}
+        self.servidor.respuestas[
+            'ObtenerTrazabilidadSinClienteCodificado'] = consultar
+
+        async def consultar_todas():
+            return [r async for r in self.andreani.consultar_trazabilidades(
+                ["1", "error", "3"], por_segundo=100)]
+
+        resultados = self.ejecutar(consultar_todas())
+        self.assertEqual(resultados[0], ("1", {"numero_envio": "1"}))
+        self.assertIsInstance(resultados[1][1], andreani.APIError)
+        self.assertEqual(resultados[2], ("3", {"numero_envio": "3"}))
+
+
+class TransporteAsincronoTests(TestCase):
+    '''
+    Set de pruebas del transporte HTTP asincronico.
+    '''
+    def setUp(self):
+        ServidorEco.conexiones = 0
+        ServidorEco.cortadas = []
+        self.servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                        ServidorEco)
+        threading.Thread(target=self.servidor.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(self.servidor.server_close)
+        self.addCleanup(self.servidor.shutdown)
+        self.url = "http://127.0.0.1:%d" % self.servidor.server_port
+
+    def test_keep_alive(self):
+        '''
+        Pruebo que las peticiones sucesivas reutilicen la conexion.
+        '''
+        async def enviar():
+            transporte = andreani.TransporteAsincrono()
+            respuestas = []
+            for i in range(3):
+                respuestas.append(await transporte.enviar(
+                    self.url + "/eco", b"hola %d" % i, {}))
+            await transporte.cerrar()
+            return respuestas
+
+        respuestas = asyncio.run(enviar())
+        self.assertEqual([body for status, reason, body in respuestas],
+                         [b"hola 0", b"hola 1", b"hola 2"])
+        self.assertEqual(ServidorEco.conexiones, 1)
+
+    def test_error_http(self):
+        '''
+        Pruebo que los errores HTTP se devuelvan con su status.
+        '''
+        async def enviar():
+            transporte = andreani.TransporteAsincrono()
+            respuesta = await transporte.enviar(self.url + "/error", b"x", {})
+            await transporte.cerrar()
+            return respuesta
+
+        status, reason, body = asyncio.run(enviar())
+        self.assertEqual(status, 500)
+        self.assertEqual(body, b"x")
+
+    def test_post_enviado_no_se_reintenta(self):
+        '''
+        Pruebo que un POST enviado por una conexion reutilizada no se
+        reenvie si el servidor la cierra sin responder.
+        '''
+        async def enviar():
+            transporte = andreani.TransporteAsincrono()
+            try:
+                await transporte.enviar(self.url + "/eco", b"uno", {})
+                await transporte.enviar(self.url + "/cortar", b"compra", {})
+            finally:
+                await transporte.cerrar()
+
+        with self.assertRaises((ConnectionError,
+                                asyncio.IncompleteReadError)):
+            asyncio.run(enviar())
+        self.assertEqual(ServidorEco.cortadas, [b"compra"])
+
+
 class IntegrationTests(TestCase):
     '''
     Pruebas de integración del módulo.